@@ -1,5 +1,6 @@
 #include <ESP8266WiFi.h>
 #include <ESP8266HTTPClient.h>
+#include <EEPROM.h>
 #include "HX711.h"
 
 // HX711 setup (DOUT, SCK)
@@ -17,9 +18,26 @@ const char* serverURL = "https://caretraxserver.up.railway.app";
 bool isStopped = false;
 String inputString = "";
 
+// Reading sequence numbers: the server drops retried readings it already has.
+// bootCount lives in EEPROM so sequences keep increasing across reboots.
+String deviceId;
+uint32_t bootCount = 0;
+uint32_t readingSeq = 0;
+const int MAX_SEND_ATTEMPTS = 3;
+// A reading the server has not acknowledged yet; it keeps its seq and is
+// sent again before the next measurement
+String unsentPayload = "";
+
 void setup() {
   Serial.begin(115200);
 
+  EEPROM.begin(sizeof(bootCount));
+  EEPROM.get(0, bootCount);
+  bootCount++;
+  EEPROM.put(0, bootCount);
+  EEPROM.commit();
+  deviceId = WiFi.macAddress();
+
   // Connect to WiFi
   WiFi.begin(ssid, password);
   Serial.print("Connecting to Wi-Fi");
@@ -68,38 +86,63 @@ void loop() {
   }
 
   if (!isStopped) {
-    // Measure weight
-    scale.set_scale();
-    scale.tare();
-    scale.set_scale(calibration_factor);
-    weight = scale.get_units(5);
+    if (unsentPayload.length() == 0) {
+      // Measure weight
+      scale.set_scale();
+      scale.tare();
+      scale.set_scale(calibration_factor);
+      weight = scale.get_units(5);
+
+      Serial.print("📊 Measured Weight: ");
+      Serial.print(weight);
+      Serial.println(" KG");
 
-    Serial.print("📊 Measured Weight: ");
-    Serial.print(weight);
-    Serial.println(" KG");
+      unsentPayload = "{\"weight\":" + String(weight, 3) +
+                      ",\"device_id\":\"" + deviceId + "\"" +
+                      ",\"boot\":" + String(bootCount) +
+                      ",\"seq\":" + String(readingSeq) + "}";
+    } else {
+      Serial.println("🔁 Resending the last unacknowledged reading");
+    }
 
     if (WiFi.status() == WL_CONNECTED) {
-      WiFiClient client;
-      HTTPClient http;
-      
-      // Use HTTPS for Railway (CHANGED FROM HTTP)
-      http.begin(client, serverURL);
-      http.addHeader("Content-Type", "application/json");
-
-      String payload = "{\"weight\":" + String(weight, 3) + "}";
-      int httpResponseCode = http.POST(payload);
-
-      if (httpResponseCode > 0) {
-        Serial.print("✅ Data sent successfully to Railway. Response: ");
-        Serial.println(httpResponseCode);
-        String response = http.getString();
-        Serial.print("📡 Server response: ");
-        Serial.println(response);
-      } else {
-        Serial.print("❌ Error sending data: ");
-        Serial.println(http.errorToString(httpResponseCode).c_str());
+      // Retrying with the same seq is safe: a reading that did reach the
+      // server before the timeout is reported as a duplicate, not stored twice.
+      // Only a 2xx (200 stored, 202 spilled) means the server has it.
+      for (int attempt = 1; attempt <= MAX_SEND_ATTEMPTS; attempt++) {
+        WiFiClient client;
+        HTTPClient http;
+
+        // Use HTTPS for Railway (CHANGED FROM HTTP)
+        http.begin(client, serverURL);
+        http.addHeader("Content-Type", "application/json");
+
+        int httpResponseCode = http.POST(unsentPayload);
+
+        if (httpResponseCode >= 200 && httpResponseCode < 300) {
+          Serial.print("✅ Data sent successfully to Railway. Response: ");
+          Serial.println(httpResponseCode);
+          String response = http.getString();
+          Serial.print("📡 Server response: ");
+          Serial.println(response);
+          http.end();
+          unsentPayload = "";
+          readingSeq++;
+          break;
+        }
+
+        Serial.print("❌ Error sending data (attempt ");
+        Serial.print(attempt);
+        Serial.print("): ");
+        if (httpResponseCode > 0) {
+          Serial.print("HTTP ");
+          Serial.println(httpResponseCode);
+        } else {
+          Serial.println(http.errorToString(httpResponseCode).c_str());
+        }
+        http.end();
+        delay(200 * attempt);
       }
-      http.end();
     } else {
       Serial.println("📶 WiFi not connected. Data not sent.");
       // Try to reconnect
@@ -0,0 +1,116 @@
+"""Admission control for database-backed requests.
+
+Every request is sorted into a route class (ingest, reads, auth, ...). Each
+class may run at most `limit` requests at once, all classes together at
+most `capacity`, and at most `queue` more may wait `wait_s` seconds for a
+slot. Freed slots go to the highest-priority waiters first, so scale uploads
+keep flowing while dashboard reads are shed.
+
+A request that cannot be admitted is rejected straight away (503 with
+Retry-After) instead of tying up a thread in get_db_connection(); when the
+database slows down, the queues fill and the low-priority classes back off
+before the ingest path does.
+
+Limits are per process; in pre-fork mode each worker has its own.
+"""
+import threading
+import time
+from functools import wraps
+
+
+class RouteClass:
+    def __init__(self, name, priority, limit, queue, wait_s, retry_after_s):
+        self.name = name
+        self.priority = priority    # higher is served first
+        self.limit = limit
+        self.queue = queue
+        self.wait_s = wait_s
+        self.retry_after_s = retry_after_s
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+
+class AdmissionController:
+    def __init__(self, capacity, route_classes):
+        self.capacity = capacity
+        self.classes = {c.name: c for c in route_classes}
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def _can_run(self, route_class):
+        if route_class.in_flight >= route_class.limit or self.in_flight >= self.capacity:
+            return False
+        # Waiters of a higher class get freed slots first
+        return not any(c.waiting for c in self.classes.values() if c.priority > route_class.priority)
+
+    def acquire(self, name):
+        """Take a slot for the class, waiting up to its wait_s; False if shed"""
+        route_class = self.classes[name]
+        with self.condition:
+            if not self._can_run(route_class):
+                if route_class.waiting >= route_class.queue:
+                    route_class.rejected += 1
+                    return False
+                deadline = time.monotonic() + route_class.wait_s
+                route_class.waiting += 1
+                try:
+                    while not self._can_run(route_class):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            route_class.rejected += 1
+                            return False
+                        self.condition.wait(remaining)
+                finally:
+                    route_class.waiting -= 1
+                    # A lower class may have been held back by this waiter
+                    self.condition.notify_all()
+            route_class.in_flight += 1
+            route_class.admitted += 1
+            self.in_flight += 1
+            return True
+
+    def release(self, name):
+        with self.condition:
+            self.classes[name].in_flight -= 1
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def guard(self, classify):
+        """Decorate a do_GET/do_POST method.
+
+        classify(handler) names the request's route class, or None to let it
+        through unmetered. Shed requests go to handler.shed(route_class).
+        """
+        def decorator(method):
+            @wraps(method)
+            def wrapper(handler):
+                name = classify(handler)
+                if name is None:
+                    return method(handler)
+                if not self.acquire(name):
+                    return handler.shed(self.classes[name])
+                try:
+                    return method(handler)
+                finally:
+                    self.release(name)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "capacity": self.capacity,
+                "inFlight": self.in_flight,
+                "classes": {
+                    c.name: {
+                        "limit": c.limit,
+                        "inFlight": c.in_flight,
+                        "queued": c.waiting,
+                        "admitted": c.admitted,
+                        "rejected": c.rejected,
+                    }
+                    for c in self.classes.values()
+                },
+            }
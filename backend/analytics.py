@@ -0,0 +1,197 @@
+"""Drip consumption analytics.
+
+Readings for a time window are loaded with one query (one row of arrays per
+patient) and flattened into NumPy arrays. They are cut into bag segments at
+drip-record start times and at any unrecorded refill (a rise of more than
+REFILL_THRESHOLD_KG), and every quantity is then computed for all patients
+at once:
+
+- volume: the net drop in weight of each bag within each group, so sensor
+  noise and knocks on the scale cancel out rather than add up;
+- hours: the time covered by those intervals, and rate = volume / hours;
+- bags: distinct segments that drained in the group; bag lifetime is the
+  span of readings of each segment that ended inside the window (a bag hung
+  before the window starts is measured from the window's first reading).
+
+Intervals are attributed to the group (patient, ward or shift) of their
+later reading. Results for windows that ended more than CLOSED_AFTER_S ago
+cannot change any more and are cached.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from live_state import REFILL_THRESHOLD_KG
+
+GROUPS = ('shift', 'ward', 'patient')
+
+# Shift start hours, e.g. day 07-15, evening 15-23, night 23-07
+DEFAULT_SHIFT_STARTS = (7, 15, 23)
+
+CLOSED_AFTER_S = 600
+CACHE_SIZE = 128
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def load(cursor, start, end, ward=None):
+    """Readings and drip starts for the window as (patients, wards, t, w, p, drip_t, drip_p).
+
+    Timestamps are naive local times; extract(epoch) gives their wall-clock
+    seconds, which is all the shift arithmetic needs.
+    """
+    cursor.execute("""
+        SELECT w.patient_id, p.ward,
+               array_agg(extract(epoch FROM w.timestamp)::float8 ORDER BY w.timestamp),
+               array_agg(w.weight ORDER BY w.timestamp)
+        FROM weight_data w
+        JOIN patients p ON p.id = w.patient_id
+        WHERE w.timestamp >= %s AND w.timestamp < %s AND (%s IS NULL OR p.ward = %s)
+        GROUP BY w.patient_id, p.ward
+        ORDER BY w.patient_id
+    """, (start, end, ward, ward))
+    rows = cursor.fetchall()
+    patients = [row[0] for row in rows]
+    wards = [row[1] for row in rows]
+    t = np.concatenate([np.asarray(row[2], dtype=np.float64) for row in rows]) if rows else np.empty(0)
+    w = np.concatenate([np.asarray(row[3], dtype=np.float64) for row in rows]) if rows else np.empty(0)
+    p = np.repeat(np.arange(len(rows)), [len(row[2]) for row in rows])
+
+    cursor.execute("""
+        SELECT patient_id, extract(epoch FROM start_time)::float8
+        FROM drip_records
+        WHERE patient_id = ANY(%s) AND start_time < %s AND (end_time IS NULL OR end_time >= %s)
+    """, (patients, end, start))
+    index = {patient_id: i for i, patient_id in enumerate(patients)}
+    drips = cursor.fetchall()
+    drip_p = np.array([index[row[0]] for row in drips], dtype=np.int64)
+    drip_t = np.array([row[1] for row in drips], dtype=np.float64)
+    return patients, wards, t, w, p, drip_t, drip_p
+
+
+def segment(t, w, p, drip_t, drip_p):
+    """Start-of-segment flags and segment numbers for readings sorted by (p, t)"""
+    n = len(t)
+    boundary = np.ones(n, dtype=bool)
+    if n > 1:
+        same_patient = p[1:] == p[:-1]
+        refill = np.diff(w) > REFILL_THRESHOLD_KG
+
+        # Number of the patient's drips started at or before each reading;
+        # a change between neighbours means a replacement in between
+        order = np.lexsort((drip_t, drip_p))
+        keys = np.stack([drip_p[order], drip_t[order]])
+        started = np.searchsorted(keys[0] * 1e11 + keys[1], p * 1e11 + t, side='right')
+        replaced = started[1:] != started[:-1]
+
+        boundary[1:] = ~same_patient | refill | replaced
+    return boundary, np.cumsum(boundary) - 1
+
+
+def shift_starts_of(t, shift_starts):
+    """Wall-clock epoch seconds of the shift each timestamp falls in"""
+    starts = np.asarray(sorted(shift_starts), dtype=np.float64) * 3600
+    day, second = np.divmod(t, 86400)
+    shift = np.searchsorted(starts, second, side='right') - 1
+    # Before the first start of the day: still the previous night's shift
+    day = np.where(shift < 0, day - 1, day)
+    return day * 86400 + starts[shift]     # index -1 is the last shift
+
+
+def consumption(patients, wards, t, w, p, drip_t, drip_p, group, shift_starts=DEFAULT_SHIFT_STARTS):
+    """Per-group consumption as a list of dicts, sorted by group key"""
+    if len(t) < 2:
+        return []
+    boundary, seg = segment(t, w, p, drip_t, drip_p)
+
+    # One interval per pair of consecutive readings of the same bag
+    same_bag = ~boundary[1:]
+    drop_ml = np.where(same_bag, w[:-1] - w[1:], 0.0) * 1000
+    seconds = np.where(same_bag, np.diff(t), 0.0)
+    later = np.arange(1, len(t))
+
+    if group == 'patient':
+        labels = np.array(patients, dtype=object)
+        raw_keys = p[later]
+    elif group == 'ward':
+        ward_names, ward_of_patient = np.unique(np.array([ward or '' for ward in wards], dtype=object), return_inverse=True)
+        labels = ward_names
+        raw_keys = ward_of_patient[p[later]]
+    else:
+        raw_keys = shift_starts_of(t[later], shift_starts)
+        labels = None
+
+    keys, inverse = np.unique(raw_keys, return_inverse=True)
+    groups = len(keys)
+    hours = np.bincount(inverse, weights=seconds, minlength=groups) / 3600
+
+    # Net drain of each bag within each group: noise and knocks cancel out
+    # instead of adding up, and a net rise counts as nothing
+    segments = int(seg[-1]) + 1
+    pairs, pair_index = np.unique(inverse.astype(np.int64) * segments + seg[later], return_inverse=True)
+    pair_volume = np.clip(np.bincount(pair_index, weights=drop_ml), 0, None)
+    pair_group = pairs // segments
+    volume = np.bincount(pair_group, weights=pair_volume, minlength=groups)
+    bags = np.bincount(pair_group[pair_volume > 0], minlength=groups)
+    patient_pairs = np.unique(inverse.astype(np.int64) * len(patients) + p[later])
+    patient_counts = np.bincount(patient_pairs // len(patients), minlength=groups)
+
+    # A bag ended if another segment of the same patient follows it
+    first = np.flatnonzero(boundary)
+    last = np.append(first[1:] - 1, len(t) - 1)
+    ended = np.append(p[first[1:]] == p[first[:-1]], False)
+    lifetime_h = (t[last] - t[first]) / 3600
+    ended_group = inverse[np.maximum(last[ended] - 1, 0)]
+    valid = last[ended] > first[ended]
+    ended_count = np.bincount(ended_group[valid], minlength=groups)
+    ended_hours = np.bincount(ended_group[valid], weights=lifetime_h[ended][valid], minlength=groups)
+
+    results = []
+    for i, key in enumerate(keys):
+        if labels is not None:
+            label = labels[key]
+        else:
+            label = (EPOCH + timedelta(seconds=float(key))).isoformat()
+        results.append({
+            "key": label,
+            "volumeMl": round(float(volume[i]), 1),
+            "hours": round(float(hours[i]), 2),
+            "rateMlPerHour": round(float(volume[i] / hours[i]), 1) if hours[i] > 0 else None,
+            "bags": int(bags[i]),
+            "bagsCompleted": int(ended_count[i]),
+            "avgBagHours": round(float(ended_hours[i] / ended_count[i]), 2) if ended_count[i] else None,
+            "patients": int(patient_counts[i]),
+        })
+    return results
+
+
+class WindowCache:
+    """LRU cache for results of closed windows; open windows are never cached"""
+
+    def __init__(self, size=CACHE_SIZE, closed_after_s=CLOSED_AFTER_S):
+        self.size = size
+        self.closed_after_s = closed_after_s
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def closed(self, end):
+        return end <= datetime.fromtimestamp(time.time() - self.closed_after_s)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, end, value):
+        if not self.closed(end):
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
@@ -0,0 +1,392 @@
+"""Columnar archive of weight history for discharged patients.
+
+Once a patient has been discharged for ARCHIVE_AFTER_DAYS, the archiver
+moves their weight_data rows up to discharged_at into a chunk file under
+ARCHIVE_DIR/<patient_id>/ and deletes them from the table. A file holds the
+readings column by column in chunks of CHUNK_POINTS rows:
+
+    header   b'CTXA' | version (uint8) | 3 pad bytes
+    chunks   timestamps | weights | seqs | devices, each a run of
+             zigzag varints:
+               timestamps  microseconds since 1970-01-01 (wall clock):
+                           first value, first delta, then delta-of-deltas,
+                           which are ~0 for a scale reporting on a timer
+               weights     multiples of the file's weight step (0.1 g by
+                           default), first value then deltas
+               seqs        seq + 1 (0 for none), first value then deltas
+               devices     (index into the file's device list, run length)
+    footer   one INDEX record per chunk (offset, time range, row count,
+             byte length of each column) | JSON metadata
+    trailer  footer offset (uint64) | chunk count (uint32)
+             | metadata length (uint32) | b'CTXA'
+
+Readers mmap the file, view the index and each chunk's bytes as NumPy
+arrays without copying, skip chunks outside the requested time range and
+decode the rest with vectorized varint, zigzag and cumsum passes.
+
+The weight_archive table is the catalog: a file counts only once its
+catalog row and the deletion of its rows have committed together, so a
+crash mid-archive leaves an unreferenced file behind and no reading is
+ever read twice or lost. Weights come back rounded to the weight step;
+timestamps, devices and sequence numbers come back exactly.
+"""
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import numpy as np
+
+MAGIC = b'CTXA'
+VERSION = 1
+HEADER = struct.Struct('<4sB3x')
+TRAILER = struct.Struct('<QII4s')
+INDEX = np.dtype([
+    ('offset', '<u8'), ('t_first', '<i8'), ('t_last', '<i8'), ('count', '<u4'),
+    ('t_bytes', '<u4'), ('w_bytes', '<u4'), ('seq_bytes', '<u4'), ('device_bytes', '<u4'),
+])
+
+CHUNK_POINTS = 4096
+WEIGHT_STEP_KG = 0.0001
+
+# History reads look this far past the requested range for the points on
+# either side (the compressor stores one at least every few minutes)
+NEIGHBOUR_MARGIN = timedelta(hours=1)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_micros(timestamp):
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def zigzag(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def unzigzag(values):
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+def varint_encode(values):
+    """Little-endian base-128 encoding of a uint64 array"""
+    lengths = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        lengths += rest > 0
+        rest >>= np.uint64(7)
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    for k in range(int(lengths.max(initial=0))):
+        more = lengths > k
+        byte = (values[more] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        out[starts[more] + k] = byte | (lengths[more] > k + 1).astype(np.uint64) << np.uint64(7)
+    return out.tobytes()
+
+
+def varint_decode(buf):
+    """Decode a uint8 array of back-to-back varints into uint64"""
+    if not len(buf):
+        return np.empty(0, dtype=np.uint64)
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    position = np.arange(len(buf)) - np.repeat(starts, ends - starts + 1)
+    payload = (buf & 0x7f).astype(np.uint64) << (position * 7).astype(np.uint64)
+    return np.add.reduceat(payload, starts)
+
+
+def delta(values):
+    return np.concatenate((values[:1], np.diff(values)))
+
+
+def encode_chunk(t, q, seq, device):
+    """Column streams of one chunk; t in microseconds, q in weight steps"""
+    deltas = delta(t)
+    runs = np.flatnonzero(np.diff(device)) + 1
+    run_starts = np.concatenate(([0], runs))
+    run_lengths = np.diff(np.append(run_starts, len(device)))
+    pairs = np.column_stack((device[run_starts], run_lengths)).ravel()
+    return [
+        varint_encode(zigzag(np.concatenate((deltas[:1], delta(deltas[1:]))))),
+        varint_encode(zigzag(delta(q))),
+        varint_encode(zigzag(delta(seq))),
+        varint_encode(pairs.astype(np.uint64)),
+    ]
+
+
+def decode_chunk(t_buf, w_buf, seq_buf, device_buf):
+    stream = unzigzag(varint_decode(t_buf))
+    t = np.cumsum(np.concatenate((stream[:1], np.cumsum(stream[1:]))))
+    q = np.cumsum(unzigzag(varint_decode(w_buf)))
+    seq = np.cumsum(unzigzag(varint_decode(seq_buf)))
+    pairs = varint_decode(device_buf).astype(np.int64).reshape(-1, 2)
+    device = np.repeat(pairs[:, 0], pairs[:, 1])
+    return t, q, seq, device
+
+
+def write_file(path, patient_id, t, weights, seqs, device_ids, weight_step=WEIGHT_STEP_KG, chunk_points=CHUNK_POINTS):
+    """Write readings sorted by timestamp to path (atomically); returns its size.
+
+    t is in microseconds; seqs and device_ids may contain None.
+    """
+    devices = sorted(set(device_ids), key=lambda d: (d is not None, d or ''))
+    device_index = {device_id: i for i, device_id in enumerate(devices)}
+    q = np.rint(np.asarray(weights, dtype=np.float64) / weight_step).astype(np.int64)
+    seq = np.array([0 if s is None else s + 1 for s in seqs], dtype=np.int64)
+    device = np.array([device_index[d] for d in device_ids], dtype=np.int64)
+
+    index = np.zeros((len(t) + chunk_points - 1) // chunk_points, dtype=INDEX)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION))
+        for i, start in enumerate(range(0, len(t), chunk_points)):
+            end = start + chunk_points
+            columns = encode_chunk(t[start:end], q[start:end], seq[start:end], device[start:end])
+            index[i] = (f.tell(), t[start], t[min(end, len(t)) - 1], min(end, len(t)) - start, *map(len, columns))
+            for column in columns:
+                f.write(column)
+        footer_offset = f.tell()
+        meta = json.dumps({"patientId": patient_id, "weightStep": weight_step, "devices": devices}).encode()
+        f.write(index.tobytes())
+        f.write(meta)
+        f.write(TRAILER.pack(footer_offset, len(index), len(meta), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.rename(tmp, path)
+    directory = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+    return size
+
+
+class ArchiveFile:
+    """A memory-mapped archive file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = HEADER.unpack_from(self.mm, 0)
+        footer_offset, chunks, meta_len, trailer_magic = TRAILER.unpack_from(self.mm, len(self.mm) - TRAILER.size)
+        if magic != MAGIC or trailer_magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(f"{path} is not a weight archive file")
+        self.index = np.frombuffer(self.mm, dtype=INDEX, count=chunks, offset=footer_offset)
+        meta_offset = footer_offset + chunks * INDEX.itemsize
+        self.meta = json.loads(self.mm[meta_offset:meta_offset + meta_len])
+
+    def chunks(self, start_us=None, end_us=None):
+        """(t, weight, seq, device_id index) arrays for each chunk overlapping the range, in order"""
+        selected = np.ones(len(self.index), dtype=bool)
+        if start_us is not None:
+            selected &= self.index['t_last'] >= start_us
+        if end_us is not None:
+            selected &= self.index['t_first'] <= end_us
+        step = self.meta["weightStep"]
+        decimals = max(0, math.ceil(-math.log10(step)))
+        for chunk in self.index[selected]:
+            offset = int(chunk['offset'])
+            buffers = []
+            for name in ('t_bytes', 'w_bytes', 'seq_bytes', 'device_bytes'):
+                length = int(chunk[name])
+                buffers.append(np.frombuffer(self.mm, dtype=np.uint8, count=length, offset=offset))
+                offset += length
+            t, q, seq, device = decode_chunk(*buffers)
+            del buffers
+            yield t, np.round(q * step, decimals), seq, device
+
+    def read(self, start_us=None, end_us=None):
+        """(t, weight, seq, device_id index) arrays for chunks overlapping the range"""
+        columns = [[], [], [], []]
+        for values in self.chunks(start_us, end_us):
+            for column, value in zip(columns, values):
+                column.append(value)
+        t, weight, seq, device = (np.concatenate(c) if c else np.empty(0, dtype=np.int64) for c in columns)
+        return t, weight.astype(np.float64), seq, device
+
+    def close(self):
+        self.index = None
+        try:
+            self.mm.close()
+        except BufferError:
+            pass    # a caller still holds a view; the map goes with it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Archive:
+    def __init__(self, directory, weight_step=WEIGHT_STEP_KG, chunk_points=CHUNK_POINTS):
+        self.directory = directory
+        self.weight_step = weight_step
+        self.chunk_points = chunk_points
+        os.makedirs(directory, exist_ok=True)
+
+    def relative_path(self, patient_id, first_us, last_us):
+        return os.path.join(quote(patient_id, safe=''), f"{first_us:020d}-{last_us:020d}.wca")
+
+    def archive_patient(self, conn, patient_id, discharged_at):
+        """Move one patient's readings up to discharge into a file; returns (rows, bytes)"""
+        cursor = conn.cursor()
+        # Another worker or node may be archiving the same patient
+        cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", (f"weight_archive:{patient_id}",))
+        if not cursor.fetchone()[0]:
+            conn.rollback()
+            return 0, 0
+        cursor.execute("""
+            SELECT id, timestamp, weight, device_id, seq FROM weight_data
+            WHERE patient_id = %s AND timestamp <= %s
+            ORDER BY timestamp, id
+        """, (patient_id, discharged_at))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            return 0, 0
+
+        t = np.array([to_micros(row[1]) for row in rows], dtype=np.int64)
+        relative = self.relative_path(patient_id, t[0], t[-1])
+        path = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = write_file(path, patient_id, t, [row[2] for row in rows], [row[4] for row in rows],
+                          [row[3] for row in rows], self.weight_step, self.chunk_points)
+
+        # The catalog row and the deletion commit together
+        cursor.execute("""
+            INSERT INTO weight_archive (patient_id, path, first_timestamp, last_timestamp, row_count, bytes)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (path) DO UPDATE SET row_count = EXCLUDED.row_count, bytes = EXCLUDED.bytes
+        """, (patient_id, relative, rows[0][1], rows[-1][1], len(rows), size))
+        cursor.execute("DELETE FROM weight_data WHERE id = ANY(%s)", ([row[0] for row in rows],))
+        conn.commit()
+        cursor.close()
+        return len(rows), size
+
+    def run(self, connect, discharged_before):
+        """Archive every patient discharged before the given time; returns (patients, rows, bytes)"""
+        conn = connect()
+        if conn is None:
+            return 0, 0, 0
+        totals = [0, 0, 0]
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT p.id, p.discharged_at FROM patients p
+                WHERE p.discharged_at < %s
+                  AND EXISTS (SELECT 1 FROM weight_data w WHERE w.patient_id = p.id AND w.timestamp <= p.discharged_at)
+                ORDER BY p.discharged_at
+            """, (discharged_before,))
+            patients = cursor.fetchall()
+            conn.rollback()
+            for patient_id, discharged_at in patients:
+                try:
+                    rows, size = self.archive_patient(conn, patient_id, discharged_at)
+                except Exception:
+                    conn.rollback()
+                    raise
+                if rows:
+                    totals[0] += 1
+                    totals[1] += rows
+                    totals[2] += size
+        finally:
+            conn.close()
+        return tuple(totals)
+
+    def files(self, cursor, patient_id, start=None, end=None):
+        """Catalogued files of a patient overlapping [start, end], oldest first"""
+        cursor.execute("""
+            SELECT path FROM weight_archive
+            WHERE patient_id = %s
+              AND (%s::timestamp IS NULL OR last_timestamp >= %s)
+              AND (%s::timestamp IS NULL OR first_timestamp <= %s)
+            ORDER BY first_timestamp
+        """, (patient_id, start, start, end, end))
+        return [os.path.join(self.directory, row[0]) for row in cursor.fetchall()]
+
+    def read(self, cursor, patient_id, start=None, end=None):
+        """(t, weight, seq, device_id) for a patient's archived readings in [start, end]"""
+        start_us = to_micros(start) if start is not None else None
+        end_us = to_micros(end) if end is not None else None
+        parts = []
+        for path in self.files(cursor, patient_id, start, end):
+            with ArchiveFile(path) as f:
+                t, weight, seq, device = f.read(start_us, end_us)
+                keep = np.ones(len(t), dtype=bool)
+                if start_us is not None:
+                    keep &= t >= start_us
+                if end_us is not None:
+                    keep &= t <= end_us
+                devices = np.array(f.meta["devices"], dtype=object)
+                parts.append((t[keep], weight[keep], seq[keep], devices[device[keep]]))
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+        t, weight, seq, device = (np.concatenate(column) for column in zip(*parts))
+        order = np.argsort(t, kind='stable')
+        return t[order], weight[order], seq[order], device[order]
+
+    def rows(self, cursor, patient_id, start=None, end=None):
+        """Archived readings as (patient_id, timestamp, weight, device_id, seq) tuples, by timestamp.
+
+        Rows are decoded one chunk at a time as they are consumed, so an
+        export holds at most one chunk per file in memory.
+        """
+        start_us = to_micros(start) if start is not None else None
+        end_us = to_micros(end) if end is not None else None
+        paths = self.files(cursor, patient_id, start, end)
+        return heapq.merge(*(self._file_rows(path, patient_id, start_us, end_us) for path in paths),
+                           key=lambda row: row[1])
+
+    def _file_rows(self, path, patient_id, start_us, end_us):
+        with ArchiveFile(path) as f:
+            devices = f.meta["devices"]
+            for t, weight, seq, device in f.chunks(start_us, end_us):
+                keep = np.ones(len(t), dtype=bool)
+                if start_us is not None:
+                    keep &= t >= start_us
+                if end_us is not None:
+                    keep &= t <= end_us
+                timestamps = t[keep].astype('datetime64[us]').tolist()
+                for timestamp, w, s, d in zip(timestamps, weight[keep].tolist(), seq[keep].tolist(), device[keep].tolist()):
+                    yield patient_id, timestamp, w, devices[d], None if s == 0 else s - 1
+
+    def points(self, cursor, patient_id, start, end):
+        """Archived (timestamp, weight) points in [start, end] plus the nearest one on either side"""
+        t, weight, _, _ = self.read(cursor, patient_id, start - NEIGHBOUR_MARGIN, end + NEIGHBOUR_MARGIN)
+        lo = max(int(np.searchsorted(t, to_micros(start), side='left')) - 1, 0)
+        hi = int(np.searchsorted(t, to_micros(end), side='right')) + 1
+        return list(zip(t[lo:hi].astype('datetime64[us]').tolist(), weight[lo:hi].tolist()))
+
+
+def merge_archived(rows, archived_rows):
+    """Merge archived readings into export rows ordered by (patient_id, timestamp).
+
+    The export query adds a marker row (timestamp NULL, sorted first) for
+    each patient with archived readings; archived_rows(patient_id) supplies
+    them and they are interleaved with that patient's rows by timestamp.
+    """
+    pending, head = iter(()), None
+    for row in rows:
+        if row[1] is None:
+            if head is not None:
+                yield head
+            yield from pending
+            pending = iter(archived_rows(row[0]))
+            head = next(pending, None)
+            continue
+        while head is not None and (head[0] != row[0] or head[1] <= row[1]):
+            yield head
+            head = next(pending, None)
+        yield row
+    if head is not None:
+        yield head
+    yield from pending
@@ -0,0 +1,177 @@
+"""Non-blocking log pipeline for the request path.
+
+event() puts a record on a bounded queue and returns; a writer thread does
+the formatting and the (possibly slow) write to stdout. When the queue is
+full the record is dropped and counted, so a stalled log collector slows
+the log down, never ingest.
+
+The writer applies, per message kind:
+
+- sampling: LOG_SAMPLE_RATES="reading=0.01" keeps 1% of reading lines;
+- rate limiting: LOG_RATE_LIMITS="reading=0.2,db_error=1" allows that many
+  lines per second (token bucket, bursts up to BURST lines);
+- summaries: every LOG_SUMMARY_INTERVAL_S seconds one line per kind that has
+  a summary template, e.g. "412 readings from 38 device(s) in the last 60s",
+  plus a count of the lines that sampling and rate limiting held back.
+
+LOG_FORMAT=json writes one JSON object per line instead of plain text.
+"""
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+QUEUE_SIZE = 10000
+BURST = 5
+
+DEFAULT_RATE_LIMITS = {'reading': 0.2, 'spilled': 1, 'db_error': 1}
+
+SUMMARIES = {
+    'reading': "📈 {readings} readings from {devices} device(s) in the last {seconds:.0f}s, {points} point(s) stored",
+    'spilled': "💾 {readings} reading(s) from {devices} device(s) spilled to the local log in the last {seconds:.0f}s",
+    'db_error': "❌ {count} database error(s) in the last {seconds:.0f}s",
+}
+
+
+def parse_rates(value, defaults=None):
+    """Parse "kind=number,kind=number" into a dict"""
+    rates = dict(defaults or {})
+    for item in filter(None, (value or '').split(',')):
+        kind, _, number = item.partition('=')
+        rates[kind.strip()] = float(number)
+    return rates
+
+
+class AsyncLog:
+    def __init__(self, stream=None, json_format=False, rate_limits=None, sample_rates=None,
+                 summary_interval_s=60, queue_size=QUEUE_SIZE):
+        self.stream = stream
+        self.json_format = json_format
+        self.rate_limits = rate_limits or {}
+        self.sample_rates = sample_rates or {}
+        self.summary_interval_s = summary_interval_s
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            json_format=os.getenv('LOG_FORMAT', 'text') == 'json',
+            rate_limits=parse_rates(os.getenv('LOG_RATE_LIMITS'), DEFAULT_RATE_LIMITS),
+            sample_rates=parse_rates(os.getenv('LOG_SAMPLE_RATES')),
+            summary_interval_s=float(os.getenv('LOG_SUMMARY_INTERVAL_S', '60')),
+        )
+
+    def _reset(self):
+        # A forked worker starts its own queue and writer thread
+        self.queue = queue.Queue(self.queue_size)
+        self.thread = None
+        self.dropped = 0
+
+    def event(self, kind, message, **fields):
+        """Log message.format(**fields) as a `kind` record; never blocks"""
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait((time.time(), kind, message, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        tokens = {}
+        refilled = time.monotonic()
+        totals = {}
+        held_back = {}
+        window_start = time.monotonic()
+        while True:
+            timeout = max(0.0, window_start + self.summary_interval_s - time.monotonic())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+
+            if record is not None:
+                timestamp, kind, message, fields = record
+                self._aggregate(totals.setdefault(kind, {"count": 0, "devices": set()}), fields)
+
+                # Refill every kind's bucket, then spend a token if sampled in
+                now = time.monotonic()
+                for limited, rate in self.rate_limits.items():
+                    tokens[limited] = min(BURST, tokens.get(limited, BURST) + (now - refilled) * rate)
+                refilled = now
+                sampled = random.random() < self.sample_rates.get(kind, 1.0)
+                if sampled and kind in self.rate_limits:
+                    sampled = tokens[kind] >= 1
+                    if sampled:
+                        tokens[kind] -= 1
+                if sampled:
+                    self._write(timestamp, kind, message, fields)
+                else:
+                    held_back[kind] = held_back.get(kind, 0) + 1
+
+            if time.monotonic() - window_start >= self.summary_interval_s:
+                seconds = time.monotonic() - window_start
+                self._summarise(totals, held_back, seconds)
+                totals, held_back = {}, {}
+                window_start = time.monotonic()
+
+    def _aggregate(self, total, fields):
+        total["count"] += 1
+        for key, value in fields.items():
+            if key == 'device':
+                total["devices"].add(value)
+            elif isinstance(value, int) and not isinstance(value, bool):
+                total[key] = total.get(key, 0) + value
+
+    def _summarise(self, totals, held_back, seconds):
+        now = time.time()
+        for kind, total in totals.items():
+            template = SUMMARIES.get(kind)
+            if template is None:
+                continue
+            fields = dict(total, devices=len(total["devices"]), seconds=seconds)
+            fields.setdefault('readings', total["count"])
+            fields.setdefault('points', 0)
+            summary = {k: round(v, 3) if isinstance(v, float) else v for k, v in fields.items()}
+            self._write(now, f'{kind}_summary', template, summary)
+
+        dropped, self.dropped = self.dropped, 0
+        if held_back or dropped:
+            detail = ", ".join(f"{kind}={n}" for kind, n in sorted(held_back.items()))
+            self._write(now, 'log_summary', "🔇 {suppressed} log line(s) held back ({detail}), {dropped} dropped",
+                        {"suppressed": sum(held_back.values()), "detail": detail or "none", "dropped": dropped})
+
+    def _write(self, timestamp, kind, message, fields):
+        try:
+            text = message.format(**fields)
+        except (KeyError, IndexError, ValueError):
+            text = message
+        if self.json_format:
+            record = dict(fields, ts=datetime.fromtimestamp(timestamp).isoformat(), kind=kind, message=text)
+            line = json.dumps(record, default=str, ensure_ascii=False)
+        else:
+            line = text
+        stream = self.stream or sys.stdout
+        try:
+            stream.write(line + "\n")
+            stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def flush(self, timeout=2.0):
+        """Wait (bounded) for queued records to be written, e.g. before exit"""
+        deadline = time.monotonic() + timeout
+        while not self.queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
@@ -0,0 +1,256 @@
+"""Swinging-door compression of drip weight readings.
+
+A bag empties slowly, so most 2-second samples lie on a straight line between
+their neighbours. The compressor keeps only the points needed to rebuild the
+curve (by linear interpolation) within a fixed error tolerance.
+
+CompressorStore keeps one compressor per patient in a dict for a single
+process; shared_state.py provides the same interface over shared memory for
+pre-fork mode, so a scale whose uploads land on different workers still
+feeds one compressor.
+"""
+import copy
+import threading
+from bisect import bisect_right
+
+
+class SwingingDoorCompressor:
+    """Per-patient swinging-door compressor.
+
+    `add()` takes each new reading and returns the (timestamp, weight, seq)
+    points that must be persisted; seq is passed through untouched. The most
+    recent reading is held back until a later reading proves whether it is
+    needed. A reading no newer than the last one received is returned as it
+    is, without moving the doors.
+    """
+
+    def __init__(self, tolerance, max_gap=None):
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+        self.archived = None    # last persisted point
+        self.pending = None     # last received point, not yet persisted
+        self.upper_slope = None
+        self.lower_slope = None
+        self.force_next = False
+
+    def _open_doors(self, point):
+        self.archived = point
+        self.pending = None
+        self.upper_slope = float('inf')
+        self.lower_slope = float('-inf')
+
+    def add(self, timestamp, weight, force=False, seq=None):
+        point = (timestamp, weight, seq)
+
+        if self.archived is None:
+            self._open_doors(point)
+            return [point]
+
+        if force or self.force_next:
+            # Keep both sides of a step (drip replacement, status change)
+            self.force_next = False
+            persisted = [self.pending, point] if self.pending else [point]
+            self._open_doors(point)
+            return persisted
+
+        # A late or repeated timestamp (batch uploads, spill replays) cannot
+        # join the current segment; store it as it is and keep the doors
+        latest = self.pending[0] if self.pending else self.archived[0]
+        if timestamp <= latest:
+            return [point]
+
+        dt = (timestamp - self.archived[0]).total_seconds()
+
+        if self.max_gap is not None and dt >= self.max_gap:
+            persisted = [self.pending, point] if self.pending else [point]
+            self._open_doors(point)
+            return persisted
+
+        # The line from the last stored point to this reading must pass within
+        # tolerance of every reading since; the doors are the slopes that do
+        base = self.archived[1]
+        if self.lower_slope <= (weight - base) / dt <= self.upper_slope:
+            self.upper_slope = min(self.upper_slope, (weight + self.tolerance - base) / dt)
+            self.lower_slope = max(self.lower_slope, (weight - self.tolerance - base) / dt)
+            self.pending = point
+            return []
+
+        # The doors closed: the previous reading becomes the new pivot
+        persisted = [self.pending]
+        self._open_doors(self.pending)
+        dt = (timestamp - self.archived[0]).total_seconds()
+        base = self.archived[1]
+        self.upper_slope = (weight + self.tolerance - base) / dt
+        self.lower_slope = (weight - self.tolerance - base) / dt
+        self.pending = point
+        return persisted
+
+    def flush(self):
+        """Return the held-back reading so it can be persisted (e.g. on shutdown)."""
+        if self.pending is None:
+            return []
+        point = self.pending
+        self._open_doors(point)
+        return [point]
+
+
+class BaseCompressorStore:
+    """Per-patient compressors, with the scale and last status seen for each.
+
+    Entries are {"compressor", "device_id", "status"}; subclasses provide an
+    atomic modify() and a get() that returns a copy.
+    """
+
+    def __init__(self, tolerance, max_gap=None):
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+
+    def new_entry(self):
+        return {"compressor": SwingingDoorCompressor(self.tolerance, self.max_gap), "device_id": None, "status": None}
+
+    def modify(self, patient_id, fn):
+        """Replace the entry with fn(entry or None); None from fn leaves it as is"""
+        raise NotImplementedError
+
+    def get(self, patient_id):
+        raise NotImplementedError
+
+    def patients(self):
+        raise NotImplementedError
+
+    def add(self, patient_id, device_id, readings, status):
+        """Compress (timestamp, weight, seq) readings; returns (points to store, status changed).
+
+        A change of status keeps the batch's last reading.
+        """
+        result = []
+
+        def apply(entry):
+            entry = entry or self.new_entry()
+            result.append(self._compress(entry, device_id, readings, status))
+            return entry
+        self.modify(patient_id, apply)
+        return result[0]
+
+    def draft(self, patient_id, device_id, readings, status):
+        """add() on a copy of the entry: (points to store, status changed, draft).
+
+        Nothing changes until save(draft), so a batch that never reaches the
+        database leaves the compressor where it was.
+        """
+        base = self.get(patient_id)
+        entry = self.get(patient_id) or self.new_entry()
+        points, status_changed = self._compress(entry, device_id, readings, status)
+        return points, status_changed, (self._state(base), entry)
+
+    def save(self, patient_id, draft):
+        """Store a draft() once its points are stored; returns points still to store.
+
+        If another batch moved the entry meanwhile, that entry is kept and the
+        point the draft held back is returned instead of being lost.
+        """
+        expected, entry = draft
+        held_back = []
+
+        def apply(current):
+            if self._state(current) == expected:
+                return entry
+            if entry["compressor"].pending:
+                held_back.append(entry["compressor"].pending)
+            return None
+        self.modify(patient_id, apply)
+        return held_back
+
+    def _compress(self, entry, device_id, readings, status):
+        status_changed = status is not None and entry["status"] not in (None, status)
+        if status is not None:
+            entry["status"] = status
+        entry["device_id"] = device_id
+        points = []
+        for i, (timestamp, weight, seq) in enumerate(readings):
+            points += entry["compressor"].add(timestamp, weight, force=status_changed and i == len(readings) - 1, seq=seq)
+        return points, status_changed
+
+    @staticmethod
+    def _state(entry):
+        if entry is None:
+            return None
+        compressor = entry["compressor"]
+        return (compressor.archived, compressor.pending, compressor.upper_slope, compressor.lower_slope,
+                compressor.force_next, entry["device_id"], entry["status"])
+
+    def set_device(self, patient_id, device_id):
+        def apply(entry):
+            if entry and entry["device_id"] == device_id:
+                return None
+            entry = entry or self.new_entry()
+            entry["device_id"] = device_id
+            return entry
+        self.modify(patient_id, apply)
+
+    def force_next(self, patient_id):
+        """Keep the readings on both sides of the next one (a bag change)"""
+        def apply(entry):
+            entry = entry or self.new_entry()
+            entry["compressor"].force_next = True
+            return entry
+        self.modify(patient_id, apply)
+
+    def flush(self, patient_id):
+        """(device_id, held-back points) of a patient, emptying the compressor"""
+        result = []
+
+        def apply(entry):
+            points = entry["compressor"].flush() if entry else []
+            result.append((entry["device_id"] if entry else None, points))
+            return entry if points else None
+        self.modify(patient_id, apply)
+        return result[0]
+
+
+class CompressorStore(BaseCompressorStore):
+    def __init__(self, tolerance, max_gap=None):
+        super().__init__(tolerance, max_gap)
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def modify(self, patient_id, fn):
+        with self.lock:
+            entry = fn(self.entries.get(patient_id))
+            if entry is not None:
+                self.entries[patient_id] = entry
+
+    def get(self, patient_id):
+        with self.lock:
+            entry = self.entries.get(patient_id)
+            return dict(entry, compressor=copy.copy(entry["compressor"])) if entry else None
+
+    def patients(self):
+        with self.lock:
+            return list(self.entries)
+
+
+def interpolate(points, start, end, step):
+    """Resample stored (timestamp, weight, ...) points onto a regular grid.
+
+    Points must be sorted by timestamp. Grid times before the first or after
+    the last stored point are skipped rather than extrapolated.
+    """
+    if not points:
+        return []
+
+    times = [p[0] for p in points]
+    resampled = []
+    t = max(start, times[0])
+    while t <= end and t <= times[-1]:
+        i = bisect_right(times, t)
+        if i >= len(points):
+            weight = points[-1][1]
+        else:
+            (t0, w0), (t1, w1) = points[i - 1][:2], points[i][:2]
+            span = (t1 - t0).total_seconds()
+            fraction = (t - t0).total_seconds() / span if span > 0 else 0
+            weight = w0 + (w1 - w0) * fraction
+        resampled.append((t, weight))
+        t += step
+    return resampled
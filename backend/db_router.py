@@ -0,0 +1,232 @@
+"""Connection pools and primary/replica routing.
+
+Each database gets a pool of idle connections. A connection is handed out
+as a lease whose close() puts it back in the pool (rolled back if it was
+left in a transaction), so handlers keep their usual
+`conn = ...; finally: conn.close()`. The pool caps only how many idle
+connections are kept; admission control caps how many are in use.
+
+A connection is checked before it is handed out again: poll() notices one
+the server has closed (a restart or failover) without a round trip, and one
+idle for more than validate_after_s also has to answer a SELECT 1. Dead
+connections are dropped and the next one (or a new one) is tried, so a
+restart costs reconnects, not failed requests.
+
+Writes, and reads that must see them, go to the primary. Reads on routes
+in the replica policy go to the replica when one is configured and it is
+healthy: at most every check_interval_s a request checks its replay lag,
+and while the replica is unreachable or more than max_lag_s behind,
+every read goes to the primary.
+
+Pools are per process. Idle connections are closed before a fork, so
+pre-fork workers never share a socket with the parent.
+"""
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class Lease:
+    """A pooled connection; close() returns it to the pool"""
+
+    def __init__(self, pool, conn):
+        object.__setattr__(self, 'pool', pool)
+        object.__setattr__(self, 'conn', conn)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __setattr__(self, name, value):
+        # e.g. conn.autocommit = True must reach the connection
+        setattr(self.conn, name, value)
+
+    def close(self):
+        conn = self.conn
+        object.__setattr__(self, 'conn', None)
+        if conn is not None:
+            self.pool.release(conn)
+
+
+class Pool:
+    def __init__(self, name, connect, size=10, idle_timeout_s=300, validate_after_s=30):
+        self.name = name
+        self.connect = connect
+        self.size = size
+        self.idle_timeout_s = idle_timeout_s
+        self.validate_after_s = validate_after_s
+        self.lock = threading.Lock()
+        self.idle = []      # (connection, released at), newest last
+        self.opened = 0
+        os.register_at_fork(before=self.clear, after_in_child=self._forget)
+
+    def acquire(self):
+        """A lease on an idle connection, or on a new one (raises if that fails)"""
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, released = self.idle.pop()
+            idle_s = time.monotonic() - released
+            if idle_s < self.idle_timeout_s and self._alive(conn, idle_s):
+                return Lease(self, conn)
+            self._discard(conn)
+        conn = self.connect()
+        with self.lock:
+            self.opened += 1
+        return Lease(self, conn)
+
+    def _alive(self, conn, idle_s):
+        if conn.closed:
+            return False
+        try:
+            conn.poll()
+            if idle_s >= self.validate_after_s:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def release(self, conn):
+        if conn.closed:
+            return
+        try:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except psycopg2.Error:
+            self._discard(conn)
+            return
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((conn, time.monotonic()))
+                return
+        self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def clear(self):
+        """Close every idle connection"""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _forget(self):
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def snapshot(self):
+        with self.lock:
+            return {"idle": len(self.idle), "opened": self.opened, "size": self.size}
+
+
+class DatabaseRouter:
+    def __init__(self, primary, replica=None, replica_routes=(), max_lag_s=5.0, check_interval_s=5.0):
+        self.primary = primary
+        self.replica = replica
+        self.replica_routes = set(replica_routes)
+        self.max_lag_s = max_lag_s
+        self.check_interval_s = check_interval_s
+        self.lock = threading.Lock()
+        self.healthy = replica is not None
+        self.lag_s = None
+        self.last_error = None
+        self.checked = float('-inf')
+        self.checking = False
+        self.counts = {"replica": 0, "primary": 0, "fallback": 0}
+
+    def read(self, route, fresh=False):
+        """A lease for a read on `route`; fresh=True always reads from the primary"""
+        if self.replica is None or fresh or route not in self.replica_routes:
+            self._count("primary")
+            return self.primary.acquire()
+
+        check = False
+        with self.lock:
+            if not self.checking and time.monotonic() - self.checked >= self.check_interval_s:
+                self.checking = check = True
+            healthy = self.healthy
+        if check:
+            return self._check_and_read()
+        if healthy:
+            try:
+                lease = self.replica.acquire()
+                self._count("replica")
+                return lease
+            except psycopg2.Error as e:
+                self._mark(False, None, e)
+        self._count("fallback")
+        return self.primary.acquire()
+
+    def _check_and_read(self):
+        """Measure the replica's lag on the connection this read would use"""
+        lease = None
+        try:
+            lease = self.replica.acquire()
+            cursor = lease.cursor()
+            cursor.execute(LAG_SQL)
+            lag_s = float(cursor.fetchone()[0])
+            cursor.close()
+            lease.rollback()
+        except Exception as e:
+            if lease is not None:
+                lease.close()
+            self._mark(False, None, e)
+        else:
+            self._mark(lag_s <= self.max_lag_s, lag_s, None)
+            if lag_s <= self.max_lag_s:
+                self._count("replica")
+                return lease
+            lease.close()
+        self._count("fallback")
+        return self.primary.acquire()
+
+    def _mark(self, healthy, lag_s, error):
+        with self.lock:
+            was_healthy = self.healthy
+            self.healthy = healthy
+            self.lag_s = lag_s
+            self.last_error = str(error).strip() if error else None
+            self.checked = time.monotonic()
+            self.checking = False
+        if was_healthy and not healthy:
+            reason = f"{lag_s:.1f}s behind" if error is None else f"unreachable ({self.last_error})"
+            print(f"⚠️ Read replica {reason}; reading from the primary")
+        elif healthy and not was_healthy:
+            print("✅ Read replica back; dashboard reads use it again")
+
+    def _count(self, target):
+        with self.lock:
+            self.counts[target] += 1
+
+    def snapshot(self):
+        with self.lock:
+            replica = None
+            if self.replica is not None:
+                replica = {
+                    "healthy": self.healthy,
+                    "lagSeconds": self.lag_s,
+                    "maxLagSeconds": self.max_lag_s,
+                    "lastError": self.last_error,
+                    "routes": sorted(self.replica_routes),
+                    "pool": self.replica.snapshot(),
+                }
+            return {"primary": {"pool": self.primary.snapshot()}, "replica": replica, "reads": dict(self.counts)}
@@ -0,0 +1,74 @@
+"""Duplicate detection for retried sensor uploads.
+
+Each device numbers its readings. Sequence numbers are 64-bit: the device's
+boot counter in the high 32 bits and a per-boot counter in the low 32 bits,
+so they keep increasing across reboots.
+
+For every device we keep the highest sequence seen plus a bitmap of which of
+the WINDOW sequences below it have arrived (the same scheme as IPsec replay
+protection). Checking a reading is O(1) and never touches the database.
+Compression keeps only a few readings in weight_data, so every committed
+batch also stores the device's high-water mark in device_sequences (spilled
+batches are replayed into weight_data in full). After a restart the window
+is seeded from the higher of the two, with every sequence up to it counted
+as seen.
+"""
+import threading
+
+WINDOW = 1024
+WINDOW_MASK = (1 << WINDOW) - 1
+
+
+def compose_seq(boot, counter):
+    """Combine a boot number and a per-boot counter into one sequence"""
+    return (int(boot) << 32) | (int(counter) & 0xFFFFFFFF)
+
+
+def advance(state, seq):
+    """Check seq against a (high_water_mark, bitmap) state.
+
+    Returns (accepted, new_state); state is None for a device not seen yet.
+    """
+    if state is None:
+        return True, (seq, 1)
+
+    high, bitmap = state
+    if seq > high:
+        shift = seq - high
+        # A reboot jumps the sequence by 2**32; don't build that bitmap
+        return True, (seq, ((bitmap << shift) | 1) & WINDOW_MASK if shift < WINDOW else 1)
+
+    offset = high - seq
+    if offset >= WINDOW:
+        return False, state
+    bit = 1 << offset
+    if bitmap & bit:
+        return False, state
+    return True, (high, bitmap | bit)
+
+
+class SequenceWindow:
+    def __init__(self):
+        self.devices = {}   # device_id -> (high_water_mark, bitmap)
+        self.lock = threading.Lock()
+
+    def seed(self, device_id, high_water_mark):
+        """Start a device's window at a stored high-water mark (e.g. after a restart).
+
+        Everything up to the mark counts as seen.
+        """
+        with self.lock:
+            current = self.devices.get(device_id)
+            if current is None or current[0] < high_water_mark:
+                self.devices[device_id] = (high_water_mark, WINDOW_MASK)
+
+    def seen(self, device_id, seq):
+        """True if accept() would reject seq; marks nothing"""
+        with self.lock:
+            return not advance(self.devices.get(device_id), seq)[0]
+
+    def accept(self, device_id, seq):
+        """Mark seq as seen; False if it is a duplicate or too old to tell"""
+        with self.lock:
+            accepted, self.devices[device_id] = advance(self.devices.get(device_id), seq)
+            return accepted
@@ -3,27 +3,402 @@ import os
 import socket
 import psycopg2
 from datetime import datetime, timedelta
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
 import threading
 import time
+import multiprocessing
+import signal
+from compression import CompressorStore, interpolate
+from filters import FilterBank
+from pagination import decode_cursor, encode_cursor, parse_bool, parse_limit
+from live_state import LiveState, seconds_to_empty
+from dedup import SequenceWindow, compose_seq
+from shared_state import SharedCompressorStore, SharedFilterBank, SharedLiveState, SharedSequenceWindow
+from event_bus import EventBus
+from scheduler import TimingWheel
+from profiling import Instrumentation, route_of
+from admission import AdmissionController, RouteClass
+from spill_log import SpillLog
+from async_log import AsyncLog
+import analytics
+from db_router import DatabaseRouter, Pool
+from archive import Archive, merge_archived
+import queue
+import itertools
+import csv
+import io
+
+# Request-path logging goes through a queue; see async_log.py
+log = AsyncLog.from_env()
+
+# Opt-in profiling and slow-request capture (see profiling.py)
+instrumentation = Instrumentation.from_env()
+
+# /admin/* endpoints are only served when ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Give up on a database that does not accept a connection within this time
+DB_CONNECT_TIMEOUT_S = int(os.getenv('DB_CONNECT_TIMEOUT_S', '5'))
 
 # Database connection with environment variables
+def connect_primary():
+    """New connection to the primary database"""
+    return psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        database=os.getenv('DB_NAME', 'caretrax'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD', 'password'),
+        port=os.getenv('DB_PORT', '5432'),
+        connect_timeout=DB_CONNECT_TIMEOUT_S,
+        cursor_factory=instrumentation.cursor_factory
+    )
+
+# Optional read replica, e.g. DB_REPLICA_DSN="host=replica dbname=caretrax user=postgres"
+DB_REPLICA_DSN = os.getenv('DB_REPLICA_DSN')
+
+def connect_replica():
+    """New connection to the read replica"""
+    return psycopg2.connect(
+        DB_REPLICA_DSN,
+        connect_timeout=DB_CONNECT_TIMEOUT_S,
+        cursor_factory=instrumentation.cursor_factory
+    )
+
+# Dashboard reads that may be served by the replica; everything else,
+# and any request sent with ?consistency=primary, reads from the primary
+REPLICA_ROUTES = os.getenv('DB_REPLICA_ROUTES', ','.join([
+    '/api/patients', '/api/patient/<id>', '/api/alerts', '/api/weight-history',
+    '/api/export/weight', '/api/ward/overview', '/api/analytics/consumption',
+])).split(',')
+
+# Idle connections kept per database and process (see db_router.py)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+
+db = DatabaseRouter(
+    Pool('primary', connect_primary, DB_POOL_SIZE),
+    Pool('replica', connect_replica, DB_POOL_SIZE) if DB_REPLICA_DSN else None,
+    replica_routes=REPLICA_ROUTES,
+    max_lag_s=float(os.getenv('DB_REPLICA_MAX_LAG_S', '5')),
+    check_interval_s=float(os.getenv('DB_REPLICA_CHECK_S', '5'))
+)
+
 def get_db_connection():
+    """Pooled connection to the primary, or None if it is unreachable"""
+    try:
+        return db.primary.acquire()
+    except Exception as e:
+        log.event('db_error', "❌ Database connection error: {error}", error=str(e))
+        return None
+
+def get_read_connection(route, fresh=False):
+    """Pooled connection for a read on route: the replica if allowed and healthy, else the primary"""
     try:
-        return psycopg2.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            database=os.getenv('DB_NAME', 'caretrax'),
-            user=os.getenv('DB_USER', 'postgres'),
-            password=os.getenv('DB_PASSWORD', 'password'),
-            port=os.getenv('DB_PORT', '5432')
-        )
+        return db.read(route, fresh)
     except Exception as e:
-        print(f"❌ Database connection error: {e}")
+        log.event('db_error', "❌ Database connection error: {error}", error=str(e))
         return None
 
-# Store the latest weight data (for backward compatibility)
-latest_weight = {"weight": 0, "timestamp": datetime.now().isoformat()}
+# Readings without a patient_id belong to the original single-bed setup
+DEFAULT_PATIENT_ID = 'P-123456'
+
+# Ingest-stage compression: tolerance in grams, weights are stored in kg
+COMPRESSION_TOLERANCE_KG = float(os.getenv('COMPRESSION_TOLERANCE_G', '5')) / 1000
+COMPRESSION_MAX_GAP_S = float(os.getenv('COMPRESSION_MAX_GAP_S', '300'))
+
+MAX_HISTORY_POINTS = 5000
+
+# Sequence numbers already seen per device, for rejecting retried uploads
+sequence_window = SequenceWindow()
+
+def seed_sequence_window():
+    """Start each device's window at its high-water mark (see dedup.py)"""
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT device_id, MAX(seq) FROM (
+                    SELECT device_id, high_water_mark AS seq FROM device_sequences
+                    UNION ALL
+                    SELECT device_id, MAX(seq) FROM weight_data
+                    WHERE seq IS NOT NULL
+                    GROUP BY device_id
+                ) marks
+                GROUP BY device_id
+            """)
+            for device_id, seq in cursor.fetchall():
+                sequence_window.seed(device_id, seq)
+            cursor.close()
+        except Exception as e:
+            print(f"❌ Error loading device sequences: {e}")
+        finally:
+            conn.close()
+
+# Newest filtered reading, percentage and status per patient
+live_state = LiveState()
+
+# Ward overviews are cached as encoded JSON for a short time
+OVERVIEW_CACHE_TTL_S = float(os.getenv('OVERVIEW_CACHE_TTL_S', '2'))
+overview_cache = {}
+overview_locks = {}     # ward -> lock held while that ward's entry is rebuilt
+overview_locks_lock = threading.Lock()
+
+# Status changes, drip replacements and alerts from every server node
+# LISTEN needs a dedicated connection of its own, outside the pool
+event_bus = EventBus(connect_primary)
+
+# Server-sent event clients connected to this process, one queue each
+STREAM_QUEUE_SIZE = 100
+stream_clients = set()
+stream_clients_lock = threading.Lock()
+# Set when a worker stops serving; stream handlers end within one keep-alive
+stopping = threading.Event()
+
+def broadcast_event(event):
+    """Event bus subscriber: hand an event to every local stream client"""
+    with stream_clients_lock:
+        clients = list(stream_clients)
+    for client in clients:
+        try:
+            client.put_nowait(event)
+        except queue.Full:
+            pass  # a stalled client misses events rather than holding up the rest
+
+event_bus.subscribe(broadcast_event)
+
+# Patient listings default to a whole ward on one page
+PATIENT_PAGE_SIZE = 200
+
+# Rows fetched per round trip by the streaming export
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', '5000'))
+
+# Consumption analytics: shift start hours, and results of closed windows
+SHIFT_STARTS = tuple(int(h) for h in os.getenv('SHIFT_STARTS', '7,15,23').split(','))
+consumption_cache = analytics.WindowCache()
+
+# Per-device noise filtering, configured by an optional JSON file
+filter_bank = FilterBank(os.getenv('FILTER_CONFIG_FILE'))
+
+# Per-patient compressors, with each patient's scale and last status
+compressors = CompressorStore(COMPRESSION_TOLERANCE_KG, COMPRESSION_MAX_GAP_S)
+
+def flush_compressors(patient_ids=None):
+    """Store the readings compressors hold back, when a scale goes quiet or on shutdown"""
+    held = []
+    for patient_id in compressors.patients() if patient_ids is None else patient_ids:
+        device_id, points = compressors.flush(patient_id)
+        if points:
+            held.append((patient_id, device_id, points))
+    if not held:
+        return
+
+    conn = None if database_down.is_set() else get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            for patient_id, device_id, points in held:
+                for timestamp, weight, seq in points:
+                    cursor.execute("""
+                        INSERT INTO weight_data (weight, timestamp, patient_id, device_id, seq)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON CONFLICT (device_id, seq) DO NOTHING
+                    """, (weight, timestamp, patient_id, device_id, seq))
+            conn.commit()
+            cursor.close()
+            return
+        except Exception as e:
+            log.event('db_error', "❌ Database error: {error}", error=str(e))
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        finally:
+            conn.close()
+    spill_log.append([
+        (patient_id, device_id, timestamp, weight, seq)
+        for patient_id, device_id, points in held
+        for timestamp, weight, seq in points
+    ])
+
+# A device that has not reported for this long is flagged stale
+SENSOR_TIMEOUT_S = float(os.getenv('SENSOR_TIMEOUT_S', '30'))
+SCHEDULER_TICK_S = 1
+
+# Per-device offline deadlines and per-patient predicted empty times; each
+# reading re-arms its timers, and a tick only visits the ones that expire
+deadlines = TimingWheel(SCHEDULER_TICK_S, time.time())
+
+def schedule_deadlines(device_id, patient_id):
+    """Re-arm the device's offline timer and the patient's empty-bag timer"""
+    deadlines.schedule(('offline', device_id), time.time() + SENSOR_TIMEOUT_S, patient_id)
+    entry = live_state.get(patient_id)
+    seconds_left = seconds_to_empty(entry)
+    if seconds_left is None:
+        deadlines.cancel(('empty', patient_id))
+    else:
+        deadlines.schedule(('empty', patient_id), entry["timestamp"].timestamp() + seconds_left, patient_id)
+
+def raise_alert(patient_id, alert_type, severity, message):
+    """Store an alert and announce it on the event bus"""
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO alerts (patient_id, alert_type, message, timestamp, severity, ward)
+                VALUES (%s, %s, %s, %s, %s, (SELECT ward FROM patients WHERE id = %s))
+            """, (patient_id, alert_type, message, datetime.now(), severity, patient_id))
+            event_bus.publish(cursor, 'alert', patient_id, alertType=alert_type, severity=severity, message=message)
+            conn.commit()
+            cursor.close()
+        except Exception as e:
+            print(f"❌ Error raising {alert_type} alert: {e}")
+            conn.rollback()
+        finally:
+            conn.close()
+
+def handle_expired(key, patient_id):
+    """Check an expired timer against live state and alert if it still holds.
+
+    In pre-fork mode a newer reading may have reached another worker, so the
+    timer is re-armed from the shared entry instead; claim() makes sure only
+    one worker raises the alert.
+    """
+    kind, device_id = key
+    now = time.time()
+    entry = live_state.get(patient_id)
+    if not entry:
+        return
+
+    if kind == 'offline':
+        last_seen = entry["timestamp"].timestamp()
+        if now - last_seen < SENSOR_TIMEOUT_S:
+            deadlines.schedule(key, last_seen + SENSOR_TIMEOUT_S, patient_id)
+            return
+        # The last reading before the scale went quiet ends the stored curve
+        flush_compressors([patient_id])
+        if live_state.claim(patient_id, 'stale', lambda e: now - e["timestamp"].timestamp() >= SENSOR_TIMEOUT_S):
+            print(f"⚠️ Sensor {device_id} offline, no reading for {now - last_seen:.0f}s")
+            raise_alert(patient_id, 'sensor_offline', 'warning',
+                        f'No reading from scale {device_id} since {entry["timestamp"].strftime("%I:%M %p")}')
+    elif kind == 'empty':
+        def empty_at(e):
+            seconds_left = seconds_to_empty(e)
+            return e["timestamp"].timestamp() + seconds_left if seconds_left is not None else None
+        predicted = empty_at(entry)
+        if predicted is None:
+            return
+        if predicted > now:
+            deadlines.schedule(key, predicted, patient_id)
+        elif live_state.claim(patient_id, 'overdue', lambda e: (empty_at(e) or now + 1) <= now):
+            print(f"🚨 Drip for {patient_id} predicted empty, not yet replaced")
+            raise_alert(patient_id, 'drip_empty_overdue', 'critical',
+                        'Insulin drip predicted empty and not yet replaced')
+
+def run_deadlines():
+    """Scheduler thread body: advance the wheel once per tick"""
+    while True:
+        time.sleep(SCHEDULER_TICK_S)
+        for key, patient_id in deadlines.advance(time.time()):
+            try:
+                handle_expired(key, patient_id)
+            except Exception as e:
+                print(f"❌ Scheduler error: {e}")
+
+def start_scheduler():
+    threading.Thread(target=run_deadlines, name='deadlines', daemon=True).start()
+
+# Readings the database could not take wait here until it is back
+SPILL_DIR = os.getenv('SPILL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spill'))
+SPILL_REPLAY_INTERVAL_S = float(os.getenv('SPILL_REPLAY_INTERVAL_S', '5'))
+spill_log = SpillLog(
+    SPILL_DIR,
+    segment_bytes=int(os.getenv('SPILL_SEGMENT_MB', '16')) << 20,
+    fsync_interval_s=float(os.getenv('SPILL_FSYNC_INTERVAL_S', '0.05'))
+)
+
+# Set once ingest fails to reach the database: uploads then go straight to
+# the spill log instead of each waiting out DB_CONNECT_TIMEOUT_S, until the
+# replayer gets through again
+database_down = threading.Event()
+
+def trip_database_down():
+    if not database_down.is_set():
+        database_down.set()
+        log.event('database', "⚠️ Database unreachable; spilling readings until it answers again")
+
+def connect_for_replay():
+    conn = get_db_connection()
+    if conn is not None and database_down.is_set():
+        database_down.clear()
+        log.event('database', "✅ Database reachable again; readings go straight to it")
+    return conn
+
+def run_spill_replayer():
+    """Replayer thread body: drain the spill log whenever the database answers"""
+    while True:
+        time.sleep(SPILL_REPLAY_INTERVAL_S)
+        try:
+            if database_down.is_set() and not spill_log.has_pending():
+                conn = connect_for_replay()
+                if conn:
+                    conn.close()
+            replayed = spill_log.replay(connect_for_replay)
+            if replayed:
+                print(f"♻️ Replayed {replayed} spilled reading(s) into weight_data")
+        except Exception as e:
+            print(f"❌ Spill replay error: {e}")
+
+def start_spill_replayer():
+    threading.Thread(target=run_spill_replayer, name='spill-replay', daemon=True).start()
+
+# Readings of patients discharged ARCHIVE_AFTER_DAYS ago move from weight_data
+# to columnar files in ARCHIVE_DIR (see archive.py); unset keeps them all in
+# the table. Every node serving history needs the same ARCHIVE_DIR.
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR')
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '7'))
+ARCHIVE_INTERVAL_S = float(os.getenv('ARCHIVE_INTERVAL_S', '3600'))
+archive = Archive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+
+def run_archiver():
+    """Archiver thread body: archive newly eligible patients every ARCHIVE_INTERVAL_S"""
+    while True:
+        time.sleep(ARCHIVE_INTERVAL_S)
+        try:
+            patients, rows, size = archive.run(get_db_connection, datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS))
+            if patients:
+                print(f"🗄️ Archived {rows} reading(s) of {patients} discharged patient(s) into {size / 1024:.0f} KiB")
+        except Exception as e:
+            print(f"❌ Archive error: {e}")
+
+def start_archiver():
+    if archive is not None:
+        threading.Thread(target=run_archiver, name='archiver', daemon=True).start()
+
+# Admission control: scale uploads first, staff actions next, dashboard reads
+# and exports last (see admission.py)
+DB_CONCURRENCY = int(os.getenv('DB_CONCURRENCY', '20'))
+READ_CONCURRENCY = int(os.getenv('READ_CONCURRENCY', '8'))
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', '2'))
+admission = AdmissionController(DB_CONCURRENCY, [
+    RouteClass('ingest', priority=3, limit=DB_CONCURRENCY, queue=200, wait_s=3, retry_after_s=2),
+    RouteClass('actions', priority=2, limit=DB_CONCURRENCY, queue=50, wait_s=3, retry_after_s=2),
+    RouteClass('reads', priority=1, limit=READ_CONCURRENCY, queue=20, wait_s=0.5, retry_after_s=5),
+    RouteClass('exports', priority=0, limit=EXPORT_CONCURRENCY, queue=0, wait_s=0, retry_after_s=30),
+])
+INGEST_PATHS = ('/', '/api/weight/batch')
+
+def classify_request(handler):
+    """Route class of a request, or None for ones that never touch the database"""
+    path = urlparse(handler.path).path
+    if handler.command == 'POST':
+        return 'ingest' if path in INGEST_PATHS else 'actions'
+    if path in ('/weight', '/stream') or path.startswith('/admin/'):
+        return None
+    if path in ('/api/export/weight', '/api/analytics/consumption'):
+        return 'exports'
+    return 'reads'
 
 class RequestHandler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
@@ -33,14 +408,22 @@ class RequestHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         self.end_headers()
 
+    @instrumentation.instrument
+    @admission.guard(classify_request)
     def do_POST(self):
         try:
             if self.path == '/':
                 self.handle_weight_data()
+            elif self.path == '/api/weight/batch':
+                self.handle_weight_batch()
+            elif self.path == '/api/alerts/mark-read':
+                self.handle_mark_alerts_read()
             elif self.path == '/api/drip-replacement':
                 self.handle_drip_replacement()
             elif self.path == '/api/patient-status-update':
                 self.handle_patient_status_update()
+            elif self.path == '/api/patient/discharge':
+                self.handle_patient_discharge()
             elif self.path == '/api/emergency-override':
                 self.handle_emergency_override()
             else:
@@ -48,76 +431,240 @@ class RequestHandler(BaseHTTPRequestHandler):
                 self.end_headers()
                 
         except Exception as e:
-            print(f"❌ Error processing POST request: {e}")
+            log.event('request_error', "❌ Error processing POST request: {error}", error=str(e))
             self.send_response(500)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
 
+    @instrumentation.instrument
+    @admission.guard(classify_request)
     def do_GET(self):
         try:
-            if self.path == '/weight':
+            path = urlparse(self.path).path
+            if path == '/weight':
                 self.handle_get_weight()
-            elif self.path == '/api/patients':
+            elif path == '/api/patients':
                 self.handle_get_patients()
-            elif self.path.startswith('/api/patient/'):
-                patient_id = self.path.split('/')[-1]
+            elif path.startswith('/api/patient/'):
+                patient_id = path.split('/')[-1]
                 self.handle_get_patient(patient_id)
-            elif self.path == '/api/alerts':
+            elif path == '/api/alerts':
                 self.handle_get_alerts()
+            elif path == '/api/weight-history':
+                self.handle_get_weight_history()
+            elif path == '/api/export/weight':
+                self.handle_export_weight()
+            elif path == '/api/ward/overview':
+                self.handle_ward_overview()
+            elif path == '/api/analytics/consumption':
+                self.handle_consumption_analytics()
+            elif path == '/stream':
+                self.handle_stream()
+            elif path.startswith('/admin/') and ADMIN_TOKEN:
+                self.handle_admin(path)
             else:
                 self.send_response(404)
                 self.end_headers()
                 
         except Exception as e:
-            print(f"❌ Error processing GET request: {e}")
+            log.event('request_error', "❌ Error processing GET request: {error}", error=str(e))
             self.send_response(500)
             self.end_headers()
 
-    def handle_weight_data(self):
+    def shed(self, route_class):
+        """Answer a request turned away by admission control"""
+        # Scale firmware treats any reply as delivered, so a shed upload is
+        # not refused: its readings go to the spill log instead of the database
+        if route_class.name == 'ingest':
+            try:
+                if self.path == '/':
+                    self.handle_weight_data(spill_only=True)
+                else:
+                    self.handle_weight_batch(spill_only=True)
+            except Exception as e:
+                log.event('request_error', "❌ Error spilling shed upload: {error}", error=str(e))
+                self.send_response(500)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": str(e)}).encode())
+            return
+
+        # A dashboard is better off with a slightly old ward overview than none
+        if urlparse(self.path).path == '/api/ward/overview':
+            ward = parse_qs(urlparse(self.path).query).get('ward', [None])[0]
+            cached = overview_cache.get(ward)
+            if cached is not None:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(cached[1])))
+                self.send_header('X-Cache', 'stale')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(cached[1])
+                return
+
+        self.send_response(503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Retry-After', str(route_class.retry_after_s))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps({"error": "Server busy", "retryAfter": route_class.retry_after_s}).encode())
+
+    def handle_weight_data(self, spill_only=False):
         """Handle weight data from Arduino"""
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
         data = json.loads(post_data.decode('utf-8'))
         
-        global latest_weight
-        latest_weight = {
-            "weight": data.get("weight", 0),
-            "timestamp": datetime.now().isoformat()
-        }
+        patient_id = data.get("patient_id", DEFAULT_PATIENT_ID)
+        device_id = data.get("device_id", patient_id)
+        seq = compose_seq(data.get("boot", 0), data["seq"]) if "seq" in data else None
+        accepted = self.ingest_readings(device_id, patient_id, [(datetime.now(), data.get("weight", 0), seq)], spill_only)
         
-        # Save to database
-        conn = get_db_connection()
+        # A retried reading we already have is still a success for the device;
+        # 202 means it is safe in the spill log but not in the database yet
+        self.send_response(202 if spill_only else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps({"status": "success" if accepted else "duplicate"}).encode())
+
+    def handle_weight_batch(self, spill_only=False):
+        """Handle a batch of buffered readings from one device"""
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        data = json.loads(post_data.decode('utf-8'))
+        
+        patient_id = data.get("patient_id", DEFAULT_PATIENT_ID)
+        device_id = data.get("device_id", patient_id)
+        boot = data.get("boot", 0)
+        now = datetime.now()
+        readings = [
+            (
+                datetime.fromisoformat(r["timestamp"]) if r.get("timestamp") else now,
+                r.get("weight", 0),
+                compose_seq(boot, r["seq"]) if "seq" in r else None
+            )
+            for r in data.get("readings", [])
+        ]
+        readings.sort(key=lambda r: (r[0], r[2] or 0))
+        accepted = self.ingest_readings(device_id, patient_id, readings, spill_only)
+        
+        self.send_response(202 if spill_only else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps({"status": "success", "accepted": accepted, "duplicates": len(readings) - accepted}).encode())
+
+    def ingest_readings(self, device_id, patient_id, readings, spill_only=False):
+        """Filter, compress and store (timestamp, raw weight, seq) readings, oldest first.
+
+        Returns how many readings were new; retries of sequenced readings
+        already seen are dropped before they reach the filters. With
+        spill_only the database is skipped and they go to the spill log.
+        Sequences are marked seen and the compressor moves on only once the
+        readings are committed or spilled.
+        """
+        fresh, seqs = [], set()
+        for reading in readings:
+            seq = reading[2]
+            if seq is None or (seq not in seqs and not sequence_window.seen(device_id, seq)):
+                fresh.append(reading)
+                seqs.add(seq)
+        readings = fresh
+        if not readings:
+            return 0
+        
+        # One vectorized filter pass for the whole batch
+        compressors.set_device(patient_id, device_id)
+        filtered = filter_bank.process(device_id, [r[1] for r in readings])
+        readings = [(timestamp, float(weight), seq) for (timestamp, _, seq), weight in zip(readings, filtered)]
+        
+        for timestamp, weight, seq in readings:
+            live_state.update(patient_id, weight, timestamp, seq)
+        schedule_deadlines(device_id, patient_id)
+        latest_time, latest_weight = readings[-1][0], readings[-1][1]
+        
+        # Save to database; readings it cannot take go to the spill log and
+        # are replayed once it is back
+        conn = None if spill_only or database_down.is_set() else get_db_connection()
+        spill = conn is None
+        if conn is None and not spill_only and not database_down.is_set():
+            trip_database_down()
         if conn:
+            committed = False
             try:
                 cursor = conn.cursor()
                 
-                # Insert weight data
-                cursor.execute(
-                    "INSERT INTO weight_data (weight, timestamp, patient_id) VALUES (%s, %s, %s)",
-                    (latest_weight["weight"], latest_weight["timestamp"], 'P-123456')  # Default to Taha Nasir
-                )
+                # Update patient status based on the newest weight
+                percentage, status = self.update_patient_status_from_weight(cursor, patient_id, latest_weight)
+                live_state.set_status(patient_id, percentage, status)
                 
-                # Update patient status based on weight
-                self.update_patient_status_from_weight(cursor, 'P-123456', latest_weight["weight"])
+                # Only the points needed to rebuild the curve are stored; a
+                # status change always keeps the reading that caused it
+                points, status_changed, draft = compressors.draft(patient_id, device_id, readings, status)
                 
+                if status_changed:
+                    event_bus.publish(cursor, 'status', patient_id, status=status, remainingPercentage=percentage)
+                
+                # Insert weight data; the unique (device_id, seq) index catches
+                # retries that arrive while the first attempt is still in flight
+                self.insert_points(cursor, patient_id, device_id, points)
+                high_water_mark = max((seq for seq in seqs if seq is not None), default=None)
+                if high_water_mark is not None:
+                    cursor.execute("""
+                        INSERT INTO device_sequences (device_id, high_water_mark, updated_at)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (device_id) DO UPDATE
+                        SET high_water_mark = GREATEST(device_sequences.high_water_mark, EXCLUDED.high_water_mark),
+                            updated_at = EXCLUDED.updated_at
+                    """, (device_id, high_water_mark, datetime.now()))
                 conn.commit()
+                committed = True
+                
+                # Another batch for the patient may have moved the compressor
+                # meanwhile; then the point this one held back is stored now
+                held_back = compressors.save(patient_id, draft)
+                if held_back:
+                    self.insert_points(cursor, patient_id, device_id, held_back)
+                    conn.commit()
                 cursor.close()
-                print(f"📊 Weight saved: {latest_weight['weight']} ml at {latest_weight['timestamp']}")
+                log.event('reading', "📊 Weight saved: {weight} ml at {time} ({points} point(s) stored)",
+                          device=device_id, patient=patient_id, readings=len(readings), points=len(points) + len(held_back),
+                          weight=latest_weight, time=latest_time.isoformat())
                 
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                log.event('db_error', "❌ Database unavailable: {error}", error=str(e))
+                trip_database_down()
+                spill = not committed
             except Exception as e:
-                print(f"❌ Database error: {e}")
+                log.event('db_error', "❌ Database error: {error}", error=str(e))
                 conn.rollback()
+                spill = not committed
             finally:
                 conn.close()
         
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps({"status": "success"}).encode())
+        if spill:
+            spill_log.append([(patient_id, device_id, timestamp, weight, seq) for timestamp, weight, seq in readings])
+            log.event('spilled', "💾 Spilled {readings} reading(s) for {patient} to the local log",
+                      device=device_id, patient=patient_id, readings=len(readings))
+        
+        for seq in seqs:
+            if seq is not None:
+                sequence_window.accept(device_id, seq)
+        
+        return len(readings)
 
+    def insert_points(self, cursor, patient_id, device_id, points):
+        for timestamp, weight, seq in points:
+            cursor.execute("""
+                INSERT INTO weight_data (weight, timestamp, patient_id, device_id, seq)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (device_id, seq) DO NOTHING
+            """, (weight, timestamp, patient_id, device_id, seq))
 
     def update_patient_status_from_weight(self, cursor, patient_id, weight):
         """Update patient status based on current weight and drip volume"""
@@ -149,19 +696,25 @@ class RequestHandler(BaseHTTPRequestHandler):
                 
                 # Create alert if critical
                 if status == 'critical':
+                    message = f'Insulin drip level critically low ({remaining_percentage:.1f}%)'
                     cursor.execute("""
-                        INSERT INTO alerts (patient_id, alert_type, message, timestamp, severity)
-                        VALUES (%s, %s, %s, %s, %s)
+                        INSERT INTO alerts (patient_id, alert_type, message, timestamp, severity, ward)
+                        VALUES (%s, %s, %s, %s, %s, (SELECT ward FROM patients WHERE id = %s))
                     """, (
                         patient_id,
                         'low_drip',
-                        f'Insulin drip level critically low ({remaining_percentage:.1f}%)',
+                        message,
                         datetime.now(),
-                        'critical'
+                        'critical',
+                        patient_id
                     ))
+                    event_bus.publish(cursor, 'alert', patient_id, alertType='low_drip', severity='critical', message=message)
+                
+                return remaining_percentage, status
                 
         except Exception as e:
-            print(f"❌ Error updating patient status: {e}")
+            log.event('db_error', "❌ Error updating patient status: {error}", error=str(e))
+        return None, None
 
     def handle_drip_replacement(self):
         """Handle drip replacement by staff"""
@@ -172,49 +725,39 @@ class RequestHandler(BaseHTTPRequestHandler):
         conn = get_db_connection()
         if conn:
             try:
+                # The whole replacement runs inside replace_patient_drip() (see
+                # scripts/database-setup.sql), so autocommit makes it one round trip
+                conn.autocommit = True
                 cursor = conn.cursor()
-                
+
                 patient_id = data['patientId']
                 new_volume = data['newVolume']
                 replaced_by = data.get('replacedBy', 'Staff')
-                
-                # End current drip record
-                cursor.execute("""
-                    UPDATE drip_records 
-                    SET status = 'replaced', end_time = %s, replaced_by = %s
-                    WHERE patient_id = %s AND status = 'active'
-                """, (datetime.now(), replaced_by, patient_id))
-                
-                # Create new drip record
-                cursor.execute("""
-                    INSERT INTO drip_records (patient_id, drip_type, volume_ml, start_time, administered_by)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (patient_id, 'Insulin Drip', new_volume, datetime.now(), replaced_by))
-                
-                # Update patient record
-                cursor.execute("""
-                    UPDATE patients 
-                    SET current_drip_volume = %s, remaining_percentage = 100, status = 'normal', last_checked = %s
-                    WHERE id = %s
-                """, (new_volume, datetime.now(), patient_id))
-                
-                # Log treatment record
-                cursor.execute("""
-                    INSERT INTO treatment_records (patient_id, treatment_type, timestamp, administered_by, notes)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (patient_id, 'Drip Replacement', datetime.now(), replaced_by, f'Replaced with {new_volume}ml drip'))
-                
-                conn.commit()
+
+                cursor.execute(
+                    "SELECT replace_patient_drip(%s, %s, %s, %s)",
+                    (patient_id, new_volume, replaced_by, datetime.now())
+                )
+                new_drip_id = cursor.fetchone()[0]
                 cursor.close()
-                
+
+                # The new bag must not be smoothed towards the old one's weight;
+                # keep the readings on both sides of the bag change
+                entry = compressors.get(patient_id)
+                if entry and entry["device_id"]:
+                    filter_bank.reset(entry["device_id"])
+                compressors.force_next(patient_id)
+                live_state.reset_rate(patient_id)
+                deadlines.cancel(('empty', patient_id))
+
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
-                self.wfile.write(json.dumps({"status": "success", "message": "Drip replaced successfully"}).encode())
+                self.wfile.write(json.dumps({"status": "success", "message": "Drip replaced successfully", "dripId": new_drip_id}).encode())
                 
             except Exception as e:
-                print(f"❌ Drip replacement error: {e}")
+                log.event('request_error', "❌ Drip replacement error: {error}", error=str(e))
                 conn.rollback()
                 self.send_response(500)
                 self.send_header('Content-Type', 'application/json')
@@ -224,11 +767,98 @@ class RequestHandler(BaseHTTPRequestHandler):
             finally:
                 conn.close()
 
+    def handle_stream(self):
+        """Server-sent events: status changes, drip replacements and alerts"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'keep-alive')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
+        events = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with stream_clients_lock:
+            stream_clients.add(events)
+        try:
+            while not stopping.is_set():
+                try:
+                    event = events.get(timeout=15)
+                    self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode())
+                except queue.Empty:
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            log.event('stream', "Client {client} disconnected", client=self.client_address[0])
+        finally:
+            with stream_clients_lock:
+                stream_clients.discard(events)
+
+    def read_connection(self):
+        """Database connection for a GET handler, routed by REPLICA_ROUTES.
+
+        Clients that must see their own write (e.g. a dashboard refreshing
+        right after marking alerts read) send ?consistency=primary or an
+        X-Consistency: primary header.
+        """
+        query = parse_qs(urlparse(self.path).query)
+        fresh = 'primary' in (query.get('consistency', [None])[0], self.headers.get('X-Consistency'))
+        return get_read_connection(route_of(self.path), fresh)
+
+    def handle_admin(self, path):
+        """Operational reports: /admin/profile, /admin/slow-requests, /admin/tracemalloc, /admin/admission, /admin/db"""
+        if self.headers.get('Authorization') != f'Bearer {ADMIN_TOKEN}':
+            self.send_response(401)
+            self.end_headers()
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            if path == '/admin/profile':
+                body = instrumentation.profile_report(
+                    sort=query.get('sort', ['cumulative'])[0],
+                    limit=int(query.get('limit', ['40'])[0]),
+                    reset=parse_bool(query, 'reset') or False,
+                    dump=parse_bool(query, 'dump') or False
+                ).encode()
+                content_type = 'text/plain; charset=utf-8'
+            elif path == '/admin/admission':
+                body = json.dumps(admission.snapshot()).encode()
+                content_type = 'application/json'
+            elif path == '/admin/db':
+                body = json.dumps(db.snapshot()).encode()
+                content_type = 'application/json'
+            elif path == '/admin/slow-requests':
+                body = json.dumps(list(instrumentation.slow_requests)).encode()
+                content_type = 'application/json'
+            elif path == '/admin/tracemalloc':
+                body = json.dumps(instrumentation.tracemalloc_action(
+                    query.get('action', ['snapshot'])[0],
+                    limit=int(query.get('limit', ['25'])[0])
+                )).encode()
+                content_type = 'application/json'
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+        except (KeyError, ValueError) as e:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        self.wfile.write(body)
+
     def handle_get_weight(self):
         """Get latest weight data"""
+        latest = live_state.latest()
         response_data = {
-            "weight": latest_weight["weight"],
-            "timestamp": latest_weight["timestamp"]
+            "weight": latest["weight"] if latest else 0,
+            "timestamp": (latest["timestamp"] if latest else datetime.now()).isoformat(),
+            "stale": latest["stale"] if latest else False
         }
         
         self.send_response(200)
@@ -237,40 +867,619 @@ class RequestHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(response_data).encode())
 
+    def handle_get_weight_history(self):
+        """Get a patient's weight curve, rebuilt from the compressed points"""
+        query = parse_qs(urlparse(self.path).query)
+        patient_id = query.get('patient_id', [DEFAULT_PATIENT_ID])[0]
+        end = datetime.fromisoformat(query['to'][0]) if 'to' in query else datetime.now()
+        start = datetime.fromisoformat(query['from'][0]) if 'from' in query else end - timedelta(hours=24)
+        step = float(query['step'][0]) if 'step' in query else None
+
+        conn = self.read_connection()
+        if not conn:
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "Database unavailable"}).encode())
+            return
+        try:
+            cursor = conn.cursor()
+            # Include the stored point on either side of the range so the
+            # edges interpolate instead of being cut off
+            cursor.execute("""
+                (SELECT timestamp, weight FROM weight_data
+                 WHERE patient_id = %s AND timestamp < %s
+                 ORDER BY timestamp DESC LIMIT 1)
+                UNION ALL
+                (SELECT timestamp, weight FROM weight_data
+                 WHERE patient_id = %s AND timestamp >= %s AND timestamp <= %s
+                 ORDER BY timestamp)
+                UNION ALL
+                (SELECT timestamp, weight FROM weight_data
+                 WHERE patient_id = %s AND timestamp > %s
+                 ORDER BY timestamp LIMIT 1)
+            """, (patient_id, start, patient_id, start, end, patient_id, end))
+            points = cursor.fetchall()
+            if archive is not None:
+                points += archive.points(cursor, patient_id, start, end)
+            points.sort()
+            cursor.close()
+
+            # The newest reading is held back by the compressor until the
+            # next one arrives, so add it to reach the live value
+            entry = compressors.get(patient_id)
+            pending = entry["compressor"].pending if entry else None
+            if pending and (not points or pending[0] > points[-1][0]):
+                points.append(pending[:2])
+
+            if step:
+                step = timedelta(seconds=max(step, (end - start).total_seconds() / MAX_HISTORY_POINTS))
+                points = interpolate(points, start, end, step)
+            else:
+                points = [p for p in points if start <= p[0] <= end]
+
+            history = [{"timestamp": p[0].isoformat(), "weight": p[1]} for p in points]
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps(history).encode())
+
+        except Exception as e:
+            log.event('request_error', "❌ Get weight history error: {error}", error=str(e))
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+        finally:
+            conn.close()
+
+    def handle_export_weight(self):
+        """Stream stored weight readings as CSV or NDJSON"""
+        query = parse_qs(urlparse(self.path).query)
+        patient_id = query.get('patient_id', [None])[0]
+        export_format = query.get('format', ['csv'])[0]
+        if export_format not in ('csv', 'ndjson'):
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "format must be csv or ndjson"}).encode())
+            return
+
+        conditions, params = [], []
+        if patient_id:
+            conditions.append("patient_id = %s")
+            params.append(patient_id)
+        if 'from' in query:
+            conditions.append("timestamp >= %s")
+            params.append(datetime.fromisoformat(query['from'][0]))
+        if 'to' in query:
+            conditions.append("timestamp <= %s")
+            params.append(datetime.fromisoformat(query['to'][0]))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        # With an archive, each patient that has archived readings in range
+        # gets a marker row (NULL timestamp, sorted first) for merge_archived
+        markers, marker_params = "", []
+        if archive is not None:
+            marker_conditions = ["TRUE"]
+            if patient_id:
+                marker_conditions.append("patient_id = %s")
+                marker_params.append(patient_id)
+            if 'from' in query:
+                marker_conditions.append("last_timestamp >= %s")
+                marker_params.append(datetime.fromisoformat(query['from'][0]))
+            if 'to' in query:
+                marker_conditions.append("first_timestamp <= %s")
+                marker_params.append(datetime.fromisoformat(query['to'][0]))
+            markers = f"""
+                    UNION ALL
+                    SELECT DISTINCT patient_id, NULL::timestamp, NULL::float, NULL::varchar, NULL::bigint
+                    FROM weight_archive WHERE {' AND '.join(marker_conditions)}"""
+
+        conn = self.read_connection()
+        if not conn:
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "Database unavailable"}).encode())
+            return
+        headers_sent = False
+        try:
+            # A named cursor keeps the result set on the server; rows are
+            # pulled EXPORT_FETCH_SIZE at a time so memory stays flat
+            cursor = conn.cursor(name='weight_export')
+            cursor.itersize = EXPORT_FETCH_SIZE
+            cursor.execute(f"""
+                SELECT patient_id, timestamp, weight, device_id, seq FROM weight_data
+                {where}{markers}
+                ORDER BY patient_id, timestamp NULLS FIRST
+            """, params + marker_params)
+
+            # Chunked transfer needs HTTP/1.1; the connection is closed afterwards
+            self.protocol_version = 'HTTP/1.1'
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv' if export_format == 'csv' else 'application/x-ndjson')
+            self.send_header('Content-Disposition', f'attachment; filename="weight_data.{export_format}"')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Connection', 'close')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+
+            headers_sent = True
+
+            # csv.writer quotes device ids and patient ids containing commas or quotes
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator='\n')
+            if export_format == 'csv':
+                writer.writerow(('patient_id', 'timestamp', 'weight', 'device_id', 'seq'))
+                self.send_chunk(buffer.getvalue().encode())
+            records = iter(cursor)
+            if archive is not None:
+                archive_cursor = conn.cursor()
+                start = datetime.fromisoformat(query['from'][0]) if 'from' in query else None
+                end = datetime.fromisoformat(query['to'][0]) if 'to' in query else None
+                records = merge_archived(records, lambda archived_id: archive.rows(archive_cursor, archived_id, start, end))
+            while True:
+                rows = list(itertools.islice(records, EXPORT_FETCH_SIZE))
+                if not rows:
+                    break
+                if export_format == 'csv':
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows((row[0], row[1].isoformat(), row[2], row[3], row[4]) for row in rows)
+                    body = buffer.getvalue()
+                else:
+                    body = "".join(json.dumps({"patient_id": row[0], "timestamp": row[1].isoformat(), "weight": row[2], "device_id": row[3], "seq": row[4]}) + "\n" for row in rows)
+                self.send_chunk(body.encode())
+            self.send_chunk(b"")
+            cursor.close()
+
+        except Exception as e:
+            log.event('request_error', "❌ Weight export error: {error}", error=str(e))
+            # Once the headers are out the client can only see a truncated
+            # chunked body (no terminating chunk); before that it gets a 500
+            if not headers_sent:
+                self.send_response(500)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": str(e)}).encode())
+        finally:
+            conn.close()
+
+    def handle_consumption_analytics(self):
+        """Drip consumption per shift, ward or patient over a time window"""
+        query = parse_qs(urlparse(self.path).query)
+        group = query.get('group', ['ward'])[0]
+        ward = query.get('ward', [None])[0]
+        end = datetime.fromisoformat(query['to'][0]) if 'to' in query else datetime.now()
+        start = datetime.fromisoformat(query['from'][0]) if 'from' in query else end - timedelta(hours=24)
+        if group not in analytics.GROUPS or start >= end:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            error = f"group must be one of {', '.join(analytics.GROUPS)}" if group not in analytics.GROUPS else "from must be before to"
+            self.wfile.write(json.dumps({"error": error}).encode())
+            return
+
+        key = (start, end, group, ward)
+        body = consumption_cache.get(key)
+        if body is None:
+            conn = self.read_connection()
+            if not conn:
+                self.send_response(503)
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                return
+            try:
+                cursor = conn.cursor()
+                data = analytics.load(cursor, start, end, ward)
+                cursor.close()
+                groups = analytics.consumption(*data, group, SHIFT_STARTS)
+                body = json.dumps({
+                    "from": start.isoformat(),
+                    "to": end.isoformat(),
+                    "group": group,
+                    "ward": ward,
+                    "groups": groups,
+                }).encode()
+                consumption_cache.put(key, end, body)
+
+            except Exception as e:
+                log.event('request_error', "❌ Consumption analytics error: {error}", error=str(e))
+                self.send_response(500)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": str(e)}).encode())
+                return
+            finally:
+                conn.close()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        """Write one chunk of a chunked response (an empty chunk ends the body)"""
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def handle_ward_overview(self):
+        """Everything a ward dashboard shows, in one response"""
+        query = parse_qs(urlparse(self.path).query)
+        ward = query.get('ward', [None])[0]
+
+        # A fresh entry is served without locking. On a miss one thread per
+        # ward rebuilds it; only other misses for the same ward wait for it
+        cached = overview_cache.get(ward)
+        if cached is None or cached[0] < time.monotonic():
+            with overview_locks_lock:
+                ward_lock = overview_locks.setdefault(ward, threading.Lock())
+            with ward_lock:
+                cached = overview_cache.get(ward)
+                if cached is None or cached[0] < time.monotonic():
+                    built = self.build_ward_overview(ward)
+                    if built is None:
+                        self.send_response(503)
+                        self.send_header('Content-Type', 'application/json')
+                        self.send_header('Access-Control-Allow-Origin', '*')
+                        self.end_headers()
+                        self.wfile.write(json.dumps({"error": "Database unavailable"}).encode())
+                        return
+                    body, patient_count = built
+                    cached = (time.monotonic() + OVERVIEW_CACHE_TTL_S, body)
+                    # Only wards that have patients are kept, so made-up ward
+                    # names in the query cannot grow the cache
+                    if patient_count or ward is None:
+                        overview_cache[ward] = cached
+                    else:
+                        overview_cache.pop(ward, None)
+            if ward not in overview_cache:
+                with overview_locks_lock:
+                    if overview_locks.get(ward) is ward_lock:
+                        del overview_locks[ward]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cached[1])))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(cached[1])
+
+    def build_ward_overview(self, ward):
+        """Join live state with one batched query; returns (encoded JSON, patient count) or None"""
+        conn = self.read_connection()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT p.id, p.name, p.room, p.status, p.remaining_percentage, p.current_drip_volume,
+                       p.last_checked, d.id, d.drip_type, d.volume_ml, d.start_time, d.administered_by,
+                       a.unread
+                FROM patients p
+                LEFT JOIN LATERAL (
+                    SELECT id, drip_type, volume_ml, start_time, administered_by
+                    FROM drip_records
+                    WHERE patient_id = p.id AND status = 'active'
+                    ORDER BY start_time DESC
+                    LIMIT 1
+                ) d ON TRUE
+                CROSS JOIN LATERAL (
+                    SELECT count(*) AS unread FROM alerts WHERE patient_id = p.id AND read = FALSE
+                ) a
+                WHERE %s IS NULL OR p.ward = %s
+                ORDER BY p.room, p.name
+            """, (ward, ward))
+            rows = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            log.event('request_error', "❌ Ward overview error: {error}", error=str(e))
+            return None
+        finally:
+            conn.close()
+
+        patients = []
+        for row in rows:
+            live = live_state.get(row[0])
+            # The estimate runs from the newest reading, so a quiet scale's
+            # drip still comes due
+            seconds_left = seconds_to_empty(live)
+            empty_at = live["timestamp"] + timedelta(seconds=seconds_left) if seconds_left is not None else None
+            patients.append({
+                "id": row[0],
+                "name": row[1],
+                "room": row[2],
+                "status": live["status"] if live and live["status"] else row[3],
+                "remainingPercentage": live["percentage"] if live and live["percentage"] is not None else (float(row[4]) if row[4] else 0),
+                "currentDripVolume": row[5],
+                "weight": live["weight"] if live else None,
+                "weightTimestamp": live["timestamp"].isoformat() if live else None,
+                "stale": live["stale"] if live else False,
+                "lastChecked": row[6].isoformat() if row[6] else None,
+                "activeDrip": {
+                    "id": row[7],
+                    "type": row[8],
+                    "volumeMl": row[9],
+                    "startTime": row[10].isoformat(),
+                    "administeredBy": row[11]
+                } if row[7] else None,
+                "secondsToEmpty": max(0, round((empty_at - datetime.now()).total_seconds())) if empty_at else None,
+                "estimatedEmptyAt": empty_at.isoformat() if empty_at else None,
+                "unreadAlerts": row[12]
+            })
+
+        return json.dumps({"ward": ward, "generatedAt": datetime.now().isoformat(), "patients": patients}).encode(), len(patients)
+
     def handle_get_patients(self):
-        """Get all patients with current status"""
+        """Get one page of patients with current status, ordered by name"""
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            after = decode_cursor(query.get('cursor', [None])[0], (str, str))
+            limit = parse_limit(query, default=PATIENT_PAGE_SIZE)
+        except ValueError as e:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            return
+
+        conditions, params = [], []
+        for column in ('status', 'ward', 'room'):
+            if column in query:
+                conditions.append(f"{column} = %s")
+                params.append(query[column][0])
+        if after:
+            conditions.append("(name, id) > (%s, %s)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        conn = self.read_connection()
+        if not conn:
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "Database unavailable"}).encode())
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT id, name, room, remaining_percentage, last_checked, status, current_drip_volume, ward
+                FROM patients
+                {where}
+                ORDER BY name, id
+                LIMIT %s
+            """, params + [limit + 1])
+            rows = cursor.fetchall()
+            cursor.close()
+
+            next_cursor = encode_cursor([rows[limit - 1][1], rows[limit - 1][0]]) if len(rows) > limit else None
+            patients = [self.patient_to_json(row) for row in rows[:limit]]
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Expose-Headers', 'X-Next-Cursor')
+            if next_cursor:
+                self.send_header('X-Next-Cursor', next_cursor)
+            self.end_headers()
+            self.wfile.write(json.dumps(patients).encode())
+            
+        except Exception as e:
+            log.event('request_error', "❌ Get patients error: {error}", error=str(e))
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+        finally:
+            conn.close()
+
+    def patient_to_json(self, row):
+        """Shape a patients row (listing column order) for the API, with live values on top"""
+        live = live_state.get(row[0])
+        return {
+            "id": row[0],
+            "name": row[1],
+            "room": row[2],
+            "remainingPercentage": live["percentage"] if live and live["percentage"] is not None else (float(row[3]) if row[3] else 0),
+            "lastChecked": row[4].strftime("%I:%M %p") if row[4] else "",
+            "status": live["status"] if live and live["status"] else row[5],
+            "currentDripVolume": row[6],
+            "ward": row[7],
+            "stale": live["stale"] if live else False
+        }
+
+    def handle_get_patient(self, patient_id):
+        """Get a single patient with current status"""
+        conn = self.read_connection()
+        if not conn:
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "Database unavailable"}).encode())
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, name, room, remaining_percentage, last_checked, status, current_drip_volume, ward
+                FROM patients
+                WHERE id = %s
+            """, (patient_id,))
+            row = cursor.fetchone()
+            cursor.close()
+
+            if row is None:
+                self.send_response(404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": "Patient not found"}).encode())
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps(self.patient_to_json(row)).encode())
+
+        except Exception as e:
+            log.event('request_error', "❌ Get patient error: {error}", error=str(e))
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+        finally:
+            conn.close()
+
+    def handle_get_alerts(self):
+        """Get one page of alerts, newest first"""
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            before = decode_cursor(query.get('cursor', [None])[0], (str, int))
+            if before:
+                before = (datetime.fromisoformat(before[0]), before[1])
+            limit = parse_limit(query)
+            unread = parse_bool(query, 'unread')
+        except ValueError as e:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            return
+
+        # Each filter on its own (patient, ward, severity, unread, and unread
+        # with patient or ward) walks one of the idx_alerts_* indexes in
+        # scripts/database-setup.sql in page order; other combinations use the
+        # most selective of them and filter the rest. Alerts carry the ward
+        # they were raised on, so the ward filter needs no join
+        conditions, params = [], []
+        if 'patient_id' in query:
+            conditions.append("a.patient_id = %s")
+            params.append(query['patient_id'][0])
+        if 'ward' in query:
+            conditions.append("a.ward = %s")
+            params.append(query['ward'][0])
+        if 'severity' in query:
+            conditions.append("a.severity = %s")
+            params.append(query['severity'][0])
+        if unread is not None:
+            conditions.append("a.read = %s")
+            params.append(not unread)
+        if before:
+            conditions.append("(a.timestamp, a.id) < (%s, %s)")
+            params.extend(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        conn = self.read_connection()
+        if not conn:
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "Database unavailable"}).encode())
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT a.id, a.patient_id, a.alert_type, a.message, a.timestamp, a.read, a.severity
+                FROM alerts a
+                {where}
+                ORDER BY a.timestamp DESC, a.id DESC
+                LIMIT %s
+            """, params + [limit + 1])
+            rows = cursor.fetchall()
+            cursor.close()
+
+            next_cursor = None
+            if len(rows) > limit:
+                next_cursor = encode_cursor([rows[limit - 1][4].isoformat(), rows[limit - 1][0]])
+
+            alerts = []
+            for row in rows[:limit]:
+                alerts.append({
+                    "id": row[0],
+                    "patientId": row[1],
+                    "type": row[2],
+                    "message": row[3],
+                    "timestamp": row[4].isoformat(),
+                    "read": row[5],
+                    "severity": row[6]
+                })
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Expose-Headers', 'X-Next-Cursor')
+            if next_cursor:
+                self.send_header('X-Next-Cursor', next_cursor)
+            self.end_headers()
+            self.wfile.write(json.dumps(alerts).encode())
+
+        except Exception as e:
+            log.event('request_error', "❌ Get alerts error: {error}", error=str(e))
+            self.send_response(500)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": str(e)}).encode())
+        finally:
+            conn.close()
+
+    def handle_mark_alerts_read(self):
+        """Mark alerts as read, by id list or for a patient up to a point in time"""
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        data = json.loads(post_data.decode('utf-8'))
+
+        if data.get('ids'):
+            condition, params = "id = ANY(%s)", [[int(i) for i in data['ids']]]
+        elif data.get('patientId'):
+            condition, params = "patient_id = %s AND timestamp <= %s", [
+                data['patientId'],
+                datetime.fromisoformat(data['before']) if data.get('before') else datetime.now()
+            ]
+        else:
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "ids or patientId is required"}).encode())
+            return
+
         conn = get_db_connection()
         if conn:
             try:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT id, name, room, remaining_percentage, last_checked, status, current_drip_volume
-                    FROM patients
-                    ORDER BY name
-                """)
-                
-                patients = []
-                for row in cursor.fetchall():
-                    patients.append({
-                        "id": row[0],
-                        "name": row[1],
-                        "room": row[2],
-                        "remainingPercentage": float(row[3]) if row[3] else 0,
-                        "lastChecked": row[4].strftime("%I:%M %p") if row[4] else "",
-                        "status": row[5],
-                        "currentDripVolume": row[6]
-                    })
-                
+                cursor.execute(f"UPDATE alerts SET read = TRUE WHERE read = FALSE AND {condition}", params)
+                updated = cursor.rowcount
+                conn.commit()
                 cursor.close()
-                
+
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
                 self.end_headers()
-                self.wfile.write(json.dumps(patients).encode())
-                
+                self.wfile.write(json.dumps({"status": "success", "updated": updated}).encode())
+
             except Exception as e:
-                print(f"❌ Get patients error: {e}")
+                log.event('request_error', "❌ Mark alerts read error: {error}", error=str(e))
+                conn.rollback()
                 self.send_response(500)
                 self.send_header('Content-Type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
@@ -306,6 +1515,8 @@ class RequestHandler(BaseHTTPRequestHandler):
                     VALUES (%s, %s, %s, %s, %s)
                 """, (patient_id, updated_by, 'status_override', datetime.now(), f'Status changed to {new_status}'))
                 
+                event_bus.publish(cursor, 'status', patient_id, status=new_status, updatedBy=updated_by)
+                
                 conn.commit()
                 cursor.close()
                 
@@ -316,7 +1527,44 @@ class RequestHandler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps({"status": "success"}).encode())
                 
             except Exception as e:
-                print(f"❌ Status update error: {e}")
+                log.event('request_error', "❌ Status update error: {error}", error=str(e))
+                conn.rollback()
+                self.send_response(500)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": str(e)}).encode())
+            finally:
+                conn.close()
+
+    def handle_patient_discharge(self):
+        """Record a discharge; the patient's readings are archived ARCHIVE_AFTER_DAYS later"""
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        data = json.loads(post_data.decode('utf-8'))
+
+        conn = get_db_connection()
+        if conn:
+            try:
+                cursor = conn.cursor()
+                patient_id = data['patientId']
+                discharged_at = datetime.fromisoformat(data['dischargedAt']) if data.get('dischargedAt') else datetime.now()
+                cursor.execute("UPDATE patients SET discharged_at = %s WHERE id = %s", (discharged_at, patient_id))
+                found = cursor.rowcount == 1
+                conn.commit()
+                cursor.close()
+
+                self.send_response(200 if found else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Access-Control-Allow-Origin', '*')
+                self.end_headers()
+                if found:
+                    self.wfile.write(json.dumps({"status": "success", "dischargedAt": discharged_at.isoformat()}).encode())
+                else:
+                    self.wfile.write(json.dumps({"error": f"Patient {patient_id} not found"}).encode())
+
+            except Exception as e:
+                log.event('request_error', "❌ Discharge error: {error}", error=str(e))
                 conn.rollback()
                 self.send_response(500)
                 self.send_header('Content-Type', 'application/json')
@@ -336,10 +1584,89 @@ def get_local_ip():
     except:
         return "localhost"
 
+# Pre-fork mode: WORKERS processes share one port through SO_REUSEPORT
+WORKERS = int(os.getenv('WORKERS', '1'))
+SHARED_STATE_SLOTS = int(os.getenv('SHARED_STATE_SLOTS', '8192'))
+
+class ReusePortHTTPServer(ThreadingHTTPServer):
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+def serve_worker(server_address):
+    """Worker process body: bind its own socket on the shared port and serve"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    httpd = ReusePortHTTPServer(server_address, RequestHandler)
+    # On SIGTERM, stop accepting and let in-flight requests finish: a request
+    # killed inside a shared-state write would leave its slot mid-write for
+    # every other worker. shutdown() waits for serve_forever to return, so it
+    # cannot run on the main thread that the handler interrupts
+    httpd.daemon_threads = False
+    httpd.block_on_close = True
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown, daemon=True).start())
+    event_bus.start()
+    start_scheduler()
+    start_spill_replayer()
+    start_archiver()
+    httpd.serve_forever()
+    stopping.set()
+    httpd.server_close()
+    # Compressors are shared with the other workers; the parent flushes them
+    # once every worker has stopped. fork_worker ends with os._exit, which
+    # would drop whatever the log writer thread has not written yet
+    log.flush()
+
+def fork_worker(server_address):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve_worker(server_address)
+        finally:
+            os._exit(0)
+    return pid
+
+def start_workers(server_address):
+    """Move per-device state into shared memory and fork the workers; returns their pids.
+
+    SO_REUSEPORT spreads one scale's uploads over the workers, so everything
+    that must see all of them (dedup window, filters, compressor, last
+    status, live state) lives in the shared tables, each with its own lock.
+    """
+    global live_state, sequence_window, filter_bank, compressors
+    live_state = SharedLiveState(SHARED_STATE_SLOTS, multiprocessing.Lock())
+    sequence_window = SharedSequenceWindow(SHARED_STATE_SLOTS, multiprocessing.Lock())
+    filter_bank = SharedFilterBank(os.getenv('FILTER_CONFIG_FILE'), SHARED_STATE_SLOTS, multiprocessing.Lock())
+    compressors = SharedCompressorStore(COMPRESSION_TOLERANCE_KG, COMPRESSION_MAX_GAP_S,
+                                        SHARED_STATE_SLOTS, multiprocessing.Lock())
+    seed_sequence_window()
+    return [fork_worker(server_address) for _ in range(WORKERS)]
+
+def supervise_workers(workers, server_address):
+    """Replace any worker that exits until the server is stopped"""
+    while True:
+        pid, status = os.wait()
+        if pid not in workers:
+            continue
+        print(f"⚠️ Worker {pid} exited (status {status}); starting a new one")
+        time.sleep(1)   # a worker that dies on startup must not spin the parent
+        workers[workers.index(pid)] = fork_worker(server_address)
+
+def stop_on_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
 def run_server():
     port = int(os.environ.get('PORT', 8000))
     server_address = ('0.0.0.0', port)
-    httpd = HTTPServer(server_address, RequestHandler)
+    if WORKERS > 1:
+        workers = start_workers(server_address)
+    else:
+        # Threaded so a long export or history query does not hold up the scales
+        httpd = ThreadingHTTPServer(server_address, RequestHandler)
+        seed_sequence_window()
+        event_bus.start()
+        start_scheduler()
+        start_spill_replayer()
+        start_archiver()
     
     local_ip = get_local_ip()
     server_url = f"http://{local_ip}:{port}"
@@ -350,20 +1677,47 @@ def run_server():
     print(f'🔗 API Endpoints: {server_url}/api/*')
     print('=' * 50)
     print('🗄️ PostgreSQL Integration Active')
+    if WORKERS > 1:
+        print(f'⚙️ Pre-fork mode: {WORKERS} worker processes, shared device state')
     print('📋 Features:')
     print('   ✅ Real-time weight monitoring')
     print('   ✅ Drip replacement logging')
     print('   ✅ Patient status management')
     print('   ✅ Emergency overrides')
     print('   ✅ Alert system')
+    print(f'   ✅ Offline scale detection ({SENSOR_TIMEOUT_S:.0f}s)')
+    if instrumentation.active:
+        print(f'   🔬 Profiling {instrumentation.sample_rate:.0%} of requests, slow log from {instrumentation.slow_ms} ms')
     print('=' * 50)
     print('⏳ Ready to receive data...')
     print('Press Ctrl+C to stop the server')
     
     try:
-        httpd.serve_forever()
+        signal.signal(signal.SIGTERM, stop_on_sigterm)
+        if WORKERS > 1:
+            supervise_workers(workers, server_address)
+        else:
+            httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 Shutting down server...")
+    finally:
+        if WORKERS > 1:
+            # Signal every worker first so they drain in parallel
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid in workers:
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+        flush_compressors()
+        if WORKERS > 1:
+            for table in (live_state.table, sequence_window.table, filter_bank.table, compressors.table):
+                table.close(unlink=True)
+        log.flush()
 
 if __name__ == '__main__':
     run_server()
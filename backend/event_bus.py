@@ -0,0 +1,117 @@
+"""Cluster-wide event fan-out over PostgreSQL LISTEN/NOTIFY.
+
+Handlers publish small JSON events with pg_notify() inside their own
+transaction, so an event goes out only if the change commits. Every server
+process runs one listener thread on a dedicated connection, which hands the
+events to that process's local subscribers (e.g. SSE clients).
+
+State events arriving in a burst are coalesced: within one dispatch window
+only the newest status event per patient is delivered. Alerts and drip
+replacements are occurrences, not state, and are all delivered in order.
+"""
+import json
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+CHANNEL = 'caretrax_events'
+
+# How long the listener keeps collecting a burst before dispatching it
+COALESCE_WINDOW_S = 0.05
+
+# Event types that carry a patient's current state; only the newest counts
+STATE_EVENTS = ('status',)
+
+# Reconnect delay bounds when the listener loses its connection
+RECONNECT_MIN_S = 1
+RECONNECT_MAX_S = 30
+
+
+class EventBus:
+    def __init__(self, connect, channel=CHANNEL):
+        self.connect = connect
+        self.channel = channel
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self, callback):
+        """Call callback(event) for every event; returns an unsubscribe function"""
+        with self.lock:
+            self.subscribers.append(callback)
+
+        def unsubscribe():
+            with self.lock:
+                if callback in self.subscribers:
+                    self.subscribers.remove(callback)
+        return unsubscribe
+
+    def publish(self, cursor, event_type, patient_id, **fields):
+        """Queue an event on the caller's transaction; it is sent on commit"""
+        payload = dict(fields, type=event_type, patientId=patient_id)
+        cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, json.dumps(payload, separators=(',', ':'))))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.listen_forever, name='event-bus', daemon=True)
+            self.thread.start()
+
+    def listen_forever(self):
+        delay = RECONNECT_MIN_S
+        while True:
+            conn = None
+            try:
+                conn = self.connect()
+                if conn is None:
+                    raise psycopg2.OperationalError("no connection")
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {self.channel}")
+                delay = RECONNECT_MIN_S
+                self.listen(conn)
+            except Exception as e:
+                print(f"❌ Event bus listener error: {e}; reconnecting in {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_S)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def listen(self, conn):
+        while True:
+            if select.select([conn], [], [], 30) == ([], [], []):
+                continue
+            conn.poll()
+            if not conn.notifies:
+                continue
+
+            # Let the rest of a burst arrive, then keep the newest state per patient
+            time.sleep(COALESCE_WINDOW_S)
+            conn.poll()
+            pending = {}
+            for i, notify in enumerate(conn.notifies):
+                try:
+                    event = json.loads(notify.payload)
+                except ValueError:
+                    continue
+                if event.get('type') in STATE_EVENTS:
+                    key = (event.get('type'), event.get('patientId'))
+                else:
+                    key = i
+                pending.pop(key, None)
+                pending[key] = event
+            conn.notifies.clear()
+            self.dispatch(pending.values())
+
+    def dispatch(self, events):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for event in events:
+            for callback in subscribers:
+                try:
+                    callback(event)
+                except Exception as e:
+                    print(f"❌ Event subscriber error: {e}")
@@ -0,0 +1,177 @@
+"""Noise filtering and outlier rejection for HX711 readings.
+
+Each device keeps a small window of its recent raw readings. New readings
+(one, or a whole batch upload) are filtered in a single vectorized pass over
+that window, so a knock on the pole does not reach the status engine.
+
+Supported stages, applied in the configured order:
+    hampel  - replace readings further than n_sigmas * MAD (at least min_deviation)
+              from the window median
+    median  - rolling median over the window
+    kalman  - random-walk Kalman filter (process variance q, measurement variance r)
+"""
+import json
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_FILTER_CONFIG = {
+    "filters": ["hampel"],
+    "window": 7,
+    "n_sigmas": 3.0,
+    "min_deviation": 0.002,
+    "kalman_q": 1e-7,
+    "kalman_r": 1e-5,
+}
+
+# Scale factor that makes the MAD a consistent estimate of the standard deviation
+MAD_SCALE = 1.4826
+
+STAGES = ("hampel", "median", "kalman")
+
+# Longest window; pre-fork mode keeps each device's history in a fixed-size slot
+MAX_WINDOW = 64
+
+
+def validate_config(config):
+    """Raise ValueError if a complete filter config cannot be used"""
+    if isinstance(config["filters"], str) or not all(stage in STAGES for stage in config["filters"]):
+        raise ValueError(f"filters must be a list of {', '.join(STAGES)}: {config['filters']!r}")
+    window = config["window"]
+    if isinstance(window, bool) or not isinstance(window, int) or not 1 <= window <= MAX_WINDOW:
+        raise ValueError(f"window must be an integer from 1 to {MAX_WINDOW}: {window!r}")
+    checks = (("n_sigmas", lambda v: v > 0, "> 0"), ("min_deviation", lambda v: v >= 0, ">= 0"),
+              ("kalman_q", lambda v: v >= 0, ">= 0"), ("kalman_r", lambda v: v > 0, "> 0"))
+    for key, ok, requirement in checks:
+        value = config[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value) or not ok(value):
+            raise ValueError(f"{key} must be a finite number {requirement}: {value!r}")
+
+
+def rolling_windows(history, values, window):
+    """Trailing windows ending at each new value, as an (n, window) view"""
+    padded = np.concatenate((history, values))
+    missing = len(values) + window - 1 - len(padded)
+    if missing > 0:
+        # A new device has no history yet: repeat its first reading
+        padded = np.concatenate((np.full(missing, padded[0]), padded))
+    return sliding_window_view(padded, window)[-len(values):]
+
+
+def hampel(history, values, window, n_sigmas, min_deviation):
+    windows = rolling_windows(history, values, window)
+    medians = np.median(windows, axis=1)
+    mad = MAD_SCALE * np.median(np.abs(windows - medians[:, None]), axis=1)
+    # A quiet scale has a MAD of zero; never flag changes below min_deviation
+    outliers = np.abs(values - medians) > np.maximum(n_sigmas * mad, min_deviation)
+    return np.where(outliers, medians, values)
+
+
+def rolling_median(history, values, window):
+    return np.median(rolling_windows(history, values, window), axis=1)
+
+
+def kalman(values, estimate, variance, q, r):
+    """Scalar random-walk Kalman filter over a batch.
+
+    Returns (filtered, last_estimate, last_variance).
+    """
+    n = len(values)
+    if estimate is None:
+        estimate, variance = values[0], r
+
+    filtered = np.empty(n)
+    for i, z in enumerate(values.tolist()):
+        predicted = variance + q
+        gain = predicted / (predicted + r)
+        estimate += gain * (z - estimate)
+        variance = (1 - gain) * predicted
+        filtered[i] = estimate
+
+    return filtered, estimate, variance
+
+
+class DeviceFilter:
+    """Filter state for one scale"""
+
+    def __init__(self, config):
+        self.config = dict(DEFAULT_FILTER_CONFIG, **config)
+        validate_config(self.config)
+        self.history = np.empty(0)
+        self.estimate = None
+        self.variance = None
+        self.lock = threading.Lock()
+
+    def process(self, raw):
+        """Filter an array of raw readings (oldest first) and return the filtered array"""
+        values = np.asarray(raw, dtype=np.float64)
+        if values.size == 0:
+            return values
+
+        with self.lock:
+            return self._process(values)
+
+    def _process(self, values):
+        window = int(self.config["window"])
+        filtered = values
+        for stage in self.config["filters"]:
+            if stage == "hampel":
+                filtered = hampel(self.history, filtered, window,
+                                  self.config["n_sigmas"], self.config["min_deviation"])
+            elif stage == "median":
+                filtered = rolling_median(self.history, filtered, window)
+            elif stage == "kalman":
+                filtered, self.estimate, self.variance = kalman(
+                    filtered, self.estimate, self.variance,
+                    self.config["kalman_q"], self.config["kalman_r"]
+                )
+            else:
+                raise ValueError(f"Unknown filter stage: {stage}")
+
+        # Outlier decisions look at the raw signal, not at earlier output
+        self.history = np.concatenate((self.history, values))[-(window - 1):] if window > 1 else np.empty(0)
+        return filtered
+
+
+class FilterBank:
+    """Per-device filters, configured from a JSON file.
+
+    The file looks like {"default": {...}, "devices": {"<device_id>": {...}}};
+    any key left out falls back to DEFAULT_FILTER_CONFIG.
+    """
+
+    def __init__(self, config_path=None):
+        self.default_config = {}
+        self.device_configs = {}
+        self.filters = {}
+        self.lock = threading.Lock()
+        if config_path:
+            with open(config_path) as f:
+                config = json.load(f)
+            self.default_config = config.get("default", {})
+            self.device_configs = config.get("devices", {})
+        # A bad value fails at startup rather than on a device's first upload
+        validate_config(dict(DEFAULT_FILTER_CONFIG, **self.default_config))
+        for device_id, device_config in self.device_configs.items():
+            try:
+                validate_config(dict(DEFAULT_FILTER_CONFIG, **self.default_config, **device_config))
+            except ValueError as e:
+                raise ValueError(f"filter config for device {device_id}: {e}") from None
+
+    def device_filter(self, device_id):
+        with self.lock:
+            device_filter = self.filters.get(device_id)
+            if device_filter is None:
+                config = dict(self.default_config, **self.device_configs.get(device_id, {}))
+                device_filter = DeviceFilter(config)
+                self.filters[device_id] = device_filter
+        return device_filter
+
+    def process(self, device_id, raw):
+        return self.device_filter(device_id).process(raw)
+
+    def reset(self, device_id):
+        """Forget a device's filter state, e.g. when its bag is replaced"""
+        with self.lock:
+            self.filters.pop(device_id, None)
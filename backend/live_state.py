@@ -0,0 +1,146 @@
+"""In-memory live state per patient.
+
+Holds the newest filtered weight, percentage and status for each bed, plus a
+smoothed consumption rate used to estimate when the bag runs empty. Readers
+get a copy, so they never see a half-updated entry.
+
+LiveState keeps entries in a dict for a single process; shared_state.py
+provides the same interface over shared memory for pre-fork mode.
+"""
+import threading
+
+# The consumption rate is measured over spans of at least this many seconds;
+# over a single 2 s reading the sensor noise would swamp the drain
+RATE_SPAN_S = 300
+
+# Weight of each new span in the smoothed rate
+RATE_SMOOTHING = 0.5
+
+# A rise bigger than this (kg) between readings is a new bag, not noise
+REFILL_THRESHOLD_KG = 0.05
+
+
+def new_entry(weight, timestamp, seq=None):
+    return {"weight": weight, "timestamp": timestamp, "seq": seq, "percentage": None,
+            "status": None, "rate": None, "anchor": (timestamp, weight),
+            "stale": False, "overdue": False}
+
+
+def apply_reading(entry, weight, timestamp, seq=None):
+    """Advance an entry by one reading, updating the consumption rate"""
+    if entry is None:
+        return new_entry(weight, timestamp, seq)
+
+    anchor_time, anchor_weight = entry["anchor"]
+    span = (timestamp - anchor_time).total_seconds()
+    if weight - entry["weight"] > REFILL_THRESHOLD_KG:
+        entry["rate"] = None
+        entry["anchor"] = (timestamp, weight)
+        entry["overdue"] = False
+    elif span >= RATE_SPAN_S:
+        rate = (anchor_weight - weight) / span
+        if entry["rate"] is None:
+            entry["rate"] = rate
+        else:
+            entry["rate"] += RATE_SMOOTHING * (rate - entry["rate"])
+        entry["anchor"] = (timestamp, weight)
+    entry["weight"] = weight
+    entry["timestamp"] = timestamp
+    entry["stale"] = False
+    if seq is not None:
+        entry["seq"] = seq
+    return entry
+
+
+class BaseLiveState:
+    """Live-state operations on top of a storage-specific modify()/get()"""
+
+    def modify(self, patient_id, fn, touch=False):
+        """Replace the entry with fn(entry or None); None from fn leaves it as is"""
+        raise NotImplementedError
+
+    def get(self, patient_id):
+        raise NotImplementedError
+
+    def latest(self):
+        """The entry that received the most recent reading, or None"""
+        raise NotImplementedError
+
+    def update(self, patient_id, weight, timestamp, seq=None):
+        """Record a new reading"""
+        self.modify(patient_id, lambda entry: apply_reading(entry, weight, timestamp, seq), touch=True)
+
+    def set_status(self, patient_id, percentage, status):
+        """Record the status engine's verdict for the newest reading"""
+        if status is None:
+            return
+
+        def apply(entry):
+            if entry:
+                entry["percentage"] = percentage
+                entry["status"] = status
+            return entry
+        self.modify(patient_id, apply)
+
+    def reset_rate(self, patient_id):
+        """Forget the consumption rate, e.g. after a drip replacement"""
+        def apply(entry):
+            if entry:
+                entry["rate"] = None
+                entry["anchor"] = (entry["timestamp"], entry["weight"])
+                entry["overdue"] = False
+            return entry
+        self.modify(patient_id, apply)
+
+    def claim(self, patient_id, flag, condition):
+        """Set a flag ("stale", "overdue") if it is clear and condition(entry) holds.
+
+        Returns True only for the caller that set it, so an alert raised on
+        expiry fires once even with several processes watching.
+        """
+        claimed = []
+
+        def apply(entry):
+            if entry and not entry[flag] and condition(entry):
+                entry[flag] = True
+                claimed.append(True)
+                return entry
+            return None
+        self.modify(patient_id, apply)
+        return bool(claimed)
+
+    def seconds_to_empty(self, patient_id):
+        """Estimated seconds until the bag is empty, or None if not draining"""
+        return seconds_to_empty(self.get(patient_id))
+
+
+def seconds_to_empty(entry):
+    """Seconds from the entry's last reading until the bag is empty, or None"""
+    if not entry or not entry["rate"] or entry["rate"] <= 0:
+        return None
+    return max(0.0, entry["weight"] / entry["rate"])
+
+
+class LiveState(BaseLiveState):
+    def __init__(self):
+        self.entries = {}
+        self.latest_id = None
+        self.lock = threading.Lock()
+
+    def modify(self, patient_id, fn, touch=False):
+        with self.lock:
+            entry = fn(self.entries.get(patient_id))
+            if entry is not None:
+                self.entries[patient_id] = entry
+                if touch:
+                    self.latest_id = patient_id
+
+    def get(self, patient_id):
+        with self.lock:
+            entry = self.entries.get(patient_id)
+            return dict(entry) if entry else None
+
+    def latest(self):
+        with self.lock:
+            entry = self.entries.get(self.latest_id)
+            return dict(entry, patient_id=self.latest_id) if entry else None
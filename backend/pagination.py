@@ -0,0 +1,47 @@
+"""Keyset (cursor) pagination helpers.
+
+A cursor is the sort key of the last row on a page, JSON encoded and
+base64url wrapped so clients treat it as opaque. The next page starts
+strictly after that key, so page cost does not grow with table size.
+"""
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """Return the key stored in a cursor, or None for a missing cursor.
+
+    The key must be a list with one value of each of `types`; anything else
+    (a tampered or truncated cursor) raises ValueError.
+    """
+    if not cursor:
+        return None
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if (not isinstance(key, list) or len(key) != len(types)
+            or not all(isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(key, types))):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def parse_limit(query, default=DEFAULT_PAGE_SIZE):
+    """Page size from a parse_qs() dict, clamped to 1..MAX_PAGE_SIZE"""
+    limit = int(query.get('limit', [default])[0])
+    return max(1, min(MAX_PAGE_SIZE, limit))
+
+
+def parse_bool(query, name):
+    """A true/false query flag, or None when absent"""
+    if name not in query:
+        return None
+    return query[name][0].lower() in ('1', 'true', 'yes')
@@ -0,0 +1,191 @@
+"""Opt-in request instrumentation.
+
+Three independent tools, all off unless configured:
+
+- PROFILE_SAMPLE_RATE: fraction of requests run under cProfile; the samples
+  are merged into one profile, served by /admin/profile.
+- SLOW_REQUEST_MS: requests slower than this are recorded with their route,
+  total time and the time of every SQL statement they executed, served by
+  /admin/slow-requests and appended to PROFILE_DIR/slow-requests.ndjson.
+- tracemalloc, started and snapshotted on demand from /admin/tracemalloc.
+
+When profiling and the slow log are off, an instrumented handler costs one
+attribute check per request and connections use psycopg2's plain cursor.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+from functools import wraps
+from urllib.parse import urlparse
+
+import psycopg2.extensions
+
+SLOW_LOG_SIZE = 200
+SQL_PREVIEW_CHARS = 200
+
+
+def route_of(path):
+    """Collapse ids out of a request path so requests group by route"""
+    path = urlparse(path).path
+    if path.startswith('/api/patient/'):
+        return '/api/patient/<id>'
+    return path
+
+
+# The slow-log record of the request running on this thread, if any
+_current = threading.local()
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports each statement's time to the current request"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record = getattr(_current, 'record', None)
+            if record is not None:
+                statement = query if isinstance(query, str) else query.decode(errors='replace')
+                record["sql"].append({
+                    "statement": " ".join(statement.split())[:SQL_PREVIEW_CHARS],
+                    "ms": round((time.perf_counter() - started) * 1000, 3),
+                })
+
+
+class Instrumentation:
+    def __init__(self, sample_rate=0.0, slow_ms=None, output_dir=None, skip=('/stream', '/admin/')):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.output_dir = output_dir
+        self.skip = skip
+        self.active = sample_rate > 0 or slow_ms is not None
+        self.slow_requests = deque(maxlen=SLOW_LOG_SIZE)
+        self.lock = threading.Lock()
+        self.profile_lock = threading.Lock()
+        self.stats = None
+        self.profiled = 0
+        self.snapshot = None
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        slow_ms = os.getenv('SLOW_REQUEST_MS')
+        return cls(
+            sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+            slow_ms=float(slow_ms) if slow_ms else None,
+            output_dir=os.getenv('PROFILE_DIR'),
+        )
+
+    @property
+    def cursor_factory(self):
+        """Cursor class for new connections; None keeps psycopg2's default"""
+        return TimedCursor if self.slow_ms is not None else None
+
+    def instrument(self, method):
+        """Decorate a do_GET/do_POST handler method"""
+        @wraps(method)
+        def wrapper(handler):
+            if not self.active:
+                return method(handler)
+            route = route_of(handler.path)
+            if route.startswith(self.skip):
+                return method(handler)
+            return self.run(method, handler, route)
+        return wrapper
+
+    def run(self, method, handler, route):
+        record = {"method": handler.command, "route": route, "sql": []} if self.slow_ms is not None else None
+        _current.record = record
+
+        # cProfile cannot nest, so at most one request is profiled at a time
+        profiler = None
+        if self.sample_rate > 0 and random.random() < self.sample_rate and self.profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        started = time.perf_counter()
+        try:
+            return method(handler)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _current.record = None
+            if profiler is not None:
+                profiler.disable()
+                with self.lock:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profiler)
+                    else:
+                        self.stats.add(profiler)
+                    self.profiled += 1
+                self.profile_lock.release()
+            if record is not None and elapsed_ms >= self.slow_ms:
+                self.log_slow(record, elapsed_ms)
+
+    def log_slow(self, record, elapsed_ms):
+        sql_ms = sum(s["ms"] for s in record["sql"])
+        record.update(
+            timestamp=datetime.now().isoformat(),
+            ms=round(elapsed_ms, 3),
+            sqlMs=round(sql_ms, 3),
+            otherMs=round(elapsed_ms - sql_ms, 3),
+        )
+        self.slow_requests.append(record)
+        if self.output_dir:
+            with self.lock, open(os.path.join(self.output_dir, 'slow-requests.ndjson'), 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def profile_report(self, sort='cumulative', limit=40, reset=False, dump=False):
+        """Text report of the merged profile; optionally save it as a .prof file"""
+        with self.lock:
+            if self.stats is None:
+                return "No requests profiled yet (set PROFILE_SAMPLE_RATE)\n"
+            out = io.StringIO()
+            out.write(f"{self.profiled} profiled request(s)\n")
+            if dump and self.output_dir:
+                path = os.path.join(self.output_dir, f"profile-{datetime.now():%Y%m%d-%H%M%S}.prof")
+                self.stats.dump_stats(path)
+                out.write(f"Saved to {path}\n")
+            self.stats.stream = out
+            self.stats.sort_stats(sort).print_stats(limit)
+            if reset:
+                self.stats, self.profiled = None, 0
+            return out.getvalue()
+
+    def tracemalloc_action(self, action, limit=25):
+        """start / stop tracing, or take a snapshot (diffed against the previous one)"""
+        if action == 'start':
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(int(os.getenv('TRACEMALLOC_FRAMES', '1')))
+            return {"tracing": True}
+        if action == 'stop':
+            tracemalloc.stop()
+            self.snapshot = None
+            return {"tracing": False}
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not running; use action=start first")
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        result = {"tracing": True, "currentBytes": current, "peakBytes": peak}
+        if self.snapshot is not None:
+            result["sincePrevious"] = [str(stat) for stat in snapshot.compare_to(self.snapshot, 'lineno')[:limit]]
+        result["top"] = [str(stat) for stat in snapshot.statistics('lineno')[:limit]]
+        if self.output_dir:
+            path = os.path.join(self.output_dir, f"tracemalloc-{datetime.now():%Y%m%d-%H%M%S}.snapshot")
+            snapshot.dump(path)
+            result["savedTo"] = path
+        self.snapshot = snapshot
+        return result
@@ -0,0 +1,85 @@
+"""Hierarchical timing wheel for per-device deadlines.
+
+Every reading pushes its device's deadline forward, which is an O(1)
+cancel-and-insert. The wheel advances one tick at a time and each tick only
+touches the timers that expire in it (plus occasional cascades from coarser
+levels), so work per tick is O(expired), not O(devices).
+
+Level L has SLOTS buckets, each covering SLOTS**L ticks. A timer goes in the
+finest level whose block it shares with the current tick, and moves down a
+level when the wheel reaches the start of its block.
+"""
+import threading
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS
+LEVELS = 5
+
+
+class TimingWheel:
+    def __init__(self, tick_seconds, now):
+        self.tick_seconds = tick_seconds
+        self.current = int(now // tick_seconds)
+        self.levels = [[{} for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self.where = {}     # key -> (level, slot)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.where)
+
+    def schedule(self, key, deadline, payload=None):
+        """(Re)arm key to fire at deadline (seconds, same clock as advance())"""
+        tick = -(-deadline // self.tick_seconds)    # round up
+        with self.lock:
+            self._remove(key)
+            self._insert(key, int(tick), payload)
+
+    def cancel(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def advance(self, now):
+        """Move the wheel up to now; returns [(key, payload)] for expired timers"""
+        target = int(now // self.tick_seconds)
+        expired = []
+        with self.lock:
+            while self.current < target:
+                self.current += 1
+                for level in range(LEVELS - 1, 0, -1):
+                    if self.current & ((1 << (SLOT_BITS * level)) - 1) == 0:
+                        self._cascade(level, (self.current >> (SLOT_BITS * level)) & (SLOTS - 1))
+                bucket = self.levels[0][self.current & (SLOTS - 1)]
+                for key, (_, payload) in bucket.items():
+                    del self.where[key]
+                    expired.append((key, payload))
+                bucket.clear()
+        return expired
+
+    def _insert(self, key, tick, payload, earliest=None):
+        tick = max(tick, self.current + 1 if earliest is None else earliest)
+        for level in range(LEVELS):
+            shift = SLOT_BITS * (level + 1)
+            if tick >> shift == self.current >> shift:
+                break
+        else:
+            # Beyond the top level's horizon: park at the end of the current block
+            level = LEVELS - 1
+            tick = (((self.current >> (SLOT_BITS * LEVELS)) + 1) << (SLOT_BITS * LEVELS)) - 1
+        slot = (tick >> (SLOT_BITS * level)) & (SLOTS - 1)
+        self.levels[level][slot][key] = (tick, payload)
+        self.where[key] = (level, slot)
+
+    def _remove(self, key):
+        location = self.where.pop(key, None)
+        if location:
+            level, slot = location
+            del self.levels[level][slot][key]
+
+    def _cascade(self, level, slot):
+        bucket = self.levels[level][slot]
+        entries = list(bucket.items())
+        bucket.clear()
+        for key, (tick, payload) in entries:
+            del self.where[key]
+            # The current tick's level-0 bucket has not been expired yet
+            self._insert(key, tick, payload, earliest=self.current)
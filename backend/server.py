@@ -3,11 +3,15 @@ import os
 import socket
 import psycopg2
 from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import jwt
 import bcrypt
 from urllib.parse import urlparse, parse_qs
 import threading
+import queue
+from event_bus import EventBus
+from admission import AdmissionController, RouteClass
+from async_log import AsyncLog
 
 # Database connection
 def get_db_connection():
@@ -16,7 +20,8 @@ def get_db_connection():
         database=os.getenv('DB_NAME', 'caretrax'),
         user=os.getenv('DB_USER', 'postgres'),
         password=os.getenv('DB_PASSWORD', 'password'),
-        port=os.getenv('DB_PORT', '5432')
+        port=os.getenv('DB_PORT', '5432'),
+        connect_timeout=int(os.getenv('DB_CONNECT_TIMEOUT_S', '5'))
     )
 
 # Initialize database tables
@@ -146,15 +151,101 @@ def init_database():
         )
     ''')
     
+    # Drip replacement as a single server-side unit: serialise on the patient,
+    # end the old drip, start the new one and log it, all in one round trip
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION replace_managed_drip(
+            p_patient_id VARCHAR,
+            p_old_drip_id INTEGER,
+            p_replacement_time TIMESTAMP,
+            p_flow_rate FLOAT,
+            p_substance VARCHAR,
+            p_reason TEXT,
+            p_staff_id VARCHAR
+        )
+        RETURNS INTEGER AS $$
+        DECLARE
+            v_new_drip_id INTEGER;
+        BEGIN
+            -- drip_management patients need not have a patients row, so
+            -- concurrent replacements for one patient queue on a lock instead
+            PERFORM pg_advisory_xact_lock(hashtext('replace_managed_drip:' || p_patient_id));
+
+            UPDATE drip_management
+            SET end_time = p_replacement_time, status = 'replaced'
+            WHERE patient_id = p_patient_id AND id = p_old_drip_id AND status = 'active';
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Drip % is not active for patient %', p_old_drip_id, p_patient_id
+                    USING ERRCODE = 'no_data_found';
+            END IF;
+
+            INSERT INTO drip_management (patient_id, start_time, flow_rate, substance)
+            VALUES (p_patient_id, p_replacement_time, p_flow_rate, p_substance)
+            RETURNING id INTO v_new_drip_id;
+
+            INSERT INTO drip_replacement_log (patient_id, old_drip_id, new_drip_id, replacement_time, reason, staff_id)
+            VALUES (p_patient_id, p_old_drip_id, v_new_drip_id, p_replacement_time, p_reason, p_staff_id);
+
+            PERFORM pg_notify('caretrax_events', json_build_object(
+                'type', 'drip_replaced', 'patientId', p_patient_id, 'dripId', v_new_drip_id
+            )::text);
+
+            RETURN v_new_drip_id;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+
     conn.commit()
     cursor.close()
     conn.close()
 
+# Request-path logging goes through a queue; see async_log.py
+log = AsyncLog.from_env()
+
 # Store the latest weight data (for backward compatibility)
 latest_weight = {"weight": 0, "timestamp": datetime.now().isoformat()}
 
 # Dictionary to store connected clients for real-time updates
-connected_clients = {}
+# Server-sent event clients connected to this process, one queue each
+STREAM_QUEUE_SIZE = 100
+stream_clients = set()
+stream_clients_lock = threading.Lock()
+
+def broadcast_status_update(event):
+    """Event bus subscriber: push an event from any server node to this node's stream clients"""
+    if event.get("type") == "status":
+        message = json.dumps({"patient_id": event["patientId"], "status": event["status"]})
+    else:
+        message = json.dumps(event)
+    with stream_clients_lock:
+        clients = list(stream_clients)
+    for client in clients:
+        try:
+            client.put_nowait(message)
+        except queue.Full:
+            pass  # a stalled client misses events rather than holding up the rest
+
+# Status changes reach every node's stream clients through LISTEN/NOTIFY
+event_bus = EventBus(get_db_connection)
+event_bus.subscribe(broadcast_status_update)
+
+# Admission control: scale uploads first, then sign-ins, then everything else
+DB_CONCURRENCY = int(os.getenv('DB_CONCURRENCY', '20'))
+admission = AdmissionController(DB_CONCURRENCY, [
+    RouteClass('ingest', priority=3, limit=DB_CONCURRENCY, queue=200, wait_s=3, retry_after_s=2),
+    RouteClass('auth', priority=2, limit=int(os.getenv('AUTH_CONCURRENCY', '4')), queue=20, wait_s=2, retry_after_s=3),
+    RouteClass('reads', priority=1, limit=int(os.getenv('READ_CONCURRENCY', '8')), queue=20, wait_s=0.5, retry_after_s=5),
+])
+
+def classify_request(handler):
+    """Route class of a request, or None for ones that never touch the database"""
+    if handler.path == '/':
+        return 'ingest'
+    if handler.path.startswith('/api/auth/'):
+        return 'auth'
+    if handler.path in ('/weight', '/stream'):
+        return None
+    return 'reads'
 
 class RequestHandler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
@@ -164,39 +255,11 @@ class RequestHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
         self.end_headers()
 
+    @admission.guard(classify_request)
     def do_POST(self):
         try:
             if self.path == '/':
-                # Original weight endpoint for Arduino
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode('utf-8'))
-                
-                global latest_weight
-                latest_weight = {
-                    "weight": data.get("weight", 0),
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-                # Save to database
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO weight_data (weight, timestamp) VALUES (%s, %s)",
-                    (latest_weight["weight"], latest_weight["timestamp"])
-                )
-                conn.commit()
-                cursor.close()
-                conn.close()
-                
-                print(f"📊 Received weight: {latest_weight['weight']} ml at {latest_weight['timestamp']}")
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps({"status": "success"}).encode())
-                
+                self.handle_weight_upload()
             elif self.path == '/api/auth/login':
                 self.handle_login()
             elif self.path == '/api/auth/register':
@@ -216,6 +279,7 @@ class RequestHandler(BaseHTTPRequestHandler):
             self.send_response(500)
             self.end_headers()
 
+    @admission.guard(classify_request)
     def do_GET(self):
         try:
             if self.path == '/weight':
@@ -247,6 +311,58 @@ class RequestHandler(BaseHTTPRequestHandler):
             self.send_response(500)
             self.end_headers()
 
+    def handle_weight_upload(self):
+        """Original weight endpoint for Arduino"""
+        content_length = int(self.headers['Content-Length'])
+        post_data = self.rfile.read(content_length)
+        data = json.loads(post_data.decode('utf-8'))
+        
+        global latest_weight
+        latest_weight = {
+            "weight": data.get("weight", 0),
+            "timestamp": datetime.now().isoformat()
+        }
+        
+        # Save to database
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO weight_data (weight, timestamp) VALUES (%s, %s)",
+            (latest_weight["weight"], latest_weight["timestamp"])
+        )
+        conn.commit()
+        cursor.close()
+        conn.close()
+        
+        log.event('reading', "📊 Received weight: {weight} ml at {time}",
+                  device=data.get("device_id"), readings=1, points=1,
+                  weight=latest_weight["weight"], time=latest_weight["timestamp"])
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps({"status": "success"}).encode())
+
+    def shed(self, route_class):
+        """Answer a request turned away by admission control"""
+        if route_class.name == 'ingest':
+            # The scale counts any reply as delivered and this server has no
+            # spill log, so an upload is stored even without a slot
+            try:
+                self.handle_weight_upload()
+            except Exception as e:
+                print(f"❌ Error processing POST request: {e}")
+                self.send_response(500)
+                self.end_headers()
+            return
+        self.send_response(503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Retry-After', str(route_class.retry_after_s))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps({"error": "Server busy", "retryAfter": route_class.retry_after_s}).encode())
+
     def handle_login(self):
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
@@ -438,30 +554,16 @@ class RequestHandler(BaseHTTPRequestHandler):
 
         try:
             conn = get_db_connection()
+            # replace_managed_drip() does the whole replacement server-side,
+            # so autocommit keeps it to a single round trip
+            conn.autocommit = True
             cursor = conn.cursor()
-
-            # Stop the old drip
-            cursor.execute('''
-                UPDATE drip_management
-                SET end_time = %s, status = 'replaced'
-                WHERE patient_id = %s AND id = %s AND status = 'active'
-            ''', (data['replacementTime'], patient_id, data['old_drip_id']))
-
-            # Start the new drip
-            cursor.execute('''
-                INSERT INTO drip_management (patient_id, start_time, flow_rate, substance)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id
-            ''', (patient_id, data['replacementTime'], data['flowRate'], data['substance']))
+            cursor.execute(
+                "SELECT replace_managed_drip(%s, %s, %s, %s, %s, %s, %s)",
+                (patient_id, data['old_drip_id'], data['replacementTime'], data['flowRate'],
+                 data['substance'], data['reason'], data['staff_id'])
+            )
             new_drip_id = cursor.fetchone()[0]
-
-            # Log the replacement
-            cursor.execute('''
-                INSERT INTO drip_replacement_log (patient_id, old_drip_id, new_drip_id, replacement_time, reason, staff_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            ''', (patient_id, data['old_drip_id'], new_drip_id, data['replacementTime'], data['reason'], data['staff_id']))
-
-            conn.commit()
             cursor.close()
             conn.close()
 
@@ -534,12 +636,11 @@ class RequestHandler(BaseHTTPRequestHandler):
                 SET status = %s
                 WHERE id = %s
             ''', (status, patient_id))
+            event_bus.publish(cursor, 'status', patient_id, status=status)
             conn.commit()
             cursor.close()
             conn.close()
 
-            self.broadcast_status_update(patient_id, status)
-
             response_data = {"success": True}
             self.send_response(200)
         except Exception as e:
@@ -560,31 +661,24 @@ class RequestHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
 
-        client_address = self.client_address[0]
-        connected_clients[client_address] = self.wfile
-
+        # Each connection gets its own queue; the keep-alive write notices a
+        # closed dashboard within 15 s and ends this thread
+        messages = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with stream_clients_lock:
+            stream_clients.add(messages)
         try:
             while True:
-                # Keep the connection alive
-                import time
-                time.sleep(1)
-        except BrokenPipeError:
-            print(f"Client {client_address} disconnected")
+                try:
+                    message = messages.get(timeout=15)
+                    self.wfile.write(f"data: {message}\n\n".encode())
+                except queue.Empty:
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            print(f"Client {self.client_address[0]} disconnected")
         finally:
-            if client_address in connected_clients:
-                del connected_clients[client_address]
-
-    def broadcast_status_update(self, patient_id, status):
-        message = json.dumps({"patient_id": patient_id, "status": status})
-        for client in connected_clients.values():
-            try:
-                client.write(f"data: {message}\n\n".encode())
-                client.flush()
-            except BrokenPipeError:
-                print("Client disconnected, removing from broadcast list")
-                # Clean up disconnected clients in handle_stream instead
-            except Exception as e:
-                print(f"Error broadcasting to client: {e}")
+            with stream_clients_lock:
+                stream_clients.discard(messages)
 
 def get_local_ip():
     try:
@@ -602,7 +696,9 @@ def run_server():
     
     port = int(os.environ.get('PORT', 8000))
     server_address = ('0.0.0.0', port)
-    httpd = HTTPServer(server_address, RequestHandler)
+    # Threaded so open /stream connections don't block other requests
+    httpd = ThreadingHTTPServer(server_address, RequestHandler)
+    event_bus.start()
     
     local_ip = get_local_ip()
     server_url = f"http://{local_ip}:{port}"
@@ -0,0 +1,353 @@
+"""Per-device state shared between pre-forked worker processes: live state,
+the dedup window, filter state and compressors.
+
+Entries live in a fixed-layout hash table in multiprocessing.shared_memory,
+created by the parent before it forks. Each slot is
+
+    version (uint64) | key (KEY_SIZE bytes, UTF-8, zero-padded) | record (struct)
+
+Writers take one cross-process lock and bump the slot version to odd before
+writing and back to even after. Readers take no lock: they retry until they
+see the same even version before and after copying the slot (a seqlock), so
+/weight and /api/patients never block behind ingest. A reader that keeps
+finding the slot mid-write backs off and gives up with TimeoutError after
+READ_TIMEOUT_S, rather than spinning forever on a slot whose writer died.
+"""
+import math
+import struct
+import time
+import zlib
+from datetime import datetime
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from compression import BaseCompressorStore, SwingingDoorCompressor
+from dedup import WINDOW, WINDOW_MASK, advance
+from filters import MAX_WINDOW, FilterBank
+from live_state import BaseLiveState
+
+# patients.id and weight_data.device_id are VARCHAR(50): 50 characters of up
+# to 4 UTF-8 bytes each
+KEY_CHARS = 50
+KEY_SIZE = KEY_CHARS * 4
+SLOT_HEADER = struct.Struct(f'<Q{KEY_SIZE}s')
+VERSION = struct.Struct('<Q')
+
+# Seqlock reads: retries before backing off, and how long to keep trying
+READ_SPINS = 100
+READ_TIMEOUT_S = 0.5
+
+# Table header: version | key of the entry written most recently
+TABLE_HEADER = struct.Struct(f'<Q{KEY_SIZE}s')
+
+# weight, timestamp, anchor time, anchor weight, rate, percentage, seq, status, flags
+LIVE_RECORD = '<dddddd q16s B'
+NO_SEQ = -1
+FLAG_STALE = 1
+FLAG_OVERDUE = 2
+
+# high-water mark, bitmap of the WINDOW sequences below it
+SEQUENCE_RECORD = f'<q{WINDOW // 8}s'
+
+# Swinging-door state: stored point and held-back point (time, weight, seq),
+# door slopes, flags, last status, scale
+COMPRESSOR_RECORD = f'<ddq ddq dd B16s{KEY_SIZE}s'
+HAS_ARCHIVED = 1
+HAS_PENDING = 2
+FORCE_NEXT = 4
+
+# Filter state: history length, Kalman estimate and variance (NaN for none), history
+FILTER_RECORD = f'<Hdd{MAX_WINDOW - 1}d'
+EMPTY_FILTER = (0, math.nan, math.nan) + (0.0,) * (MAX_WINDOW - 1)
+
+
+def encode_key(key):
+    """Fixed-width slot key; overlong keys are an error, never truncated"""
+    if len(key) > KEY_CHARS or '\0' in key:
+        raise ValueError(f"Key {key[:KEY_CHARS]!r}... does not fit the shared state table")
+    return key.encode().ljust(KEY_SIZE, b'\0')
+
+
+class SharedTable:
+    def __init__(self, record_format, slots, lock):
+        self.record = struct.Struct(record_format)
+        self.slot_size = (SLOT_HEADER.size + self.record.size + 7) // 8 * 8
+        self.slots = slots
+        self.lock = lock
+        self.shm = shared_memory.SharedMemory(create=True, size=TABLE_HEADER.size + slots * self.slot_size)
+        self.buf = self.shm.buf
+        self.index = {}     # per-process cache of key -> slot offset
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    def _offset(self, key, insert=False):
+        """Slot offset for key; with insert, claim a free slot (caller holds the lock)"""
+        offset = self.index.get(key)
+        if offset is not None:
+            return offset
+
+        encoded = encode_key(key)
+        start = zlib.crc32(encoded) % self.slots
+        for probe in range(self.slots):
+            offset = TABLE_HEADER.size + ((start + probe) % self.slots) * self.slot_size
+            _, slot_key = SLOT_HEADER.unpack_from(self.buf, offset)
+            if slot_key == encoded:
+                self.index[key] = offset
+                return offset
+            if slot_key == b'\0' * KEY_SIZE:
+                if not insert:
+                    return None
+                SLOT_HEADER.pack_into(self.buf, offset, 0, encoded)
+                self.index[key] = offset
+                return offset
+        if insert:
+            raise RuntimeError("Shared state table is full")
+        return None
+
+    def _read_consistent(self, offset, unpack):
+        spins, pause, deadline = 0, 1e-5, None
+        while True:
+            before = VERSION.unpack_from(self.buf, offset)[0]
+            if not before & 1:
+                value = unpack()
+                if VERSION.unpack_from(self.buf, offset)[0] == before:
+                    return value
+            spins += 1
+            if spins < READ_SPINS:
+                continue
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + READ_TIMEOUT_S
+            elif now > deadline:
+                raise TimeoutError(f"Shared state slot at {offset} stayed mid-write for {READ_TIMEOUT_S}s")
+            time.sleep(pause)
+            pause = min(pause * 2, 0.01)
+
+    def _write(self, offset, write):
+        version = VERSION.unpack_from(self.buf, offset)[0]
+        VERSION.pack_into(self.buf, offset, version + 1)
+        write()
+        VERSION.pack_into(self.buf, offset, version + 2)
+
+    def read(self, key):
+        offset = self._offset(key)
+        if offset is None:
+            return None
+        record_offset = offset + SLOT_HEADER.size
+        record = self._read_consistent(offset, lambda: self.record.unpack_from(self.buf, record_offset))
+        return record if VERSION.unpack_from(self.buf, offset)[0] else None
+
+    def modify(self, key, fn, touch=False):
+        """Replace the record with fn(record or None); None from fn leaves it as is"""
+        with self.lock:
+            offset = self._offset(key)
+            current = None
+            if offset is not None and VERSION.unpack_from(self.buf, offset)[0]:
+                current = self.record.unpack_from(self.buf, offset + SLOT_HEADER.size)
+            record = fn(current)
+            if record is None:
+                return
+            if offset is None:
+                offset = self._offset(key, insert=True)
+            self._write(offset, lambda: self.record.pack_into(self.buf, offset + SLOT_HEADER.size, *record))
+            if touch:
+                encoded = encode_key(key)
+                self._write(0, lambda: self.buf.__setitem__(slice(VERSION.size, TABLE_HEADER.size), encoded))
+
+    def keys(self):
+        """Keys of every slot in use"""
+        keys = []
+        for slot in range(self.slots):
+            version, key = SLOT_HEADER.unpack_from(self.buf, TABLE_HEADER.size + slot * self.slot_size)
+            if version:
+                keys.append(key.rstrip(b'\0').decode())
+        return keys
+
+    def latest_key(self):
+        key = self._read_consistent(0, lambda: bytes(self.buf[VERSION.size:TABLE_HEADER.size]))
+        key = key.rstrip(b'\0')
+        return key.decode() if key else None
+
+
+def _optional(value):
+    return None if math.isnan(value) else value
+
+
+def _to_entry(record):
+    weight, timestamp, anchor_time, anchor_weight, rate, percentage, seq, status, flags = record
+    return {
+        "weight": weight,
+        "timestamp": datetime.fromtimestamp(timestamp),
+        "seq": None if seq == NO_SEQ else seq,
+        "percentage": _optional(percentage),
+        "status": status.rstrip(b'\0').decode() or None,
+        "rate": _optional(rate),
+        "anchor": (datetime.fromtimestamp(anchor_time), anchor_weight),
+        "stale": bool(flags & FLAG_STALE),
+        "overdue": bool(flags & FLAG_OVERDUE),
+    }
+
+
+def _to_record(entry):
+    return (
+        entry["weight"],
+        entry["timestamp"].timestamp(),
+        entry["anchor"][0].timestamp(),
+        entry["anchor"][1],
+        math.nan if entry["rate"] is None else entry["rate"],
+        math.nan if entry["percentage"] is None else entry["percentage"],
+        NO_SEQ if entry["seq"] is None else entry["seq"],
+        (entry["status"] or '').encode(),
+        (FLAG_STALE if entry["stale"] else 0) | (FLAG_OVERDUE if entry["overdue"] else 0),
+    )
+
+
+class SharedLiveState(BaseLiveState):
+    def __init__(self, slots, lock):
+        self.table = SharedTable(LIVE_RECORD, slots, lock)
+
+    def modify(self, patient_id, fn, touch=False):
+        def apply(record):
+            entry = fn(_to_entry(record) if record else None)
+            return _to_record(entry) if entry is not None else None
+        self.table.modify(patient_id, apply, touch)
+
+    def get(self, patient_id):
+        record = self.table.read(patient_id)
+        return _to_entry(record) if record else None
+
+    def latest(self):
+        patient_id = self.table.latest_key()
+        entry = self.get(patient_id) if patient_id else None
+        return dict(entry, patient_id=patient_id) if entry else None
+
+
+class SharedSequenceWindow:
+    """dedup.SequenceWindow over shared memory, so a retry that lands on a
+    different worker is still recognised"""
+
+    def __init__(self, slots, lock):
+        self.table = SharedTable(SEQUENCE_RECORD, slots, lock)
+
+    def seed(self, device_id, high_water_mark):
+        def apply(record):
+            if record is None or record[0] < high_water_mark:
+                return (high_water_mark, WINDOW_MASK.to_bytes(WINDOW // 8, 'little'))
+            return None
+        self.table.modify(device_id, apply)
+
+    def seen(self, device_id, seq):
+        record = self.table.read(device_id)
+        state = (record[0], int.from_bytes(record[1], 'little')) if record else None
+        return not advance(state, seq)[0]
+
+    def accept(self, device_id, seq):
+        result = []
+
+        def apply(record):
+            state = (record[0], int.from_bytes(record[1], 'little')) if record else None
+            accepted, (high, bitmap) = advance(state, seq)
+            result.append(accepted)
+            return (high, bitmap.to_bytes(WINDOW // 8, 'little')) if accepted else None
+        self.table.modify(device_id, apply)
+        return result[0]
+
+
+def _to_point(t, weight, seq):
+    return (datetime.fromtimestamp(t), weight, None if seq == NO_SEQ else seq)
+
+
+def _from_point(point):
+    if point is None:
+        return (0.0, 0.0, NO_SEQ)
+    return (point[0].timestamp(), point[1], NO_SEQ if point[2] is None else point[2])
+
+
+class SharedCompressorStore(BaseCompressorStore):
+    """compression.CompressorStore over shared memory, so every worker feeds
+    the same compressor for a patient"""
+
+    def __init__(self, tolerance, max_gap, slots, lock):
+        super().__init__(tolerance, max_gap)
+        self.table = SharedTable(COMPRESSOR_RECORD, slots, lock)
+
+    def _to_entry(self, record):
+        (archived_t, archived_w, archived_seq, pending_t, pending_w, pending_seq,
+         upper, lower, flags, status, device_id) = record
+        compressor = SwingingDoorCompressor(self.tolerance, self.max_gap)
+        if flags & HAS_ARCHIVED:
+            compressor.archived = _to_point(archived_t, archived_w, archived_seq)
+            compressor.upper_slope, compressor.lower_slope = upper, lower
+        if flags & HAS_PENDING:
+            compressor.pending = _to_point(pending_t, pending_w, pending_seq)
+        compressor.force_next = bool(flags & FORCE_NEXT)
+        return {
+            "compressor": compressor,
+            "device_id": device_id.rstrip(b'\0').decode() or None,
+            "status": status.rstrip(b'\0').decode() or None,
+        }
+
+    def _to_record(self, entry):
+        compressor = entry["compressor"]
+        flags = ((HAS_ARCHIVED if compressor.archived else 0) | (HAS_PENDING if compressor.pending else 0)
+                 | (FORCE_NEXT if compressor.force_next else 0))
+        return (
+            *_from_point(compressor.archived), *_from_point(compressor.pending),
+            compressor.upper_slope if compressor.upper_slope is not None else math.nan,
+            compressor.lower_slope if compressor.lower_slope is not None else math.nan,
+            flags, (entry["status"] or '').encode(), encode_key(entry["device_id"] or ''),
+        )
+
+    def modify(self, patient_id, fn):
+        def apply(record):
+            entry = fn(self._to_entry(record) if record else None)
+            return self._to_record(entry) if entry is not None else None
+        self.table.modify(patient_id, apply)
+
+    def get(self, patient_id):
+        record = self.table.read(patient_id)
+        return self._to_entry(record) if record else None
+
+    def patients(self):
+        return self.table.keys()
+
+
+class SharedFilterBank(FilterBank):
+    """filters.FilterBank whose per-device state lives in shared memory, so
+    the Hampel window and Kalman estimate see every reading of a scale
+    whichever worker receives it"""
+
+    def __init__(self, config_path, slots, lock):
+        super().__init__(config_path)
+        self.table = SharedTable(FILTER_RECORD, slots, lock)
+
+    def process(self, device_id, raw):
+        values = np.asarray(raw, dtype=np.float64)
+        if values.size == 0:
+            return values
+        device_filter = self.device_filter(device_id)
+        result = []
+
+        def apply(record):
+            count, estimate, variance, *history = record or EMPTY_FILTER
+            device_filter.history = np.array(history[:count])
+            device_filter.estimate = None if math.isnan(estimate) else estimate
+            device_filter.variance = None if math.isnan(variance) else variance
+            result.append(device_filter.process(values))
+            kept = device_filter.history.tolist()
+            return (
+                len(kept),
+                math.nan if device_filter.estimate is None else device_filter.estimate,
+                math.nan if device_filter.variance is None else device_filter.variance,
+                *kept, *(0.0,) * (MAX_WINDOW - 1 - len(kept)),
+            )
+        self.table.modify(device_id, apply)
+        return result[0]
+
+    def reset(self, device_id):
+        self.table.modify(device_id, lambda record: EMPTY_FILTER if record else None)
@@ -0,0 +1,238 @@
+"""Local spill log for readings the database could not take.
+
+Readings are appended to segment files as framed binary records:
+
+    length (uint32) | crc32 of body (uint32) | body
+
+    body = timestamp (float64) | weight (float64) | seq (int64, -1 if none)
+           | patient_id length (uint16) | device_id length (uint16)
+           | patient_id | device_id
+
+Appends are written straight away and fsynced in batches by a flusher
+thread; append() returns once its records are on disk, so concurrent
+writers share each fsync.
+
+The active segment is named *.open and held under an exclusive flock. Once
+it is sealed (renamed to *.log) a replayer mmaps it, bulk-inserts its
+records into weight_data and deletes it. An *.open file whose flock is free
+was left behind by a process that died, and is sealed by the replayer.
+Replays are idempotent: sequenced readings are caught by the (device_id,
+seq) unique index and the rest by patient and timestamp, so a segment
+replayed twice (a crash between commit and delete) adds nothing. Readings
+for patients that no longer exist are dropped rather than blocking the log.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import psycopg2.extras
+
+FRAME = struct.Struct('<II')
+BODY = struct.Struct('<ddqHH')
+NO_SEQ = -1
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.log'
+
+REPLAY_SQL = """
+    INSERT INTO weight_data (weight, timestamp, patient_id, device_id, seq)
+    SELECT v.weight, v.timestamp, v.patient_id, v.device_id, v.seq
+    FROM (VALUES %s) AS v (weight, timestamp, patient_id, device_id, seq)
+    WHERE EXISTS (SELECT 1 FROM patients p WHERE p.id = v.patient_id)
+      AND (v.seq IS NOT NULL OR NOT EXISTS (
+          SELECT 1 FROM weight_data w WHERE w.patient_id = v.patient_id AND w.timestamp = v.timestamp
+      ))
+    ON CONFLICT (device_id, seq) DO NOTHING
+"""
+REPLAY_TEMPLATE = "(%s::float, %s::timestamp, %s, %s, %s::bigint)"
+
+
+def encode(patient_id, device_id, timestamp, weight, seq):
+    patient = patient_id.encode()
+    device = (device_id or '').encode()
+    body = BODY.pack(timestamp.timestamp(), weight, NO_SEQ if seq is None else seq, len(patient), len(device)) + patient + device
+    return FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode(buf):
+    """Yield (patient_id, device_id, timestamp, weight, seq) from a segment.
+
+    Stops at the first incomplete or corrupt frame: a crash mid-append can
+    only tear the tail, and nothing after it was acknowledged.
+    """
+    offset = 0
+    while offset + FRAME.size <= len(buf):
+        length, crc = FRAME.unpack_from(buf, offset)
+        start = offset + FRAME.size
+        body = buf[start:start + length]
+        if len(body) < length or length < BODY.size or zlib.crc32(body) != crc:
+            return
+        timestamp, weight, seq, patient_len, device_len = BODY.unpack_from(body)
+        names = body[BODY.size:]
+        patient_id = names[:patient_len].decode()
+        device_id = names[patient_len:patient_len + device_len].decode() or None
+        yield patient_id, device_id, datetime.fromtimestamp(timestamp), weight, None if seq == NO_SEQ else seq
+        offset = start + length
+
+
+class SpillLog:
+    def __init__(self, directory, segment_bytes=16 << 20, fsync_interval_s=0.05):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval_s = fsync_interval_s
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        self.file = None
+        self.path = None
+        self.written = 0    # appends issued to the current file ...
+        self.durable = 0    # ... and how many of them are fsynced
+        self.flusher = None
+
+    def _open_segment(self):
+        self.path = os.path.join(self.directory, f"{time.time_ns():020d}-{os.getpid()}{OPEN_SUFFIX}")
+        self.file = open(self.path, 'ab')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.written = self.durable = 0
+
+    def _seal(self):
+        """Close the active segment and hand it to the replayer (hold the lock)"""
+        if self.file is None:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        os.rename(self.path, self.path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        self.file.close()
+        self.file = None
+        self.synced.notify_all()
+
+    def append(self, records):
+        """Durably store (patient_id, device_id, timestamp, weight, seq) records"""
+        data = b''.join(encode(*record) for record in records)
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self._flush_forever, name='spill-fsync', daemon=True)
+                self.flusher.start()
+            if self.file is None:
+                self._open_segment()
+            self.file.write(data)
+            self.written += 1
+            ticket, path = self.written, self.path
+            # Wait for the flusher, or for the segment to be sealed (which fsyncs)
+            while self.path == path and self.file is not None and self.durable < ticket:
+                self.synced.wait()
+            if self.file is not None and self.file.tell() >= self.segment_bytes:
+                self._seal()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.fsync_interval_s)
+            with self.lock:
+                if self.file is None or self.durable == self.written:
+                    continue
+                self.file.flush()
+                f, path, target = self.file, self.path, self.written
+            # fsync outside the lock so writers can keep appending meanwhile
+            try:
+                os.fsync(f.fileno())
+            except (ValueError, OSError):
+                continue    # sealed in the meantime, which fsynced it
+            with self.lock:
+                if self.path == path:
+                    self.durable = max(self.durable, target)
+                    self.synced.notify_all()
+
+    def seal(self):
+        with self.lock:
+            self._seal()
+
+    def sealed_segments(self):
+        """Segments ready to replay, oldest first; seals ones orphaned by dead processes"""
+        names = sorted(os.listdir(self.directory))
+        for name in names:
+            if not name.endswith(OPEN_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            with self.lock:
+                if path == self.path:
+                    continue
+            try:
+                with open(path, 'rb') as f:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.rename(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+            except (BlockingIOError, FileNotFoundError):
+                pass    # another process's active segment, or already sealed
+        return [os.path.join(self.directory, n) for n in sorted(os.listdir(self.directory)) if n.endswith(SEALED_SUFFIX)]
+
+    def has_pending(self):
+        """Cheap check for anything to replay, before touching the database"""
+        with self.lock:
+            if self.file is not None and self.written:
+                return True
+            active = self.path if self.file is not None else None
+        return any(
+            name.endswith((OPEN_SUFFIX, SEALED_SUFFIX)) and os.path.join(self.directory, name) != active
+            for name in os.listdir(self.directory)
+        )
+
+    def replay(self, connect, batch_size=1000):
+        """Drain spilled readings into weight_data; returns how many were replayed.
+
+        Does nothing while the database is still unreachable, so an outage
+        does not chop the log into tiny segments.
+        """
+        if not self.has_pending():
+            return 0
+        conn = connect()
+        if conn is None:
+            return 0
+
+        replayed = 0
+        try:
+            self.seal()
+            for path in self.sealed_segments():
+                try:
+                    f = open(path, 'rb')
+                except FileNotFoundError:
+                    continue
+                with f:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue    # another process is replaying it
+                    if not os.path.exists(path):
+                        continue    # replayed and deleted before we got the lock
+                    size = os.fstat(f.fileno()).st_size
+                    if size:
+                        try:
+                            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as buf:
+                                replayed += self._insert(conn, buf, batch_size)
+                            conn.commit()
+                        except Exception:
+                            conn.rollback()
+                            raise
+                    os.unlink(path)
+        finally:
+            conn.close()
+        return replayed
+
+    def _insert(self, conn, buf, batch_size):
+        cursor = conn.cursor()
+        count = 0
+        batch = []
+        for patient_id, device_id, timestamp, weight, seq in decode(buf):
+            batch.append((weight, timestamp, patient_id, device_id, seq))
+            if len(batch) >= batch_size:
+                psycopg2.extras.execute_values(cursor, REPLAY_SQL, batch, template=REPLAY_TEMPLATE, page_size=batch_size)
+                count += len(batch)
+                batch = []
+        if batch:
+            psycopg2.extras.execute_values(cursor, REPLAY_SQL, batch, template=REPLAY_TEMPLATE, page_size=batch_size)
+            count += len(batch)
+        cursor.close()
+        return count
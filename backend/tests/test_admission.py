@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, RouteClass
+
+
+def controller(capacity=2, **overrides):
+    classes = {
+        'ingest': dict(priority=3, limit=2, queue=5, wait_s=1, retry_after_s=2),
+        'reads': dict(priority=1, limit=1, queue=1, wait_s=0.05, retry_after_s=5),
+    }
+    for name, changes in overrides.items():
+        classes[name].update(changes)
+    return AdmissionController(capacity, [RouteClass(name, **c) for name, c in classes.items()])
+
+
+class Handler:
+    def __init__(self, route):
+        self.route = route
+        self.shed_with = None
+
+    def shed(self, route_class):
+        self.shed_with = route_class
+
+
+def test_class_limit_sheds_after_waiting():
+    admission = controller()
+    assert admission.acquire('reads')
+    started = time.monotonic()
+    assert not admission.acquire('reads')
+    assert time.monotonic() - started >= 0.05
+    admission.release('reads')
+    assert admission.acquire('reads')
+    assert admission.snapshot()["classes"]["reads"]["rejected"] == 1
+
+
+def test_full_queue_is_rejected_without_waiting():
+    admission = controller(reads=dict(queue=0, wait_s=5))
+    assert admission.acquire('reads')
+    started = time.monotonic()
+    assert not admission.acquire('reads')
+    assert time.monotonic() - started < 1
+
+
+def test_freed_slot_goes_to_the_higher_class():
+    admission = controller(capacity=1, reads=dict(wait_s=2))
+    assert admission.acquire('ingest')
+    order = []
+
+    def waiter(name):
+        if admission.acquire(name):
+            order.append(name)
+            time.sleep(0.05)
+            admission.release(name)
+
+    reader = threading.Thread(target=waiter, args=('reads',))
+    reader.start()
+    time.sleep(0.05)
+    uploader = threading.Thread(target=waiter, args=('ingest',))
+    uploader.start()
+    time.sleep(0.05)
+    admission.release('ingest')
+    reader.join()
+    uploader.join()
+    assert order == ['ingest', 'reads']
+
+
+@pytest.mark.parametrize("route, shed", [(None, False), ('reads', True)])
+def test_guard_meters_classified_requests_and_sheds(route, shed):
+    admission = controller()
+    assert admission.acquire('reads')
+    calls = []
+
+    @admission.guard(lambda handler: handler.route)
+    def do_GET(handler):
+        calls.append(handler)
+
+    handler = Handler(route)
+    do_GET(handler)
+    assert (handler.shed_with is not None) == shed
+    assert bool(calls) != shed
+    assert handler.shed_with is None or handler.shed_with.name == 'reads'
+
+
+def test_guard_releases_after_an_exception():
+    admission = controller()
+
+    @admission.guard(lambda handler: 'reads')
+    def do_GET(handler):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        do_GET(Handler('reads'))
+    assert admission.snapshot()["inFlight"] == 0
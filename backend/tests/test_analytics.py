@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from analytics import WindowCache, consumption, segment, shift_starts_of
+
+HOUR = 3600.0
+
+
+def readings(*series):
+    """Flatten per-patient [(seconds, kg), ...] lists into (t, w, p)"""
+    t = np.array([s for points in series for s, _ in points], dtype=np.float64)
+    w = np.array([kg for points in series for _, kg in points], dtype=np.float64)
+    p = np.repeat(np.arange(len(series)), [len(points) for points in series])
+    return t, w, p
+
+
+NO_DRIPS = (np.empty(0), np.empty(0, dtype=np.int64))
+
+
+def test_segments_split_at_patient_refill_and_drip_start():
+    t, w, p = readings(
+        [(0, 1.0), (HOUR, 0.9), (2 * HOUR, 1.0), (3 * HOUR, 0.95)],
+        [(0, 0.8), (HOUR, 0.7), (2 * HOUR, 0.6)],
+    )
+    boundary, seg = segment(t, w, p, np.array([1.5 * HOUR]), np.array([1]))
+    assert boundary.tolist() == [True, False, True, False, True, False, True]
+    assert seg.tolist() == [0, 0, 1, 1, 2, 2, 3]
+
+
+def test_patient_volume_rate_and_bags():
+    t, w, p = readings(
+        [(0, 1.0), (HOUR, 0.9), (2 * HOUR, 0.8), (3 * HOUR, 1.0), (4 * HOUR, 0.95)],
+        [(0, 0.5), (HOUR, 0.52), (2 * HOUR, 0.5)],
+    )
+    result = consumption(["P1", "P2"], ["A", "A"], t, w, p, *NO_DRIPS, 'patient')
+    first, second = result
+    assert first["key"] == "P1"
+    assert first["volumeMl"] == pytest.approx(250.0)
+    assert first["hours"] == 3.0          # the refill interval is not counted
+    assert first["rateMlPerHour"] == pytest.approx(83.3)
+    assert first["bags"] == 2
+    assert first["bagsCompleted"] == 1
+    assert first["avgBagHours"] == 2.0
+    # A knock on the scale cancels out instead of adding volume
+    assert second["volumeMl"] == 0.0
+    assert second["bags"] == 0
+
+
+def test_ward_groups_and_empty_windows():
+    t, w, p = readings([(0, 1.0), (HOUR, 0.9)], [(0, 1.0), (HOUR, 0.8)], [(0, 1.0), (HOUR, 0.7)])
+    result = consumption(["P1", "P2", "P3"], ["A", "B", "A"], t, w, p, *NO_DRIPS, 'ward')
+    assert [(r["key"], r["volumeMl"], r["patients"]) for r in result] == [("A", 400.0, 2), ("B", 200.0, 1)]
+    assert consumption([], [], np.empty(0), np.empty(0), np.empty(0, dtype=np.int64), *NO_DRIPS, 'ward') == []
+
+
+def test_shift_starts_wrap_to_the_previous_night():
+    day = 20000 * 86400.0
+    t = np.array([day + 6 * HOUR, day + 7 * HOUR, day + 16 * HOUR, day + 23.5 * HOUR])
+    starts = shift_starts_of(t, (7, 15, 23))
+    assert (starts - day).tolist() == [-HOUR, 7 * HOUR, 15 * HOUR, 23 * HOUR]
+
+
+def test_shift_groups_attribute_intervals_to_the_later_reading():
+    day = 20000 * 86400.0
+    t, w, p = readings([(day + 14 * HOUR, 1.0), (day + 15 * HOUR, 0.9), (day + 16 * HOUR, 0.8)])
+    result = consumption(["P1"], ["A"], t, w, p, *NO_DRIPS, 'shift')
+    assert [r["key"] for r in result] == ["2024-10-04T15:00:00"]
+    assert result[0]["volumeMl"] == pytest.approx(200.0)
+
+
+def test_window_cache_keeps_only_closed_windows():
+    cache = WindowCache(size=2, closed_after_s=600)
+    now = datetime.now()
+    cache.put("open", now, [1])
+    assert cache.get("open") is None
+
+    old = now - timedelta(hours=1)
+    cache.put("a", old, [1])
+    cache.put("b", old, [2])
+    assert cache.get("a") == [1]          # a is now the most recently used
+    cache.put("c", old, [3])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1] and cache.get("c") == [3]
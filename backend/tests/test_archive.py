@@ -0,0 +1,155 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from archive import (Archive, ArchiveFile, merge_archived, to_micros, unzigzag, varint_decode,
+                     varint_encode, write_file, zigzag)
+
+CHUNK = 8
+BASE = datetime(2026, 3, 1, 8, 0)
+
+
+def readings(n, start=BASE, step_s=2.0):
+    """n readings with jittered timestamps, a draining weight, gaps in seq and a device change"""
+    t = np.array([to_micros(start + timedelta(seconds=i * step_s + (i % 3) * 0.01)) for i in range(n)], dtype=np.int64)
+    weights = [round(1.2 - i * 0.0003, 4) for i in range(n)]
+    seqs = [None if i % 5 == 0 else (7 << 32) | i for i in range(n)]
+    devices = [None if i % 4 == 0 else ("scale-2" if i > n // 2 else "scale-1") for i in range(n)]
+    return t, weights, seqs, devices
+
+
+def read_back(path, start_us=None, end_us=None):
+    with ArchiveFile(path) as f:
+        t, weight, seq, device = f.read(start_us, end_us)
+        devices = [f.meta["devices"][d] for d in device.tolist()]
+    return t.tolist(), weight.tolist(), [None if s == 0 else s - 1 for s in seq.tolist()], devices
+
+
+class Catalog:
+    """Stands in for the weight_archive query in Archive.files()"""
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def execute(self, sql, params):
+        pass
+
+    def fetchall(self):
+        return [(path,) for path in self.paths]
+
+
+@pytest.mark.parametrize("values", [
+    [0],
+    [1, -1, 63, -64, 64, -65],
+    [2 ** 62, -(2 ** 62), 2 ** 63 - 1, -(2 ** 63)],
+])
+def test_zigzag_varint_round_trip(values):
+    encoded = varint_encode(zigzag(np.array(values, dtype=np.int64)))
+    decoded = unzigzag(varint_decode(np.frombuffer(encoded, dtype=np.uint8)))
+    assert decoded.tolist() == values
+
+
+def test_varint_decode_empty():
+    assert len(varint_decode(np.empty(0, dtype=np.uint8))) == 0
+
+
+@pytest.mark.parametrize("n", [1, 2, CHUNK - 1, CHUNK, CHUNK + 1, 2 * CHUNK, 3 * CHUNK + 5])
+def test_write_read_round_trip(tmp_path, n):
+    t, weights, seqs, devices = readings(n)
+    path = str(tmp_path / "p.wca")
+    size = write_file(path, "P-1", t, weights, seqs, devices, chunk_points=CHUNK)
+
+    assert os.path.getsize(path) == size
+    assert not os.path.exists(path + ".tmp")
+    with ArchiveFile(path) as f:
+        assert len(f.index) == -(-n // CHUNK)
+        assert f.meta["patientId"] == "P-1"
+    assert read_back(path) == (t.tolist(), weights, seqs, devices)
+
+
+def test_none_seq_and_device_only(tmp_path):
+    t, weights, _, _ = readings(CHUNK + 3)
+    path = str(tmp_path / "p.wca")
+    write_file(path, "P-1", t, weights, [None] * len(t), [None] * len(t), chunk_points=CHUNK)
+    _, _, seqs, devices = read_back(path)
+    assert seqs == [None] * len(t)
+    assert devices == [None] * len(t)
+
+
+def test_weights_round_to_step(tmp_path):
+    t, _, seqs, devices = readings(3)
+    path = str(tmp_path / "p.wca")
+    write_file(path, "P-1", t, [0.123456, 0.98766, 1.0], seqs, devices, chunk_points=CHUNK)
+    assert read_back(path)[1] == [0.1235, 0.9877, 1.0]
+
+
+def test_range_read_skips_chunks_outside(tmp_path):
+    n = 4 * CHUNK
+    t, weights, seqs, devices = readings(n)
+    path = str(tmp_path / "p.wca")
+    write_file(path, "P-1", t, weights, seqs, devices, chunk_points=CHUNK)
+
+    with ArchiveFile(path) as f:
+        # Chunk-granular: whole chunks overlapping the range come back
+        got, _, _, _ = f.read(int(t[CHUNK + 2]), int(t[2 * CHUNK + 1]))
+        assert got.tolist() == t[CHUNK:3 * CHUNK].tolist()
+        assert len(f.read(int(t[-1]) + 1)[0]) == 0
+        assert len(f.read(None, int(t[0]) - 1)[0]) == 0
+        assert len(list(f.chunks(int(t[CHUNK]), int(t[CHUNK])))) == 1
+
+
+def test_archive_read_and_rows_trim_to_range(tmp_path):
+    archive = Archive(str(tmp_path), chunk_points=CHUNK)
+    t, weights, seqs, devices = readings(3 * CHUNK)
+    os.makedirs(tmp_path / "P-1")
+    write_file(str(tmp_path / "P-1" / "a.wca"), "P-1", t, weights, seqs, devices, chunk_points=CHUNK)
+    catalog = Catalog(["P-1/a.wca"])
+    start, end = BASE + timedelta(seconds=11), BASE + timedelta(seconds=31)
+
+    t_read, _, _, _ = archive.read(catalog, "P-1", start, end)
+    expected = [v for v in t.tolist() if to_micros(start) <= v <= to_micros(end)]
+    assert t_read.tolist() == expected
+
+    rows = list(archive.rows(catalog, "P-1", start, end))
+    assert [to_micros(row[1]) for row in rows] == expected
+    assert all(row[0] == "P-1" for row in rows)
+
+
+def test_rows_merges_files_in_timestamp_order(tmp_path):
+    archive = Archive(str(tmp_path), chunk_points=CHUNK)
+    os.makedirs(tmp_path / "P-1")
+    first = readings(2 * CHUNK + 1)
+    second = readings(CHUNK, start=BASE + timedelta(seconds=5))
+    write_file(str(tmp_path / "P-1" / "a.wca"), "P-1", *first, chunk_points=CHUNK)
+    write_file(str(tmp_path / "P-1" / "b.wca"), "P-1", *second, chunk_points=CHUNK)
+
+    rows = archive.rows(Catalog(["P-1/a.wca", "P-1/b.wca"]), "P-1")
+    assert not isinstance(rows, list)
+    timestamps = [row[1] for row in rows]
+    assert len(timestamps) == 3 * CHUNK + 1
+    assert timestamps == sorted(timestamps)
+
+
+def test_merge_archived_interleaves_by_patient_and_time():
+    archived = {
+        "P-1": [("P-1", BASE + timedelta(seconds=s), 1.0, None, None) for s in (1, 4)],
+        "P-2": [("P-2", BASE + timedelta(seconds=9), 1.0, None, None)],
+    }
+    rows = [
+        ("P-1", None),
+        ("P-1", BASE + timedelta(seconds=2)),
+        ("P-1", BASE + timedelta(seconds=5)),
+        ("P-2", None),
+        ("P-3", BASE),
+    ]
+    merged = list(merge_archived(iter(rows), lambda patient_id: iter(archived[patient_id])))
+    assert [(row[0], row[1]) for row in merged] == [
+        ("P-1", BASE + timedelta(seconds=1)),
+        ("P-1", BASE + timedelta(seconds=2)),
+        ("P-1", BASE + timedelta(seconds=4)),
+        ("P-1", BASE + timedelta(seconds=5)),
+        ("P-2", BASE + timedelta(seconds=9)),
+        ("P-3", BASE),
+    ]
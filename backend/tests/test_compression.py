@@ -0,0 +1,88 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from compression import SwingingDoorCompressor, interpolate
+
+BASE = datetime(2026, 3, 1, 8, 0)
+TOLERANCE = 0.002
+
+
+def at(seconds):
+    return BASE + timedelta(seconds=seconds)
+
+
+def compress(compressor, readings):
+    stored = []
+    for seconds, weight in readings:
+        stored += compressor.add(at(seconds), weight, seq=seconds)
+    return stored + compressor.flush()
+
+
+def test_straight_drain_keeps_only_the_ends():
+    readings = [(2 * i, 1.0 - 0.0001 * i) for i in range(100)]
+    stored = compress(SwingingDoorCompressor(TOLERANCE), readings)
+    assert [p[2] for p in stored] == [0, 198]
+
+
+def test_reconstruction_stays_within_tolerance():
+    readings = [(2 * i, 1.0 - 0.0001 * i + (0.003 if 40 <= i < 60 else 0)) for i in range(100)]
+    stored = compress(SwingingDoorCompressor(TOLERANCE), readings)
+    assert len(stored) < len(readings)
+    rebuilt = dict(interpolate(stored, at(0), at(198), timedelta(seconds=2)))
+    for seconds, weight in readings:
+        assert abs(rebuilt[at(seconds)] - weight) <= TOLERANCE + 1e-12
+
+
+def test_noisy_drain_reconstruction_stays_within_tolerance():
+    rng = random.Random(7)
+    readings = [(2 * i, 1.0 - 0.0001 * i + rng.gauss(0, 0.0015)) for i in range(500)]
+    stored = compress(SwingingDoorCompressor(TOLERANCE), readings)
+    rebuilt = dict(interpolate(stored, at(0), at(998), timedelta(seconds=2)))
+    for seconds, weight in readings:
+        assert abs(rebuilt[at(seconds)] - weight) <= TOLERANCE + 1e-12
+
+
+def test_max_gap_stores_a_point():
+    compressor = SwingingDoorCompressor(TOLERANCE, max_gap=60)
+    stored = compress(compressor, [(0, 1.0), (30, 1.0), (61, 1.0)])
+    assert [p[2] for p in stored] == [0, 30, 61]
+
+
+def test_force_keeps_both_sides_of_a_step():
+    compressor = SwingingDoorCompressor(TOLERANCE)
+    assert compressor.add(at(0), 0.1) == [(at(0), 0.1, None)]
+    assert compressor.add(at(2), 0.1) == []
+    compressor.force_next = True
+    assert compressor.add(at(4), 1.0) == [(at(2), 0.1, None), (at(4), 1.0, None)]
+
+
+@pytest.mark.parametrize("late", [0, 1, 3, 4])
+def test_late_and_equal_timestamps_are_stored_not_dropped(late):
+    compressor = SwingingDoorCompressor(TOLERANCE)
+    stored = compressor.add(at(0), 1.0, seq=0)
+    stored += compressor.add(at(2), 0.9999, seq=1)
+    stored += compressor.add(at(4), 0.9998, seq=2)
+    # at(4) is held back; a reading at or before it arrives afterwards
+    assert compressor.add(at(late), 0.5, seq=9) == [(at(late), 0.5, 9)]
+    stored += compressor.add(at(6), 0.9997, seq=3)
+    stored += compressor.flush()
+    assert [p[2] for p in stored] == [0, 3]
+    assert compressor.pending is None
+
+
+def test_equal_timestamp_to_first_point_is_stored():
+    compressor = SwingingDoorCompressor(TOLERANCE)
+    compressor.add(at(0), 1.0, seq=0)
+    assert compressor.add(at(0), 1.0, seq=1) == [(at(0), 1.0, 1)]
+    assert compressor.add(at(2), 1.0, seq=2) == []
+    assert compressor.flush() == [(at(2), 1.0, 2)]
+
+
+def test_flush_returns_held_reading_once():
+    compressor = SwingingDoorCompressor(TOLERANCE)
+    compressor.add(at(0), 1.0)
+    compressor.add(at(2), 1.0)
+    assert compressor.flush() == [(at(2), 1.0, None)]
+    assert compressor.flush() == []
@@ -0,0 +1,164 @@
+import psycopg2
+import psycopg2.extensions
+
+from db_router import DatabaseRouter, Pool
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append(sql.strip())
+        if self.conn.fail:
+            raise psycopg2.OperationalError("server closed the connection")
+
+    def fetchone(self):
+        return (self.conn.lag_s,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, name, lag_s=0.0):
+        self.name = name
+        self.lag_s = lag_s
+        self.fail = False
+        self.closed = 0
+        self.autocommit = False
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.executed = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def poll(self):
+        if self.fail:
+            raise psycopg2.OperationalError("connection lost")
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeDatabase:
+    def __init__(self, name, lag_s=0.0):
+        self.name = name
+        self.lag_s = lag_s
+        self.down = False
+        self.connections = []
+
+    def connect(self):
+        if self.down:
+            raise psycopg2.OperationalError(f"{self.name} is down")
+        conn = FakeConnection(self.name, self.lag_s)
+        self.connections.append(conn)
+        return conn
+
+
+def pool(database, **kwargs):
+    return Pool(database.name, database.connect, **kwargs)
+
+
+def test_lease_returns_connection_to_the_pool():
+    db = FakeDatabase("primary")
+    connections = pool(db)
+    lease = connections.acquire()
+    lease.autocommit = True
+    lease.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    lease.close()
+    lease.close()
+    conn = db.connections[0]
+    assert conn.autocommit is False and conn.rollbacks == 1
+    assert connections.acquire().conn is conn
+    assert connections.snapshot()["opened"] == 1
+
+
+def test_dead_and_stale_connections_are_replaced():
+    db = FakeDatabase("primary")
+    connections = pool(db, validate_after_s=0)
+    lease = connections.acquire()
+    first = lease.conn
+    lease.close()
+    first.fail = True
+    lease = connections.acquire()
+    second = lease.conn
+    assert second is not first and first.closed
+    lease.close()
+    assert connections.acquire().conn is second
+    assert second.executed == ["SELECT 1"]
+    assert len(db.connections) == 2
+
+
+def test_pool_keeps_at_most_size_idle_connections():
+    db = FakeDatabase("primary")
+    connections = pool(db, size=1)
+    first, second = connections.acquire(), connections.acquire()
+    first.close()
+    second.close()
+    assert connections.snapshot()["idle"] == 1
+    assert db.connections[1].closed
+
+
+def router(lag_s=0.0, max_lag_s=5.0, check_interval_s=0.0):
+    primary, replica = FakeDatabase("primary"), FakeDatabase("replica", lag_s)
+    routes = DatabaseRouter(pool(primary), pool(replica), replica_routes=("overview",),
+                            max_lag_s=max_lag_s, check_interval_s=check_interval_s)
+    return routes, primary, replica
+
+
+def test_replica_serves_listed_routes_while_caught_up():
+    routes, _, _ = router(lag_s=1.0)
+    assert routes.read("overview").conn.name == "replica"
+    assert routes.read("overview", fresh=True).conn.name == "primary"
+    assert routes.read("alerts").conn.name == "primary"
+    assert routes.counts == {"replica": 1, "primary": 2, "fallback": 0}
+    assert routes.snapshot()["replica"]["lagSeconds"] == 1.0
+
+
+def test_lagging_replica_falls_back_to_the_primary():
+    routes, _, replica = router(lag_s=30.0)
+    assert routes.read("overview").conn.name == "primary"
+    assert routes.healthy is False and routes.lag_s == 30.0
+
+    for conn in replica.connections:
+        conn.lag_s = 0.0
+    replica.lag_s = 0.0
+    assert routes.read("overview").conn.name == "replica"
+    assert routes.healthy is True
+
+
+def test_unreachable_replica_falls_back_until_the_next_check():
+    routes, _, replica = router(check_interval_s=3600)
+    replica.down = True
+    assert routes.read("overview").conn.name == "primary"
+    assert routes.healthy is False and "down" in routes.last_error
+    # Between checks an unhealthy replica is not even tried
+    replica.down = False
+    assert routes.read("overview").conn.name == "primary"
+    assert routes.counts["fallback"] == 2
+
+
+def test_replica_failure_between_checks_marks_it_unhealthy():
+    routes, _, replica = router(check_interval_s=3600)
+    routes.read("overview").close()
+    assert routes.healthy
+    replica.down = True
+    replica.connections[0].fail = True
+    assert routes.read("overview").conn.name == "primary"
+    assert routes.healthy is False
+
+
+def test_without_a_replica_everything_reads_from_the_primary():
+    primary = FakeDatabase("primary")
+    routes = DatabaseRouter(pool(primary), replica_routes=("overview",))
+    assert routes.read("overview").conn.name == "primary"
+    assert routes.snapshot()["replica"] is None
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from filters import DeviceFilter, FilterBank, kalman
+
+
+def test_kalman_stays_finite_when_gain_is_near_one():
+    values = np.concatenate((np.full(300, 1.0), np.full(300, 0.9)))
+    filtered, estimate, variance = kalman(values, None, None, 1e-3, 1e-12)
+    assert np.isfinite(filtered).all()
+    assert filtered[-1] == pytest.approx(0.9)
+
+
+def test_kalman_batches_match_one_pass():
+    values = np.random.default_rng(1).normal(1.0, 0.003, 200)
+    whole, _, _ = kalman(values, None, None, 1e-7, 1e-5)
+    first, estimate, variance = kalman(values[:77], None, None, 1e-7, 1e-5)
+    second, _, _ = kalman(values[77:], estimate, variance, 1e-7, 1e-5)
+    np.testing.assert_allclose(np.concatenate((first, second)), whole)
+
+
+def test_hampel_replaces_a_knock():
+    device = DeviceFilter({"filters": ["hampel"], "window": 5})
+    filtered = device.process([1.0, 1.0001, 0.9999, 1.0, 1.4, 1.0])
+    assert filtered[4] == pytest.approx(1.0, abs=1e-3)
+
+
+@pytest.mark.parametrize("config", [
+    {"kalman_r": 0},
+    {"kalman_q": -1e-9},
+    {"window": 0},
+    {"window": 2.5},
+    {"n_sigmas": float("nan")},
+    {"min_deviation": -0.1},
+    {"filters": ["hampel", "smooth"]},
+    {"filters": "kalman"},
+])
+def test_invalid_config_is_rejected(config):
+    with pytest.raises(ValueError):
+        DeviceFilter(config)
+
+
+def test_reset_forgets_the_old_bag():
+    bank = FilterBank()
+    config = {"filters": ["hampel", "kalman"]}
+    bank.device_configs = {"scale-1": config}
+    bank.process("scale-1", np.full(50, 0.10))
+    assert bank.process("scale-1", [1.0])[0] < 0.2
+    bank.reset("scale-1")
+    np.testing.assert_allclose(bank.process("scale-1", [1.0, 1.0, 1.0]), 1.0)
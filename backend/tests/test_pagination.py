@@ -0,0 +1,49 @@
+import pytest
+
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor, parse_bool, parse_limit
+
+
+def test_cursor_round_trip():
+    key = ["2026-03-01T08:00:00", 42]
+    cursor = encode_cursor(key)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, (str, int)) == key
+
+
+def test_missing_cursor_is_none():
+    assert decode_cursor(None, (str, int)) is None
+    assert decode_cursor("", (str, int)) is None
+
+
+@pytest.mark.parametrize("cursor", ["not base64 json!", "e30x", "%%%"])
+def test_garbage_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, (str, int))
+
+
+@pytest.mark.parametrize("key", ["abc", {"name": "x"}, ["2026-03-01T08:00:00"], [42, "2026-03-01T08:00:00"],
+                                 ["2026-03-01T08:00:00", True], ["2026-03-01T08:00:00", 1, 2]])
+def test_cursor_of_the_wrong_shape_is_rejected(key):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(encode_cursor(key), (str, int))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({}, 50),
+    ({"limit": ["10"]}, 10),
+    ({"limit": ["0"]}, 1),
+    ({"limit": ["100000"]}, MAX_PAGE_SIZE),
+])
+def test_parse_limit_clamps(query, expected):
+    assert parse_limit(query) == expected
+
+
+def test_parse_limit_rejects_non_numbers():
+    with pytest.raises(ValueError):
+        parse_limit({"limit": ["ten"]})
+
+
+def test_parse_bool():
+    assert parse_bool({}, "unread") is None
+    assert parse_bool({"unread": ["true"]}, "unread") is True
+    assert parse_bool({"unread": ["0"]}, "unread") is False
@@ -0,0 +1,61 @@
+from scheduler import SLOT_BITS, SLOTS, TimingWheel
+
+
+def fire_times(wheel, until, step=1.0, start=0.0):
+    fired = {}
+    now = start
+    while now < until:
+        now += step
+        for key, payload in wheel.advance(now):
+            fired[key] = (now, payload)
+    return fired
+
+
+def test_fires_at_deadline_not_before():
+    wheel = TimingWheel(1.0, 0.0)
+    wheel.schedule("a", 5.0, "payload")
+    assert wheel.advance(4.0) == []
+    assert wheel.advance(5.0) == [("a", "payload")]
+    assert len(wheel) == 0
+
+
+def test_deadline_rounds_up_to_a_tick():
+    wheel = TimingWheel(1.0, 0.0)
+    wheel.schedule("a", 2.1)
+    assert wheel.advance(2.9) == []
+    assert wheel.advance(3.0) == [("a", None)]
+
+
+def test_past_deadline_fires_on_next_tick():
+    wheel = TimingWheel(1.0, 10.0)
+    wheel.schedule("a", 3.0)
+    assert wheel.advance(11.0) == [("a", None)]
+
+
+def test_reschedule_replaces_and_cancel_removes():
+    wheel = TimingWheel(1.0, 0.0)
+    wheel.schedule("a", 3.0)
+    wheel.schedule("a", 8.0)
+    wheel.schedule("b", 4.0)
+    wheel.cancel("b")
+    wheel.cancel("missing")
+    assert len(wheel) == 1
+    assert fire_times(wheel, 20.0) == {"a": (8.0, None)}
+
+
+def test_far_deadlines_cascade_to_the_right_tick():
+    wheel = TimingWheel(1.0, 3.0)
+    deadlines = {f"k{d}": float(d) for d in (SLOTS - 1, SLOTS, SLOTS + 1, SLOTS ** 2 + 7, 3 * SLOTS ** 2 + SLOTS + 2)}
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    fired = fire_times(wheel, max(deadlines.values()) + 1, start=3.0)
+    assert {key: at for key, (at, _) in fired.items()} == deadlines
+
+
+def test_deadline_beyond_horizon_is_parked_and_rearmable():
+    wheel = TimingWheel(1.0, 0.0)
+    horizon = 1 << (SLOT_BITS * 5)
+    wheel.schedule("far", float(horizon * 2))
+    assert len(wheel) == 1
+    wheel.schedule("far", 2.0)
+    assert fire_times(wheel, 3.0) == {"far": (2.0, None)}
@@ -0,0 +1,177 @@
+import json
+import multiprocessing
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import shared_state
+from compression import CompressorStore
+from filters import FilterBank
+from shared_state import (KEY_CHARS, VERSION, SharedCompressorStore, SharedFilterBank, SharedLiveState,
+                          SharedSequenceWindow, SharedTable)
+
+
+@pytest.fixture
+def table():
+    table = SharedTable('<dq', 64, threading.Lock())
+    yield table
+    table.close(unlink=True)
+
+
+def test_modify_and_read(table):
+    assert table.read("P-1") is None
+    table.modify("P-1", lambda record: (1.5, 1))
+    table.modify("P-1", lambda record: (record[0] + 1, record[1] + 1))
+    assert table.read("P-1") == (2.5, 2)
+
+
+def test_modify_returning_none_leaves_record(table):
+    table.modify("P-1", lambda record: (1.0, 1))
+    table.modify("P-1", lambda record: None)
+    table.modify("P-2", lambda record: None)
+    assert table.read("P-1") == (1.0, 1)
+    assert table.read("P-2") is None
+
+
+def test_long_keys_sharing_a_prefix_stay_distinct(table):
+    a, b = "W" * (KEY_CHARS - 1) + "a", "W" * (KEY_CHARS - 1) + "b"
+    table.modify(a, lambda record: (1.0, 1))
+    table.modify(b, lambda record: (2.0, 2), touch=True)
+    assert table.read(a) == (1.0, 1)
+    assert table.read(b) == (2.0, 2)
+    assert table.latest_key() == b
+
+
+def test_multibyte_key_at_column_width(table):
+    key = "é" * KEY_CHARS
+    table.modify(key, lambda record: (1.0, 1), touch=True)
+    assert table.read(key) == (1.0, 1)
+    assert table.latest_key() == key
+
+
+@pytest.mark.parametrize("key", ["x" * (KEY_CHARS + 1), "a\0b"])
+def test_unstorable_key_is_rejected(table, key):
+    with pytest.raises(ValueError):
+        table.modify(key, lambda record: (1.0, 1))
+
+
+def test_read_of_slot_left_mid_write_times_out(table, monkeypatch):
+    monkeypatch.setattr(shared_state, "READ_TIMEOUT_S", 0.05)
+    table.modify("P-1", lambda record: (1.0, 1))
+    offset = table._offset("P-1")
+    version = VERSION.unpack_from(table.buf, offset)[0]
+    VERSION.pack_into(table.buf, offset, version + 1)
+    with pytest.raises(TimeoutError):
+        table.read("P-1")
+    VERSION.pack_into(table.buf, offset, version + 2)
+    assert table.read("P-1") == (1.0, 1)
+
+
+def test_live_state_round_trip():
+    state = SharedLiveState(16, multiprocessing.Lock())
+    try:
+        timestamp = datetime(2026, 3, 1, 8, 0, 0, 500000)
+        state.update("P-1", 0.85, timestamp, seq=42)
+        state.set_status("P-1", 62.5, "normal")
+        entry = state.get("P-1")
+        assert entry["weight"] == 0.85
+        assert entry["timestamp"] == timestamp
+        assert entry["seq"] == 42
+        assert (entry["percentage"], entry["status"]) == (62.5, "normal")
+        assert state.latest()["patient_id"] == "P-1"
+    finally:
+        state.table.close(unlink=True)
+
+
+def test_sequence_window_rejects_replays():
+    window = SharedSequenceWindow(16, multiprocessing.Lock())
+    try:
+        assert window.accept("scale-1", 10)
+        assert not window.accept("scale-1", 10)
+        assert window.accept("scale-1", 9)
+        assert window.seen("scale-1", 9) and not window.seen("scale-1", 8)
+        assert window.accept("scale-1", 8)
+        window.seed("scale-2", 100)
+        assert not window.accept("scale-2", 100)
+        assert not window.accept("scale-2", 99)
+        assert window.accept("scale-2", 101)
+    finally:
+        window.table.close(unlink=True)
+
+
+def test_shared_compressors_match_local_ones():
+    readings = [(datetime(2026, 3, 1, 8, 0, i * 2 % 60, 250000) + (i * 2 // 60) * timedelta(minutes=1),
+                 1.0 - 0.0001 * i + (0.004 if i % 17 == 0 else 0), i) for i in range(200)]
+    local = CompressorStore(0.002, 300)
+    shared = SharedCompressorStore(0.002, 300, 16, multiprocessing.Lock())
+    try:
+        expected, got = [], []
+        for start in range(0, len(readings), 7):
+            batch = readings[start:start + 7]
+            status = "critical" if start > 150 else "normal"
+            expected.append(local.add("P-1", "scale-1", batch, status))
+            got.append(shared.add("P-1", "scale-1", batch, status))
+        local.force_next("P-1")
+        shared.force_next("P-1")
+        assert got == expected
+        assert shared.get("P-1")["compressor"].force_next
+        assert shared.flush("P-1") == local.flush("P-1")
+        assert shared.patients() == ["P-1"]
+        assert shared.get("P-1")["device_id"] == "scale-1"
+    finally:
+        shared.table.close(unlink=True)
+
+
+@pytest.fixture(params=["local", "shared"])
+def store(request):
+    if request.param == "local":
+        yield CompressorStore(0.002, 300)
+        return
+    store = SharedCompressorStore(0.002, 300, 16, multiprocessing.Lock())
+    yield store
+    store.table.close(unlink=True)
+
+
+def drain(start, count):
+    return [(datetime(2026, 3, 1, 8, 0) + timedelta(seconds=2 * i), 1.0 - 0.0001 * i, i)
+            for i in range(start, start + count)]
+
+
+def test_draft_changes_nothing_until_saved(store):
+    store.add("P-1", "scale-1", drain(0, 5), "normal")
+    before = store.get("P-1")["compressor"].pending
+    points, status_changed, draft = store.draft("P-1", "scale-1", drain(5, 5), "critical")
+    assert status_changed and points[-1][2] == 9
+    assert store.get("P-1")["compressor"].pending == before
+    assert store.save("P-1", draft) == []
+    assert store.get("P-1")["status"] == "critical"
+    assert store.add("P-1", "scale-1", drain(10, 1), "critical") == ([], False)
+
+
+def test_save_after_a_concurrent_batch_returns_the_held_back_point(store):
+    store.add("P-1", "scale-1", drain(0, 3), "normal")
+    points, _, draft = store.draft("P-1", "scale-1", drain(3, 3), "normal")
+    assert points == []
+    store.add("P-1", "scale-1", drain(6, 3), "normal")
+    after = store.get("P-1")["compressor"].pending
+    assert store.save("P-1", draft) == [drain(5, 1)[0]]
+    assert store.get("P-1")["compressor"].pending == after
+
+
+def test_shared_filter_bank_matches_local_one(tmp_path):
+    config = tmp_path / "filters.json"
+    config.write_text(json.dumps({"default": {"filters": ["hampel", "kalman"], "window": 9}}))
+    raw = np.concatenate((np.full(30, 0.5), [0.9], np.full(30, 0.499)))
+    local = FilterBank(str(config))
+    shared = SharedFilterBank(str(config), 16, multiprocessing.Lock())
+    try:
+        for start in range(0, len(raw), 4):
+            np.testing.assert_array_equal(shared.process("scale-1", raw[start:start + 4]),
+                                          local.process("scale-1", raw[start:start + 4]))
+        shared.reset("scale-1")
+        local.reset("scale-1")
+        np.testing.assert_array_equal(shared.process("scale-1", [1.0, 1.0]), local.process("scale-1", [1.0, 1.0]))
+    finally:
+        shared.table.close(unlink=True)
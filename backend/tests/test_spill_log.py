@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from spill_log import SpillLog, decode, encode
+
+RECORDS = [
+    ("P-123456", "scale-1", datetime(2026, 3, 1, 8, 0, 0, 250000), 0.8731, 42),
+    ("P-234567", None, datetime(2026, 3, 1, 8, 0, 1), 1.0, None),
+    ("P-ü", "scale-ß", datetime(2026, 3, 1, 8, 0, 2), 0.0, (3 << 32) | 7),
+]
+
+
+def test_encode_decode_round_trip():
+    assert list(decode(b"".join(encode(*record) for record in RECORDS))) == RECORDS
+
+
+def test_decode_stops_at_torn_tail():
+    data = b"".join(encode(*record) for record in RECORDS)
+    assert list(decode(data[:-3])) == RECORDS[:2]
+
+
+def test_decode_stops_at_corrupt_frame():
+    frames = [encode(*record) for record in RECORDS]
+    corrupt = bytearray(frames[1])
+    corrupt[-1] ^= 0xff
+    assert list(decode(frames[0] + bytes(corrupt) + frames[2])) == RECORDS[:1]
+
+
+def test_appended_records_reach_a_sealed_segment(tmp_path):
+    log = SpillLog(str(tmp_path), fsync_interval_s=0.001)
+    assert not log.has_pending()
+    log.append(RECORDS[:2])
+    log.append(RECORDS[2:])
+    assert log.has_pending()
+    log.seal()
+    segments = log.sealed_segments()
+    assert len(segments) == 1
+    with open(segments[0], "rb") as f:
+        assert list(decode(f.read())) == RECORDS
+
+
+def test_segment_rolls_over_at_size(tmp_path):
+    log = SpillLog(str(tmp_path), segment_bytes=1, fsync_interval_s=0.001)
+    for record in RECORDS:
+        log.append([record])
+    segments = log.sealed_segments()
+    assert len(segments) == len(RECORDS)
+    decoded = []
+    for path in segments:
+        with open(path, "rb") as f:
+            decoded.extend(decode(f.read()))
+    assert sorted(decoded, key=lambda r: r[2]) == RECORDS
@@ -0,0 +1,60 @@
+"""Benchmark the per-device filtering stage.
+
+Simulates N devices each sending readings one at a time (the normal ingest
+path) and as batch uploads, and prints the cost per sample.
+
+    python scripts/bench_filters.py --devices 1000 --samples 50 --batch 30
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+from filters import FilterBank  # noqa: E402
+
+
+def simulate(devices, samples, seed=0):
+    """Slowly draining bags with sensor noise and occasional knocks"""
+    rng = np.random.default_rng(seed)
+    start = rng.uniform(0.5, 1.0, size=(devices, 1))
+    drain = np.arange(samples) * 2e-5
+    readings = start - drain + rng.normal(0, 5e-4, size=(devices, samples))
+    spikes = rng.random((devices, samples)) < 0.01
+    readings[spikes] += rng.choice([-0.3, 0.3], size=spikes.sum())
+    return readings
+
+
+def bench(filters, readings, batch):
+    bank = FilterBank()
+    bank.default_config = {"filters": filters}
+
+    devices, samples = readings.shape
+    started = time.perf_counter()
+    for offset in range(0, samples, batch):
+        for device in range(devices):
+            bank.process(device, readings[device, offset:offset + batch])
+    elapsed = time.perf_counter() - started
+    return elapsed / (devices * samples) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--samples', type=int, default=60)
+    parser.add_argument('--batch', type=int, default=30, help='readings per batch upload')
+    args = parser.parse_args()
+
+    readings = simulate(args.devices, args.samples)
+    print(f'{args.devices} devices x {args.samples} samples')
+    print(f'{"filters":<24}{"single (us/sample)":>20}{"batch (us/sample)":>20}')
+    for filters in (["hampel"], ["median"], ["kalman"], ["hampel", "kalman"]):
+        single = bench(filters, readings, 1)
+        batched = bench(filters, readings, args.batch)
+        print(f'{"+".join(filters):<24}{single:>20.1f}{batched:>20.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,7 @@ CREATE TABLE IF NOT EXISTS patients (
     id VARCHAR(50) PRIMARY KEY,
     name VARCHAR(255) NOT NULL,
     room VARCHAR(10),
+    ward VARCHAR(50),
     admission_date DATE,
     current_drip_volume INTEGER DEFAULT 1000, -- in ml
     remaining_percentage FLOAT DEFAULT 100,
@@ -36,15 +37,48 @@ CREATE TABLE IF NOT EXISTS patients (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Databases created before wards were introduced
+ALTER TABLE patients ADD COLUMN IF NOT EXISTS ward VARCHAR(50);
+
+-- Set when the patient is discharged; their readings are archived later
+ALTER TABLE patients ADD COLUMN IF NOT EXISTS discharged_at TIMESTAMP;
+
 -- Weight data table for sensor readings
 CREATE TABLE IF NOT EXISTS weight_data (
     id SERIAL PRIMARY KEY,
     weight FLOAT NOT NULL,
     timestamp TIMESTAMP NOT NULL,
     patient_id VARCHAR(50) REFERENCES patients(id),
+    device_id VARCHAR(50),
+    seq BIGINT, -- (boot counter << 32) | reading counter, unique per device
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Databases created before devices sent sequence numbers
+ALTER TABLE weight_data ADD COLUMN IF NOT EXISTS device_id VARCHAR(50);
+ALTER TABLE weight_data ADD COLUMN IF NOT EXISTS seq BIGINT;
+
+-- Highest sequence accepted per device. Compression drops most readings, so
+-- weight_data alone cannot tell a restarted server which retries it has seen
+CREATE TABLE IF NOT EXISTS device_sequences (
+    device_id VARCHAR(50) PRIMARY KEY,
+    high_water_mark BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Archive files of discharged patients' readings (see backend/archive.py);
+-- paths are relative to the server's ARCHIVE_DIR
+CREATE TABLE IF NOT EXISTS weight_archive (
+    id SERIAL PRIMARY KEY,
+    patient_id VARCHAR(50) NOT NULL REFERENCES patients(id),
+    path TEXT NOT NULL UNIQUE,
+    first_timestamp TIMESTAMP NOT NULL,
+    last_timestamp TIMESTAMP NOT NULL,
+    row_count INTEGER NOT NULL,
+    bytes BIGINT NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Drip records table
 CREATE TABLE IF NOT EXISTS drip_records (
     id SERIAL PRIMARY KEY,
@@ -104,14 +138,19 @@ CREATE TABLE IF NOT EXISTS alerts (
     timestamp TIMESTAMP NOT NULL,
     read BOOLEAN DEFAULT FALSE,
     severity VARCHAR(20) DEFAULT 'info' CHECK (severity IN ('info', 'warning', 'critical')),
+    ward VARCHAR(50), -- the patient's ward when the alert was raised
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Databases created before alerts carried the ward: add it and fill it in
+ALTER TABLE alerts ADD COLUMN IF NOT EXISTS ward VARCHAR(50);
+UPDATE alerts a SET ward = p.ward FROM patients p WHERE p.id = a.patient_id AND a.ward IS NULL AND p.ward IS NOT NULL;
+
 -- Insert sample data
-INSERT INTO patients (id, name, room, admission_date, current_drip_volume) VALUES
-('P-123456', 'Taha Nasir', '101', '2025-02-15', 1000),
-('P-234567', 'Abdullah Farhat', '102', '2025-02-14', 1000),
-('P-345678', 'Abdullah Iqbal', '103', '2025-02-13', 1000)
+INSERT INTO patients (id, name, room, ward, admission_date, current_drip_volume) VALUES
+('P-123456', 'Taha Nasir', '101', 'Ward A', '2025-02-15', 1000),
+('P-234567', 'Abdullah Farhat', '102', 'Ward A', '2025-02-14', 1000),
+('P-345678', 'Abdullah Iqbal', '103', 'Ward A', '2025-02-13', 1000)
 ON CONFLICT (id) DO NOTHING;
 
 -- Insert sample drip records
@@ -124,9 +163,73 @@ ON CONFLICT DO NOTHING;
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_weight_data_timestamp ON weight_data(timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_weight_data_patient ON weight_data(patient_id);
+CREATE INDEX IF NOT EXISTS idx_weight_data_patient_time ON weight_data(patient_id, timestamp);
+-- Retried uploads: rows without a sequence (NULL) never conflict
+CREATE UNIQUE INDEX IF NOT EXISTS idx_weight_data_device_seq ON weight_data(device_id, seq);
 CREATE INDEX IF NOT EXISTS idx_drip_records_patient ON drip_records(patient_id);
+CREATE INDEX IF NOT EXISTS idx_weight_archive_patient_time ON weight_archive(patient_id, first_timestamp);
 CREATE INDEX IF NOT EXISTS idx_alerts_patient ON alerts(patient_id);
 CREATE INDEX IF NOT EXISTS idx_alerts_read ON alerts(read);
+CREATE INDEX IF NOT EXISTS idx_drip_records_active ON drip_records(patient_id) WHERE status = 'active';
+
+-- Keyset pagination: each listing filter has an index matching its sort order
+CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(name, id);
+CREATE INDEX IF NOT EXISTS idx_patients_ward_name ON patients(ward, name, id);
+CREATE INDEX IF NOT EXISTS idx_patients_status_name ON patients(status, name, id);
+CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_alerts_patient_timestamp ON alerts(patient_id, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_alerts_severity_timestamp ON alerts(severity, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_alerts_ward_timestamp ON alerts(ward, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_alerts_unread_timestamp ON alerts(timestamp DESC, id DESC) WHERE read = FALSE;
+CREATE INDEX IF NOT EXISTS idx_alerts_unread_patient_timestamp ON alerts(patient_id, timestamp DESC, id DESC) WHERE read = FALSE;
+CREATE INDEX IF NOT EXISTS idx_alerts_unread_ward_timestamp ON alerts(ward, timestamp DESC, id DESC) WHERE read = FALSE;
+
+-- Replace a patient's drip in one call: end the active drip record, start the
+-- new one, reset the patient and log the treatment. The patient row is locked
+-- first so concurrent replacements for the same bed run one after the other.
+-- The volume is NUMERIC so JSON volumes such as 500.0 are accepted; it is
+-- stored rounded to whole ml, as before.
+DROP FUNCTION IF EXISTS replace_patient_drip(VARCHAR, INTEGER, VARCHAR, TIMESTAMP, VARCHAR);
+CREATE OR REPLACE FUNCTION replace_patient_drip(
+    p_patient_id VARCHAR,
+    p_new_volume NUMERIC,
+    p_replaced_by VARCHAR,
+    p_replaced_at TIMESTAMP,
+    p_drip_type VARCHAR DEFAULT 'Insulin Drip'
+)
+RETURNS INTEGER AS $$
+DECLARE
+    v_new_drip_id INTEGER;
+    v_volume INTEGER := round(p_new_volume);
+BEGIN
+    PERFORM 1 FROM patients WHERE id = p_patient_id FOR UPDATE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Patient % not found', p_patient_id USING ERRCODE = 'no_data_found';
+    END IF;
+
+    UPDATE drip_records
+    SET status = 'replaced', end_time = p_replaced_at, replaced_by = p_replaced_by
+    WHERE patient_id = p_patient_id AND status = 'active';
+
+    INSERT INTO drip_records (patient_id, drip_type, volume_ml, start_time, administered_by)
+    VALUES (p_patient_id, p_drip_type, v_volume, p_replaced_at, p_replaced_by)
+    RETURNING id INTO v_new_drip_id;
+
+    UPDATE patients
+    SET current_drip_volume = v_volume, remaining_percentage = 100, status = 'normal', last_checked = p_replaced_at
+    WHERE id = p_patient_id;
+
+    INSERT INTO treatment_records (patient_id, treatment_type, timestamp, administered_by, notes)
+    VALUES (p_patient_id, 'Drip Replacement', p_replaced_at, p_replaced_by, 'Replaced with ' || v_volume || 'ml drip');
+
+    -- Delivered to every server node's event bus when the call commits
+    PERFORM pg_notify('caretrax_events', json_build_object(
+        'type', 'drip_replaced', 'patientId', p_patient_id, 'dripId', v_new_drip_id, 'volumeMl', v_volume
+    )::text);
+
+    RETURN v_new_drip_id;
+END;
+$$ LANGUAGE plpgsql;
 
 -- Create function to update timestamps
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -0,0 +1,396 @@
+"""Replay recorded weight readings against a running server.
+
+Reads weight_data rows from the database, or from a CSV/NDJSON file written
+by /api/export/weight, and sends them to POST / (one reading per request) or
+/api/weight/batch. Each device's readings go out in their recorded order and
+with their recorded gaps, at real time or --speed times faster (0 sends as
+fast as the server accepts them).
+
+    python scripts/replay.py trace.ndjson --speed 10
+    python scripts/replay.py --db --patient P-123456 --from 2024-05-01T08:00 --mode batch
+    python scripts/replay.py trace.csv --speed 0 --save-expect expected.json
+    python scripts/replay.py trace.csv --speed 0 --expect expected.json
+
+Afterwards the patients' status, remaining percentage, status transitions
+(from /stream) and alerts raised during the replay are read back and, with
+--expect, compared against a file saved by an earlier run with --save-expect.
+The exit status is 1 if anything differs.
+
+Stored weights are the compressed points, so a trace from weight_data holds
+only the readings needed to rebuild each curve; gaps between them are
+replayed as recorded. Only the standard library is needed unless --db is
+used (psycopg2). Replaying sequenced readings into the database they came
+from is rejected as duplicates; use --device-prefix or --no-seq for that.
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode
+
+REQUEST_TIMEOUT_S = 10
+
+# The server sends a keep-alive every 15 s and events only on changes, so the
+# stream read timeout must be longer than the keep-alive interval
+STREAM_TIMEOUT_S = 45
+STREAM_RETRY_S = 1
+
+
+def parse_reading(record):
+    """Normalise one exported row (CSV strings or NDJSON values)"""
+    seq = record.get('seq')
+    return {
+        "patient_id": record["patient_id"],
+        "device_id": record.get("device_id") or record["patient_id"],
+        "timestamp": datetime.fromisoformat(record["timestamp"]),
+        "weight": float(record["weight"]),
+        "seq": int(seq) if seq not in (None, '') else None,
+    }
+
+
+def load_file(path):
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            return [parse_reading(row) for row in csv.DictReader(f)]
+        return [parse_reading(json.loads(line)) for line in f if line.strip()]
+
+
+def load_db(patient_id, start, end):
+    import psycopg2
+
+    conditions, params = [], []
+    if patient_id:
+        conditions.append("patient_id = %s")
+        params.append(patient_id)
+    if start:
+        conditions.append("timestamp >= %s")
+        params.append(datetime.fromisoformat(start))
+    if end:
+        conditions.append("timestamp <= %s")
+        params.append(datetime.fromisoformat(end))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        database=os.getenv('DB_NAME', 'caretrax'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD', 'password'),
+        port=os.getenv('DB_PORT', '5432')
+    )
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT patient_id, device_id, timestamp, weight, seq FROM weight_data
+            {where}
+            ORDER BY timestamp, id
+        """, params)
+        return [
+            {"patient_id": row[0], "device_id": row[1] or row[0], "timestamp": row[2], "weight": row[3], "seq": row[4]}
+            for row in cursor.fetchall()
+        ]
+    finally:
+        conn.close()
+
+
+def plan(readings, mode, batch, speed, shift):
+    """Turn readings into requests: (due seconds after start, device, path, payload, count).
+
+    A batch is sent when its last reading was taken, as a device flushes its
+    buffer. Batches never mix boots, since the endpoint takes one per upload.
+    """
+    if not readings:
+        return []
+    t0 = readings[0]["timestamp"]
+
+    def due(reading):
+        return (reading["timestamp"] - t0).total_seconds() / speed if speed else 0
+
+    def split_seq(reading):
+        seq = reading["seq"]
+        return (None, None) if seq is None else (seq >> 32, seq & 0xFFFFFFFF)
+
+    requests = []
+    if mode == 'single':
+        for r in readings:
+            payload = {"patient_id": r["patient_id"], "device_id": r["device_id"], "weight": r["weight"]}
+            boot, counter = split_seq(r)
+            if counter is not None:
+                payload.update(boot=boot, seq=counter)
+            requests.append((due(r), r["device_id"], '/', payload, 1))
+        return requests
+
+    groups = {}
+
+    def flush(device_id):
+        group = groups.pop(device_id)
+        last = group["readings"][-1]
+        payload = {"patient_id": last["patient_id"], "device_id": device_id, "readings": [
+            dict({"timestamp": (r["timestamp"] + shift).isoformat(), "weight": r["weight"]},
+                 **({"seq": split_seq(r)[1]} if r["seq"] is not None else {}))
+            for r in group["readings"]
+        ]}
+        if group["boot"] is not None:
+            payload["boot"] = group["boot"]
+        requests.append((due(last), device_id, '/api/weight/batch', payload, len(group["readings"])))
+
+    for r in readings:
+        boot = split_seq(r)[0]
+        group = groups.get(r["device_id"])
+        if group and (group["boot"] != boot or group["readings"][-1]["patient_id"] != r["patient_id"]):
+            flush(r["device_id"])
+            group = None
+        if group is None:
+            group = groups[r["device_id"]] = {"boot": boot, "readings": []}
+        group["readings"].append(r)
+        if len(group["readings"]) >= batch:
+            flush(r["device_id"])
+    for device_id in list(groups):
+        flush(device_id)
+    requests.sort(key=lambda request: request[0])
+    return requests
+
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_S) as response:
+        return json.loads(response.read() or b'{}')
+
+
+def get(url):
+    with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT_S) as response:
+        return json.loads(response.read())
+
+
+def replay(base_url, requests, workers):
+    """Send the planned requests on time; returns one result dict per request.
+
+    Each device is pinned to one sender thread, so its requests stay in order
+    even when the server falls behind.
+    """
+    results = []
+    results_lock = threading.Lock()
+    queues = [queue.Queue() for _ in range(workers)]
+
+    def send(q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            due_at, path, payload, count = item
+            sent_at = time.monotonic()
+            result = {"due": due_at, "sent": sent_at, "count": count, "accepted": 0, "error": None}
+            try:
+                body = post(base_url + path, payload)
+                if path == '/':
+                    result["accepted"] = 1 if body.get("status") == "success" else 0
+                else:
+                    result["accepted"] = body.get("accepted", 0)
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                result["error"] = str(e)
+            result["done"] = time.monotonic()
+            with results_lock:
+                results.append(result)
+
+    threads = [threading.Thread(target=send, args=(q,), daemon=True) for q in queues]
+    for thread in threads:
+        thread.start()
+
+    started = time.monotonic()
+    for offset, device_id, path, payload, count in requests:
+        due_at = started + offset
+        delay = due_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        queues[zlib.crc32(device_id.encode()) % workers].put((due_at, path, payload, count))
+    for q in queues:
+        q.put(None)
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - started
+
+
+def watch_transitions(base_url, transitions, stop):
+    """Collect status events from /stream until stop is set, reconnecting if it drops"""
+    while not stop.is_set():
+        try:
+            with urllib.request.urlopen(base_url + '/stream', timeout=STREAM_TIMEOUT_S) as stream:
+                while not stop.is_set():
+                    line = stream.readline()
+                    if not line:
+                        break
+                    if line.startswith(b'data: '):
+                        event = json.loads(line[6:])
+                        if event.get('type') == 'status':
+                            transitions[event['patientId']].append(event['status'])
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            if stop.is_set():
+                return
+            print(f'warning: event stream dropped ({e}); reconnecting, transitions may be missed')
+        stop.wait(STREAM_RETRY_S)
+
+
+def observe(base_url, patient_ids, since, transitions):
+    """Read back the derived state for each replayed patient"""
+    observed = {}
+    for patient_id in patient_ids:
+        state = {"status_transitions": collapse(transitions.get(patient_id, []))}
+        try:
+            patient = get(f'{base_url}/api/patient/{quote(patient_id)}')
+            state["status"] = patient.get("status")
+            state["remaining_percentage"] = patient.get("remainingPercentage")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            state["status"] = state["remaining_percentage"] = None
+            print(f'warning: {patient_id}: {e}')
+
+        alerts = Counter()
+        cursor = None
+        try:
+            while True:
+                query = {"patient_id": patient_id, "limit": 500}
+                if cursor:
+                    query["cursor"] = cursor
+                with urllib.request.urlopen(f'{base_url}/api/alerts?{urlencode(query)}', timeout=REQUEST_TIMEOUT_S) as response:
+                    page = json.loads(response.read())
+                    cursor = response.headers.get('X-Next-Cursor')
+                recent = [alert for alert in page if datetime.fromisoformat(alert["timestamp"]) >= since]
+                alerts.update(alert["type"] for alert in recent)
+                if not cursor or len(recent) < len(page):
+                    break
+            state["alerts"] = dict(sorted(alerts.items()))
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            state["alerts"] = None
+            print(f'warning: {patient_id} alerts: {e}')
+        observed[patient_id] = state
+    return observed
+
+
+def collapse(statuses):
+    """Drop repeats, leaving only the changes"""
+    return [s for i, s in enumerate(statuses) if i == 0 or statuses[i - 1] != s]
+
+
+def compare(expected, observed, tolerance):
+    """List human-readable differences for the keys the expectation sets"""
+    problems = []
+    for patient_id, want in expected.items():
+        got = observed.get(patient_id)
+        if got is None:
+            problems.append(f'{patient_id}: not replayed')
+            continue
+        for key, value in want.items():
+            actual = got.get(key)
+            if key == 'remaining_percentage' and value is not None and actual is not None:
+                matches = abs(actual - value) <= tolerance
+            else:
+                matches = actual == value
+            if not matches:
+                problems.append(f'{patient_id}: {key} expected {value!r}, got {actual!r}')
+    return problems
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(results, elapsed, trace_seconds):
+    readings = sum(r["count"] for r in results)
+    accepted = sum(r["accepted"] for r in results)
+    errors = [r for r in results if r["error"]]
+    print(f'{len(results)} requests, {readings} readings in {elapsed:.1f}s '
+          f'({readings / elapsed if elapsed else 0:.1f} readings/s, '
+          f'{trace_seconds / elapsed if elapsed else 0:.1f}x recorded time)')
+    print(f'accepted {accepted}, duplicates {readings - accepted - sum(r["count"] for r in errors)}, '
+          f'failed requests {len(errors)}')
+    for r in errors[:5]:
+        print(f'  error: {r["error"]}')
+
+    done = [r for r in results if not r["error"]]
+    if done:
+        lag = [(r["done"] - r["due"]) * 1000 for r in done]
+        latency = [(r["done"] - r["sent"]) * 1000 for r in done]
+        for label, values in (('ingest lag (due -> acknowledged)', lag), ('request latency', latency)):
+            print(f'{label:<34} p50 {percentile(values, 0.5):8.1f} ms  p95 {percentile(values, 0.95):8.1f} ms  '
+                  f'p99 {percentile(values, 0.99):8.1f} ms  max {max(values):8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace', nargs='?', help='CSV or NDJSON export (omit with --db)')
+    parser.add_argument('--db', action='store_true', help='read weight_data from the database (DB_* env vars)')
+    parser.add_argument('--patient', help='with --db, only this patient')
+    parser.add_argument('--from', dest='start', help='with --db, ISO start time')
+    parser.add_argument('--to', dest='end', help='with --db, ISO end time')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--mode', choices=('single', 'batch'), default='single')
+    parser.add_argument('--batch', type=int, default=30, help='readings per batch upload')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = real time, 0 = as fast as possible')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent sender threads')
+    parser.add_argument('--device-prefix', default='', help='prepended to device ids')
+    parser.add_argument('--no-seq', action='store_true', help='send readings without sequence numbers')
+    parser.add_argument('--keep-timestamps', action='store_true',
+                        help='batch mode: send recorded timestamps instead of shifting them to now')
+    parser.add_argument('--settle', type=float, default=2.0, help='seconds to wait for events after the last request')
+    parser.add_argument('--expect', help='JSON file of expected per-patient state')
+    parser.add_argument('--save-expect', help='write the observed per-patient state here')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='remaining percentage tolerance (points)')
+    args = parser.parse_args()
+
+    if args.db == bool(args.trace):
+        parser.error('give either a trace file or --db')
+    readings = load_db(args.patient, args.start, args.end) if args.db else load_file(args.trace)
+    if not readings:
+        print('nothing to replay')
+        return 0
+    readings.sort(key=lambda r: (r["timestamp"], r["device_id"], r["seq"] or 0))
+    for r in readings:
+        r["device_id"] = args.device_prefix + r["device_id"]
+        if args.no_seq:
+            r["seq"] = None
+
+    base_url = args.url.rstrip('/')
+    since = datetime.now()
+    shift = timedelta(0) if args.keep_timestamps else since - readings[0]["timestamp"]
+    requests = plan(readings, args.mode, args.batch, args.speed, shift)
+    trace_seconds = (readings[-1]["timestamp"] - readings[0]["timestamp"]).total_seconds()
+    patient_ids = sorted({r["patient_id"] for r in readings})
+    print(f'replaying {len(readings)} readings for {len(patient_ids)} patient(s), '
+          f'{trace_seconds:.0f}s recorded, mode {args.mode}, speed {args.speed or "max"}')
+
+    transitions = defaultdict(list)
+    stop = threading.Event()
+    threading.Thread(target=watch_transitions, args=(base_url, transitions, stop), daemon=True).start()
+    time.sleep(0.2)     # let the stream connect before the first reading
+
+    results, elapsed = replay(base_url, requests, args.workers)
+    time.sleep(args.settle)
+    stop.set()
+    report(results, elapsed, trace_seconds)
+
+    observed = observe(base_url, patient_ids, since, transitions)
+    if args.save_expect:
+        with open(args.save_expect, 'w') as f:
+            json.dump(observed, f, indent=2, sort_keys=True)
+        print(f'saved observed state to {args.save_expect}')
+    if args.expect:
+        with open(args.expect) as f:
+            problems = compare(json.load(f), observed, args.tolerance)
+        for problem in problems:
+            print(f'MISMATCH {problem}')
+        print('derived state matches' if not problems else f'{len(problems)} mismatch(es)')
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
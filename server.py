@@ -1,9 +1,16 @@
 import json
 import os
 import socket
+import sys
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from async_log import AsyncLog  # noqa: E402
+
+# Per-reading lines go through a queue so a slow stdout never holds up a scale
+log = AsyncLog.from_env()
+
 # Store the latest weight data
 latest_weight = {"weight": 0, "timestamp": datetime.now().isoformat()}
 
@@ -21,7 +28,9 @@ class RequestHandler(BaseHTTPRequestHandler):
                 "timestamp": datetime.now().isoformat()
             }
             
-            print(f"📊 Received weight: {latest_weight['weight']} KG at {latest_weight['timestamp']}")
+            log.event('reading', "📊 Received weight: {weight} KG at {time}",
+                      device=data.get("device_id"), readings=1,
+                      weight=latest_weight["weight"], time=latest_weight["timestamp"])
             
             self.send_response(200)
             self.send_header('Content-Type', 'application/json')
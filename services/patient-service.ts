@@ -8,6 +8,34 @@ interface Patient {
   currentDripVolume: number
 }
 
+interface WardOverviewPatient {
+  id: string
+  name: string
+  room: string
+  status: string
+  remainingPercentage: number
+  currentDripVolume: number
+  weight: number | null
+  weightTimestamp: string | null
+  lastChecked: string | null
+  activeDrip: {
+    id: number
+    type: string
+    volumeMl: number
+    startTime: string
+    administeredBy: string
+  } | null
+  secondsToEmpty: number | null
+  estimatedEmptyAt: string | null
+  unreadAlerts: number
+}
+
+interface WardOverview {
+  ward: string | null
+  generatedAt: string
+  patients: WardOverviewPatient[]
+}
+
 class PatientService {
   private baseUrl = "http://10.20.9.189:8000/api" // Update with your server URL
 
@@ -37,6 +65,22 @@ class PatientService {
     }
   }
 
+  // One request per refresh: live weight, active drip, time-to-empty and
+  // unread alert count for every patient on the ward
+  async getWardOverview(ward?: string): Promise<WardOverview | null> {
+    try {
+      const query = ward ? `?ward=${encodeURIComponent(ward)}` : ""
+      const response = await fetch(`${this.baseUrl}/ward/overview${query}`)
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`)
+      }
+      return await response.json()
+    } catch (error) {
+      console.error("Error fetching ward overview:", error)
+      return null
+    }
+  }
+
   async replaceDrip(patientId: string, newVolume: number, replacedBy: string): Promise<boolean> {
     try {
       const response = await fetch(`${this.baseUrl}/drip-replacement`, {